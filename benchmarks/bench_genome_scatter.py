@@ -0,0 +1,65 @@
+"""
+Benchmark of the Genome Scatter restyle: a colour, label or marker change patches a copy of the cached figure with
+style_genome_comparison_scatter instead of rebuilding it. Checks the styled figure against a figure built with the
+titles and style directly.
+Run from the repository root: python benchmarks/bench_genome_scatter.py [n_sites]
+"""
+import pathlib
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1].joinpath('pimms_dash')))
+
+from figure_cache import copy_figure  # noqa: E402
+from figures import genome_comparison_scatter, style_genome_comparison_scatter  # noqa: E402
+from utils import InsertionIndex, InsertionPyramid, downsample_inserts  # noqa: E402
+
+STYLE = dict(color_control="#ff7f0e", color_test="#1f77b4", control_title="Insertions Across Control Phenotype",
+             test_title="Insertions Across Test Phenotype", marker_size=6, marker_line_width=0.5)
+
+
+def make_inserts(n_sites, seed):
+    rng = np.random.default_rng(seed)
+    positions = np.unique(rng.integers(0, 5_000_000, n_sites))
+    index = InsertionIndex(pd.DataFrame({"position": positions, "count": rng.integers(1, 500, len(positions))}))
+    return downsample_inserts(index, InsertionPyramid.from_index(index))[:2]
+
+
+def build(inserts):
+    """ As the Genome Scatter tab, with placeholder titles"""
+    fig = genome_comparison_scatter(inserts[0], inserts[1], "Control", "Test")
+    fig.update_layout(height=700)
+    return fig
+
+
+def best_of(func, repeat=5):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main(n_sites=200000):
+    inserts = [make_inserts(n_sites, seed) for seed in (0, 1)]
+    cached = build(inserts).to_plotly_json()
+
+    fig = style_genome_comparison_scatter(copy_figure(cached), **STYLE, log=True)
+    expected = genome_comparison_scatter(inserts[0], inserts[1], STYLE["control_title"],
+                                         STYLE["test_title"]).to_plotly_json()
+    assert fig["layout"]["annotations"] == expected["layout"]["annotations"]
+    for trace, color in zip(fig["data"], [STYLE["color_control"], STYLE["color_test"]]):
+        assert trace["marker"]["color"] == color and trace["marker"]["size"] == STYLE["marker_size"]
+        assert trace["marker"]["line"]["width"] == STYLE["marker_line_width"]
+    assert fig["layout"]["yaxis"]["type"] == fig["layout"]["yaxis2"]["type"] == "log"
+    # The cached figure is left as built
+    assert cached["layout"]["annotations"][0]["text"] == "Control" and "color" not in cached["data"][0]["marker"]
+
+    rebuild = best_of(lambda: style_genome_comparison_scatter(build(inserts).to_plotly_json(), **STYLE))
+    restyle = best_of(lambda: style_genome_comparison_scatter(copy_figure(cached), **STYLE))
+    print(f"{n_sites} sites, {sum(len(x) for x, _ in inserts)} points")
+    print(f"rebuild {rebuild * 1000:8.2f} ms   restyle {restyle * 1000:8.2f} ms   speedup {rebuild / restyle:6.1f}x")
+    assert restyle < rebuild, "restyling the cached figure is not faster than rebuilding it"
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
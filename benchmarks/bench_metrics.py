@@ -0,0 +1,80 @@
+"""
+Microbenchmark of the vectorised comparison metrics against the previous row-wise implementations.
+Run from the repository root: python benchmarks/bench_metrics.py [n_loci]
+"""
+import pathlib
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1].joinpath('pimms_dash')))
+
+from utils import assign_sets, fold_change_comparision, log2_fold_change  # noqa: E402
+
+
+def rowwise_fold_change_comparision(series_a, series_b):
+    """ Previous implementation, one python log2_fold_change call per locus"""
+    df = pd.concat([series_a, series_b], axis=1)
+    return df.apply(lambda row: log2_fold_change(row[series_a.name], row[series_b.name]), axis=1)
+
+
+def rowwise_assign_set(df):
+    """ Previous venn set assignment, one python call per locus"""
+    def assign_set(a, b):
+        if a and b:
+            return "AB"
+        elif a and not b:
+            return "Ab"
+        elif b and not a:
+            return "aB"
+        else:
+            return np.nan
+    return df.apply(lambda row: assign_set(row["a"], row["b"]), axis=1)
+
+
+def make_data(n_loci, seed=0):
+    rng = np.random.default_rng(seed)
+    # NIM scores with a realistic share of zero and missing values
+    test = rng.gamma(0.5, 200, n_loci)
+    control = rng.gamma(0.5, 200, n_loci)
+    test[rng.random(n_loci) < 0.2] = 0
+    control[rng.random(n_loci) < 0.2] = 0
+    control[rng.random(n_loci) < 0.01] = np.nan
+    return pd.Series(test, name="test_NIM_score"), pd.Series(control, name="control_NIM_score")
+
+
+def best_of(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main(n_loci=100000):
+    series_test, series_control = make_data(n_loci)
+    masks = pd.DataFrame({"a": series_test <= 10, "b": series_control <= 10})
+
+    expected = rowwise_fold_change_comparision(series_test, series_control)
+    result = fold_change_comparision(series_test, series_control)
+    pd.testing.assert_series_equal(result, expected.astype(float), check_names=False)
+    assert (pd.Series(assign_sets(masks["a"], masks["b"])).fillna("-") ==
+            rowwise_assign_set(masks).fillna("-")).all()
+
+    timings = {
+        "fold_change": (
+            best_of(lambda: rowwise_fold_change_comparision(series_test, series_control), repeat=1),
+            best_of(lambda: fold_change_comparision(series_test, series_control)),
+        ),
+        "assign_sets": (
+            best_of(lambda: rowwise_assign_set(masks), repeat=1),
+            best_of(lambda: assign_sets(masks["a"], masks["b"])),
+        ),
+    }
+    print(f"{n_loci} loci")
+    for name, (rowwise, vectorised) in timings.items():
+        print(f"{name:<12} row-wise {rowwise * 1000:10.1f} ms   vectorised {vectorised * 1000:8.2f} ms   "
+              f"speedup {rowwise / vectorised:8.1f}x")
+        assert vectorised < rowwise, f"vectorised {name} is not faster than the row-wise implementation"
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,120 @@
+"""
+Benchmark of the NIM Comparison figure, built from numpy arrays, against the previous list comprehension trace
+builders. Times the server side work of the tab: windowing the loci to NIM_MAX_LOCI, building the linked figure and
+serialising it to json, as the tab does for any view. The full resolution figure is timed for reference.
+Run from the repository root: python benchmarks/bench_nim_comparison.py [n_loci]
+"""
+import json
+import pathlib
+import sys
+import timeit
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1].joinpath('pimms_dash')))
+
+import plotly  # noqa: E402
+
+from app import NIM_MAX_LOCI  # noqa: E402
+from figures import NIM_comparison_bar_gl, NIM_comparison_heatmap, NIM_comparison_linked  # noqa: E402
+from utils import LocusIndex, window_loci  # noqa: E402
+
+# Server time budget of the NIM Comparison tab for 100k loci, in seconds. The tab never draws more than
+# NIM_MAX_LOCI loci, the full resolution figure is not held to the budget.
+BUDGET_100K = 1.0
+
+
+def listwise_bar_points(series_control, series_test, start_positions, end_positions, locus_tags):
+    """ Previous bar point construction, python lists with a string per point"""
+    x_points = [item for x in zip(start_positions, end_positions) for item in [x[0], x[0], x[1], x[1]]]
+    y_points_test = [item for x in series_test.to_list() for item in [0, x, x, 0]]
+    y_points_control = [item for x in series_control.to_list() for item in [0, -x, -x, 0]]
+    locus_labels = [item for x in locus_tags.to_list() for item in ["", x, x, ""]]
+    text_test = [str(abs(y)) for y in y_points_test]
+    text_control = [str(abs(y)) for y in y_points_control]
+    return x_points, y_points_test, y_points_control, locus_labels, text_test, text_control
+
+
+def listwise_heatmap_points(series_control, series_test, start_positions, end_positions, locus_tags):
+    """ Previous heatmap construction, zipped python lists"""
+    x_points = [item for x in zip(start_positions.to_list(), end_positions.to_list()) for item in x]
+    z_values = np.array([series_test.to_list(), series_control.to_list()])
+    z_values = np.dstack((z_values, np.zeros_like(z_values))).reshape(z_values.shape[0], -1)[:, :-1]
+    labels = [j for i in zip(locus_tags, [""] * len(locus_tags)) for j in i][:-1]
+    return x_points, z_values, np.array([labels, labels])
+
+
+def make_data(n_loci, seed=0):
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(300, 3000, n_loci)
+    starts = np.cumsum(lengths + rng.integers(10, 200, n_loci))
+    return pd.DataFrame({
+        "start": starts,
+        "end": starts + lengths,
+        "locus_tag": [f"LOCUS_{i:06d}" for i in range(n_loci)],
+        "test_NIM_score": rng.gamma(0.5, 200, n_loci),
+        "control_NIM_score": rng.gamma(0.5, 200, n_loci),
+    })
+
+
+def best_of(func, repeat=3):
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main(n_loci=100000):
+    df = make_data(n_loci)
+    args = (df["control_NIM_score"], df["test_NIM_score"], df["start"], df["end"], df["locus_tag"])
+
+    # Array builders produce the same points as the list builders, hover labels are sent once per bar
+    x_points, y_test, y_control, locus_labels, _, _ = listwise_bar_points(*args)
+    t1, t2, h1, h2 = NIM_comparison_bar_gl(*args, "Test", "Control", get_trace=True)
+    assert np.array_equal(t1.x, x_points) and np.array_equal(t1.y, y_test) and np.array_equal(t2.y, y_control)
+    assert list(h1.text) == locus_labels[1::4] and np.array_equal(h2.customdata[:, 0], np.abs(y_control[1::4]))
+    x_points, z_values, labels = listwise_heatmap_points(*args)
+    h1, _ = NIM_comparison_heatmap(*args, "Test", "Control", get_trace=True)
+    assert np.array_equal(h1.x, x_points) and np.array_equal(h1.z, z_values)
+    assert np.array_equal(h1.customdata, labels)
+
+    def render(args):
+        fig = NIM_comparison_linked(*args, title="NIM Score Across Genome", color_test="#1f77b4",
+                                    color_control="#ff7f0e", test_label="Test", control_label="Control")
+        # As the tab: figure_cache holds the plotly json dict, dash serialises it with the plotly encoder
+        return json.dumps(fig.to_plotly_json(), cls=plotly.utils.PlotlyJSONEncoder)
+
+    pimms_df = SimpleNamespace(get_data=lambda: df)
+    locus_index = LocusIndex.from_pimms(pimms_df)
+
+    def render_view():
+        scores, starts, ends, labels, _ = window_loci(pimms_df, locus_index, ["test_NIM_score", "control_NIM_score"])
+        return render((scores["control_NIM_score"], scores["test_NIM_score"], starts, ends, labels))
+
+    timings = {
+        "bar points": (
+            best_of(lambda: listwise_bar_points(*args), repeat=1),
+            best_of(lambda: NIM_comparison_bar_gl(*args, "Test", "Control", get_trace=True)),
+        ),
+        "heatmap points": (
+            best_of(lambda: listwise_heatmap_points(*args), repeat=1),
+            best_of(lambda: NIM_comparison_heatmap(*args, "Test", "Control", get_trace=True)),
+        ),
+    }
+    print(f"{n_loci} loci")
+    for name, (listwise, vectorised) in timings.items():
+        print(f"{name:<15} list-wise {listwise * 1000:10.1f} ms   vectorised {vectorised * 1000:8.2f} ms   "
+              f"speedup {listwise / vectorised:8.1f}x")
+        assert vectorised < listwise, f"vectorised {name} is not faster than the list-wise implementation"
+
+    scale = max(n_loci / 100000, 1)
+    full_time = best_of(lambda: render(args), repeat=1)
+    print(f"{'full figure':<15} build and json {full_time * 1000:10.1f} ms (reference, not drawn by the tab)")
+
+    view_time = best_of(render_view)
+    print(f"{'tab view':<15} window, build and json {view_time * 1000:8.1f} ms ({NIM_MAX_LOCI} loci at most)")
+    assert view_time < BUDGET_100K * scale, \
+        f"NIM Comparison view took {view_time:.2f} s, budget {BUDGET_100K * scale:.2f} s"
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,53 @@
+"""
+Check of the session sweeper quotas with bundles: one bundle opened in two sessions is hard linked into both, its
+files are not charged to either session, so neither is removed for the per session or total quota. A session with
+its own data over the quota still is.
+Run from the repository root: python benchmarks/check_session_quota.py
+"""
+import pathlib
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1].joinpath('pimms_dash')))
+
+import bundle  # noqa: E402
+import utils  # noqa: E402
+from session_gc import SessionSweeper  # noqa: E402
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        # Sessions of this check only, the sweeper must not see the sessions of the app
+        utils.SESSION_DATA_PATH = tmp.joinpath("session_data")
+
+        frame = pd.DataFrame({"score": np.random.default_rng(0).random(1_000_000)})
+        bundle_dir = tmp.joinpath("bundles", "shared")
+        bundle.write_bundle(bundle_dir, {"pimms": True, "control-run": True}, {"pimms_df": frame})
+        bundle_bytes = sum(f.stat().st_size for f in bundle_dir.iterdir())
+
+        shared = [str(uuid.uuid4()) for _ in range(2)]
+        for session_id in shared:
+            bundle.open_bundle(bundle_dir, session_id)
+        own = str(uuid.uuid4())
+        utils.store_data(frame, "pimms_df", own)
+
+        # Each quota is below the bundle size, the sessions are idle
+        sweeper = SessionSweeper(utils.SESSION_DATA_PATH, ttl=3600, session_max_bytes=bundle_bytes // 2,
+                                 total_max_bytes=bundle_bytes // 2, interval=60, idle=60)
+        sizes = {session["session_id"]: session["bytes"] for session in sweeper.sessions()}
+        assert all(sizes[session_id] < bundle_bytes // 2 for session_id in shared), sizes
+        stats = sweeper.sweep(now=time.time() + 120)
+        remaining = {session["session_id"] for session in sweeper.sessions()}
+        assert remaining == set(shared), f"sessions left {remaining}, sweep {stats}"
+        assert stats["removed"] == {"expired": 0, "session_quota": 1, "total_quota": 0}, stats
+        print(f"bundle {bundle_bytes} bytes, shared sessions charged {[sizes[s] for s in shared]} bytes, kept")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Import time report for the dashboard start up. Imports the app in a fresh interpreter with python -X importtime and
+prints the import time per package, exiting non-zero when the total exceeds a budget or when a module that should
+load on first use (R, matplotlib, dash_bio) was imported at start up. Intended to run in CI.
+Run from the repository root: python benchmarks/startup_report.py [--budget 5] [--module index]
+"""
+import argparse
+import collections
+import pathlib
+import re
+import subprocess
+import sys
+
+APP_DIR = pathlib.Path(__file__).resolve().parents[1].joinpath('pimms_dash')
+# Loaded on first use, never at start up
+DEFERRED_MODULES = ['rpy2', 'matplotlib', 'matplotlib_venn', 'dash_bio']
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(?P<self>\d+) \|\s+(?P<cumulative>\d+) \|(?P<indent>\s+)(?P<module>\S+)$")
+
+
+def import_times(module):
+    """
+    Import module in a fresh interpreter with -X importtime.
+    :return: list of (module name, self seconds, cumulative seconds, nesting depth)
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=APP_DIR,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    times = []
+    other_output = []
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            times.append((match.group('module'), int(match.group('self')) / 1e6,
+                          int(match.group('cumulative')) / 1e6, (len(match.group('indent')) - 1) // 2))
+        elif not line.startswith('import time:'):
+            other_output.append(line)
+    if process.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n' + '\n'.join(other_output))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report dashboard import time per package')
+    parser.add_argument('--module', default='index', help='module to import, from pimms_dash')
+    parser.add_argument('--budget', type=float, default=None, help='fail if the total import time exceeds this, s')
+    parser.add_argument('--top', type=int, default=20, help='packages to list')
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total = sum(cumulative for name, self_time, cumulative, depth in times if depth == 0)
+
+    # Self time summed per top level package
+    per_package = collections.Counter()
+    for name, self_time, cumulative, depth in times:
+        per_package[name.split('.')[0]] += self_time
+
+    print(f'import {args.module}: {total:.3f}s total')
+    print(f'{"package":<30} {"seconds":>8} {"share":>7}')
+    for package, seconds in per_package.most_common(args.top):
+        print(f'{package:<30} {seconds:>8.3f} {seconds / total:>7.1%}')
+
+    failures = []
+    imported = {name.split('.')[0] for name, self_time, cumulative, depth in times}
+    for module in DEFERRED_MODULES:
+        if module in imported:
+            failures.append(f'{module} imported at start up, it should load on first use')
+    if args.budget is not None and total > args.budget:
+        failures.append(f'start up import time {total:.3f}s exceeds the {args.budget:.3f}s budget')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
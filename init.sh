@@ -4,4 +4,4 @@ set -e
 echo "Starting SSH ..."
 service ssh start
 
-python3 index.py
\ No newline at end of file
+python3 serve.py
\ No newline at end of file
@@ -1,4 +1,5 @@
 import logging
+import os
 import pathlib
 
 import dash_bootstrap_components as dbc
@@ -18,6 +19,53 @@ logging.basicConfig(level=logging.INFO)
 BASE_PATH = pathlib.Path(__file__).parent.resolve()
 DATA_PATH = BASE_PATH.joinpath('data').resolve()
 TESTDATA_PATH = DATA_PATH.joinpath('example_data').resolve()
+SESSION_DATA_PATH = DATA_PATH.joinpath('session_data')
+
+# Session storage backend, one of storage.SESSION_STORES
+SESSION_STORE = os.environ.get('PIMMS_SESSION_STORE', 'feather')
+# Per worker memory budget for deserialised session datasets held by utils.session_cache
+SESSION_CACHE_MAX_BYTES = int(os.environ.get('PIMMS_SESSION_CACHE_MAX_BYTES', 512 * 1024**2))
+# Session garbage collection, see session_gc. Sessions unused for SESSION_TTL seconds are removed. Sessions larger than
+# SESSION_MAX_BYTES, and least recently used sessions while all sessions exceed SESSIONS_MAX_BYTES, are removed once
+# unused for SESSION_IDLE seconds, so a session in use is never removed for its size
+SESSION_TTL = float(os.environ.get('PIMMS_SESSION_TTL', 60 * 60))
+SESSION_IDLE = float(os.environ.get('PIMMS_SESSION_IDLE', 10 * 60))
+SESSION_MAX_BYTES = int(os.environ.get('PIMMS_SESSION_MAX_BYTES', 2 * 1024**3))
+SESSIONS_MAX_BYTES = int(os.environ.get('PIMMS_SESSIONS_MAX_BYTES', 20 * 1024**3))
+SESSION_SWEEP_INTERVAL = float(os.environ.get('PIMMS_SESSION_SWEEP_INTERVAL', 5 * 60))
+
+# DESeq2 worker pool of each job process, so JOB_WORKERS * DESEQ_WORKERS R processes in total. A job runs one DESeq2
+# at a time, a second worker only keeps a warm replacement for a worker killed by a cancel or timeout. 0 runs DESeq2
+# inside the job process, where it can not be cancelled
+DESEQ_SCRIPT_PATH = BASE_PATH.joinpath('DESeq2_process.R')
+DESEQ_WORKERS = int(os.environ.get('PIMMS_DESEQ_WORKERS', 1))
+DESEQ_TIMEOUT = float(os.environ.get('PIMMS_DESEQ_TIMEOUT', 600))
+DESEQ_MAX_JOBS_PER_WORKER = int(os.environ.get('PIMMS_DESEQ_MAX_JOBS_PER_WORKER', 50))
+# DESeq2 results cache shared by all sessions
+DESEQ_CACHE_PATH = DATA_PATH.joinpath('deseq_cache')
+DESEQ_CACHE_MAX_BYTES = int(os.environ.get('PIMMS_DESEQ_CACHE_MAX_BYTES', 1024**3))
+
+# Largest file accepted by the upload box, checked in the browser and again before decoding
+MAX_UPLOAD_BYTES = int(os.environ.get('PIMMS_MAX_UPLOAD_BYTES', 500 * 1024**2))
+
+# Processes running "Run Selection" jobs in the background
+JOB_WORKERS = int(os.environ.get('PIMMS_JOB_WORKERS', 2))
+
+# Genome scatter level of detail. Points drawn per trace, insertion sites are binned when a view holds more
+SCATTER_MAX_POINTS = int(os.environ.get('PIMMS_SCATTER_MAX_POINTS', 5000))
+# Bin width in bases of the finest level of the insertion count pyramids, each level up doubles the width
+LOD_BASE_BIN_WIDTH = int(os.environ.get('PIMMS_LOD_BASE_BIN_WIDTH', 32))
+# NIM Comparison loci drawn per view, the visible range is summarised in this many windows when it holds more
+NIM_MAX_LOCI = int(os.environ.get('PIMMS_NIM_MAX_LOCI', 5000))
+
+# Per worker memory budget for the figures and venn sets held by figure_cache, reused while only styling changes
+FIGURE_CACHE_MAX_BYTES = int(os.environ.get('PIMMS_FIGURE_CACHE_MAX_BYTES', 256 * 1024**2))
+
+# Venn diagram images kept per worker, keyed by subset sizes, colours and labels
+VENN_CACHE_SIZE = int(os.environ.get('PIMMS_VENN_CACHE_SIZE', 256))
+
+# Precomputed project bundles listed in the control panel, see bundle.py
+BUNDLE_PATH = pathlib.Path(os.environ.get('PIMMS_BUNDLE_PATH', DATA_PATH.joinpath('bundles')))
 
 # Plotly standard graph format
 plotly_template = 'simple_white'
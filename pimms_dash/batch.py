@@ -0,0 +1,224 @@
+"""
+Batch command line. Runs the "Run Selection" pipeline for the experiments of a manifest without the web UI, in
+parallel on a process pool, and writes the tables of each experiment to an output directory.
+
+The manifest is a csv with a row per experiment and the columns name, control, test, control_gff and test_gff.
+Paths are relative to the manifest. The gff columns may be empty and a row without a test file is a control run.
+
+Each experiment writes to <out>/<name>/:
+    merged            merged PIMMS table with the comparison metrics
+    deseq             DESeq2 results per locus, when DESeq2 ran
+    pca               DESeq2 PCA of the mutant pools, when DESeq2 ran
+    venn_sets         venn set membership per locus for --venn-threshold and --venn-percentiles
+    gene_insert_stats inserts per locus and condition, when coordinate gffs are given
+    run_status.json   run status, the errors of failed steps, PCA axis labels and timings
+
+With --bundle-dir each experiment is also written as a project bundle to <bundle-dir>/<name>/, which the dashboard
+opens without rerunning the pipeline when bundle-dir is its bundle directory, see bundle.py.
+
+Usage:
+    python batch.py manifest.csv --out results [--format csv|xlsx|feather|parquet] [--workers 2] [--no-deseq]
+                    [--bundle-dir ../data/bundles]
+"""
+import argparse
+import logging
+import pathlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather, parquet
+
+import bundle
+import pipeline
+import storage
+from utils import assign_sets
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_COLUMNS = ["name", "control", "test", "control_gff", "test_gff"]
+
+
+def _write_arrow(write):
+    def writer(frame, path):
+        storage.atomic_write(path, lambda fh: write(pa.Table.from_pandas(frame, preserve_index=None), fh), mode="wb")
+    return writer
+
+
+# Output format to file suffix and writer(frame, path)
+TABLE_WRITERS = {
+    "csv": (".csv", lambda frame, path: storage.atomic_write(path, lambda fh: frame.to_csv(fh))),
+    "xlsx": (".xlsx", lambda frame, path: storage.atomic_write(path, lambda fh: frame.to_excel(fh), mode="wb")),
+    "feather": (".feather", _write_arrow(lambda table, fh: feather.write_feather(table, fh))),
+    "parquet": (".parquet", _write_arrow(lambda table, fh: parquet.write_table(table, fh))),
+}
+
+
+class BatchJob:
+    """ Stand in for jobs.JobContext, logs the stages of an experiment."""
+    def __init__(self, name):
+        self.name = name
+
+    def stage(self, name):
+        logger.info(f"{self.name}: {name}")
+
+
+def read_manifest(path):
+    """
+    Read a batch manifest. Raises ValueError for missing columns and for experiment names that are not unique or
+    not usable as a directory name, see bundle.check_name.
+    :param path: path to manifest csv
+    :return: list of experiment dicts with name and absolute control, test, control_gff and test_gff pathlib.Path
+    objects or None
+    """
+    path = pathlib.Path(path)
+    manifest = pd.read_csv(path, dtype=str, keep_default_na=False)
+    missing = [col for col in ["name", "control"] if col not in manifest.columns]
+    if missing:
+        raise ValueError(f"Manifest {path} is missing the columns {', '.join(missing)}")
+    # Names are output directory and bundle names
+    names = manifest["name"].str.strip()
+    for name in names:
+        bundle.check_name(name, kind="experiment")
+    duplicated = names[names.duplicated()].unique()
+    if len(duplicated):
+        raise ValueError(f"Experiment names are not unique: {', '.join(duplicated)}")
+    experiments = []
+    for name, row in zip(names, manifest.to_dict("records")):
+        experiment = {"name": name}
+        for col in MANIFEST_COLUMNS[1:]:
+            value = row.get(col, "").strip()
+            experiment[col] = path.parent.joinpath(value).resolve() if value else None
+        experiments.append(experiment)
+    return experiments
+
+
+def experiment_tables(results, venn_threshold=0, venn_percentiles=(0, 100)):
+    """
+    Output tables of an experiment from the results of pipeline.build_selection.
+    :return: dict of table name to dataframe
+    """
+    tables = {}
+    pimms_df = results.get("pimms_df")
+    if pimms_df is None:
+        return tables
+    data = pimms_df.get_data()
+    tables["merged"] = data
+    deseq_cols = [col for col in data.columns if col.startswith("deseq_")]
+    if deseq_cols:
+        tables["deseq"] = data[["locus_tag"] + deseq_cols]
+    if pimms_df.pca_dict:
+        tables["pca"] = pd.DataFrame.from_dict(pimms_df.pca_dict, orient="index")
+    if "venn_index" in results:
+        masks = results["venn_index"].membership(venn_threshold, *venn_percentiles)
+        tables["venn_sets"] = pd.DataFrame({
+            "locus_tag": data["locus_tag"].to_numpy(),
+            "in_control": masks["control"],
+            "in_test": masks["test"],
+            "set": assign_sets(masks["control"], masks["test"]),
+        }, index=data.index)
+    if "gene_insert_stats" in results:
+        tables["gene_insert_stats"] = results["gene_insert_stats"]
+    return tables
+
+
+def run_experiment(experiment, out_dir, table_format="csv", run_deseq=True, deseq_filtering=True, venn_threshold=0,
+                   venn_percentiles=(0, 100), bundle_dir=None):
+    """
+    Run the pipeline for one experiment and write its tables. Process pool entry point.
+    :param experiment: experiment dict from read_manifest
+    :param out_dir: output directory, the tables are written to a sub directory named after the experiment
+    :param table_format: key of TABLE_WRITERS
+    :param bundle_dir: optional directory to also write a project bundle of the run to, named after the experiment
+    :return: run status dict with the experiment name, output directory, tables written and elapsed seconds
+    """
+    started = time.time()
+    run_status, results = pipeline.build_selection(
+        BatchJob(experiment["name"]), control_path=experiment["control"], test_path=experiment["test"],
+        control_gff_path=experiment["control_gff"], test_gff_path=experiment["test_gff"], run_deseq=run_deseq,
+        deseq_filtering=deseq_filtering, control_run=experiment["test"] is None)
+
+    experiment_dir = pathlib.Path(out_dir).joinpath(experiment["name"])
+    experiment_dir.mkdir(parents=True, exist_ok=True)
+    suffix, write = TABLE_WRITERS[table_format]
+    tables = experiment_tables(results, venn_threshold, venn_percentiles)
+    for name, frame in tables.items():
+        write(frame, experiment_dir.joinpath(name + suffix))
+    bundle_path = None
+    if bundle_dir is not None and run_status["pimms"]:
+        bundle_path = pathlib.Path(bundle_dir).joinpath(bundle.check_name(experiment["name"]))
+        sources = {col: str(experiment[col]) if experiment[col] else None for col in MANIFEST_COLUMNS[1:]}
+        bundle.write_bundle(bundle_path, run_status, results, sources=sources)
+
+    pimms_df = results.get("pimms_df")
+    summary = dict(run_status, name=experiment["name"], out_dir=str(experiment_dir), tables=list(tables),
+                   bundle=str(bundle_path) if bundle_path else None,
+                   pca_labels=pimms_df.pca_labels if pimms_df is not None else {},
+                   seconds=round(time.time() - started, 2))
+    storage.write_json(experiment_dir.joinpath("run_status.json"), summary)
+    return summary
+
+
+def run_batch(experiments, out_dir, workers=2, run_deseq=True, **kwargs):
+    """
+    Run experiments on a process pool, each process runs one experiment at a time with its own DESeq2 worker.
+    :param experiments: experiment dicts from read_manifest
+    :param out_dir: output directory
+    :param workers: number of processes
+    :param kwargs: passed to run_experiment
+    :return: list of run summaries, in completion order. The errors entry maps the failed steps to an error message
+    string, an experiment that raised has the single step experiment.
+    """
+    summaries = []
+    initializer = pipeline.init_job_worker if run_deseq else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        futures = {executor.submit(run_experiment, experiment, out_dir, run_deseq=run_deseq, **kwargs):
+                   experiment for experiment in experiments}
+        for future in as_completed(futures):
+            name = futures[future]["name"]
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.exception(f"{name}: failed")
+                experiment_dir = pathlib.Path(out_dir).joinpath(name)
+                summary = {"name": name, "pimms": False, "out_dir": str(experiment_dir),
+                           "errors": {"experiment": f"{type(e).__name__}: {e}"}}
+                experiment_dir.mkdir(parents=True, exist_ok=True)
+                storage.write_json(experiment_dir.joinpath("run_status.json"), summary)
+            summaries.append(summary)
+            logger.info(f"{name}: {'done' if summary.get('pimms') else 'failed'}")
+    return summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the PIMMS comparison pipeline for the experiments of a manifest")
+    parser.add_argument("manifest", help="csv with name, control, test, control_gff and test_gff columns")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--format", choices=list(TABLE_WRITERS), default="csv", help="table format")
+    parser.add_argument("--workers", type=int, default=2, help="experiments run in parallel")
+    parser.add_argument("--no-deseq", action="store_true", help="skip DESeq2")
+    parser.add_argument("--no-deseq-filtering", action="store_true",
+                        help="disable DESeq2 outlier removal and independent filtering")
+    parser.add_argument("--venn-threshold", type=float, default=0, help="NIM score threshold of the venn sets")
+    parser.add_argument("--venn-percentiles", type=float, nargs=2, default=[0, 100], metavar=("LOW", "HIGH"),
+                        help="inserts percentile range of the venn sets")
+    parser.add_argument("--bundle-dir", help="also write a project bundle per experiment to this directory")
+    args = parser.parse_args()
+
+    experiments = read_manifest(args.manifest)
+    summaries = run_batch(experiments, args.out, workers=args.workers, run_deseq=not args.no_deseq,
+                          table_format=args.format, deseq_filtering=not args.no_deseq_filtering,
+                          venn_threshold=args.venn_threshold, venn_percentiles=tuple(args.venn_percentiles),
+                          bundle_dir=args.bundle_dir)
+    for summary in sorted(summaries, key=lambda s: s["name"]):
+        status = "ok" if summary.get("pimms") else "failed"
+        print(f"{summary['name']:<30} {status:<7} {summary.get('seconds', '-'):>8}  {summary.get('out_dir', '')}")
+        for step, error in summary.get("errors", {}).items():
+            print(f"    {step}: {error}")
+    sys.exit(0 if all(summary.get("pimms") for summary in summaries) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""
+Precomputed project bundles. A bundle is a directory holding the datasets of a finished "Run Selection" in the
+session store layout, uncompressed feather files with their json sidecars, plus a bundle.json manifest with the run
+status. Opening a bundle hard links its files into the session directory, the tabs then read them memory-mapped
+without parsing the inputs or running DESeq2 again.
+
+Bundles are written by the "Export Bundle" button of the control panel and by batch.py --bundle-dir.
+
+Usage:
+    python bundle.py list
+    python bundle.py remove name [name ...]
+"""
+import argparse
+import json
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+import pipeline
+import storage
+from app import BUNDLE_PATH
+from utils import get_session_dir, load_data, session_cache, write_dataset
+
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = "bundle.json"
+
+
+def check_name(name, kind="bundle"):
+    """
+    Raise ValueError unless name is usable as a bundle or batch experiment directory name.
+    :param kind: what is named, for the error message
+    """
+    if not name or not re.fullmatch(r"[\w][\w.-]*", name):
+        raise ValueError(f"Invalid {kind} name {name!r}, use letters, digits, '_', '-' and '.'")
+    return name
+
+
+def _replace_dir(bundle_dir, write):
+    """
+    Write a bundle to a temporary directory and rename it into place, an existing bundle of the same name is only
+    replaced once the new one is complete. Sessions that opened the old bundle keep their hard linked files.
+    :param bundle_dir: bundle directory
+    :param write: function writing the bundle contents to the directory it is passed
+    """
+    bundle_dir = pathlib.Path(bundle_dir)
+    bundle_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = pathlib.Path(tempfile.mkdtemp(dir=bundle_dir.parent, prefix=".tmp-"))
+    try:
+        write(tmp_dir)
+        if bundle_dir.exists():
+            old_dir = bundle_dir.with_name(f".old-{uuid.uuid4().hex}")
+            os.rename(bundle_dir, old_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        os.rename(tmp_dir, bundle_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def _manifest(run_status, datasets, sources):
+    return {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "run_status": run_status,
+        "datasets": sorted(datasets),
+        "sources": sources or {},
+    }
+
+
+def write_bundle(bundle_dir, run_status, datasets, sources=None):
+    """
+    Write a bundle from the results of pipeline.build_selection.
+    :param bundle_dir: bundle directory
+    :param run_status: run status dict of the run
+    :param datasets: dict of dataset name to pandas dataframe or session class instance
+    :param sources: optional json serialisable description of the inputs, e.g. the input file paths
+    :return: manifest dict
+    """
+    manifest = _manifest(run_status, datasets, sources)
+
+    def write(tmp_dir):
+        for name, data in datasets.items():
+            write_dataset(data, tmp_dir.joinpath(name), store="feather")
+        storage.write_json(tmp_dir.joinpath(MANIFEST_NAME), manifest)
+
+    _replace_dir(bundle_dir, write)
+    return manifest
+
+
+def export_session(session_id, bundle_dir, run_status, sources=None):
+    """
+    Write a bundle from the datasets of the last run of a session. Feather datasets are hard linked, datasets of
+    other session stores are rewritten as feather.
+    :param session_id: uuid of session
+    :param bundle_dir: bundle directory
+    :param run_status: run status dict of the last run, selects the datasets exported
+    :param sources: optional json serialisable description of the inputs
+    :return: manifest dict
+    """
+    session_dir = get_session_dir(session_id)
+    datasets = pipeline.selection_datasets(run_status)
+    missing = [name for name in datasets if not storage.exists(session_dir.joinpath(name))]
+    if missing:
+        raise ValueError(f"Session is missing the datasets {', '.join(missing)} of its last run")
+    manifest = _manifest(run_status, datasets, sources)
+
+    def write(tmp_dir):
+        for name in datasets:
+            if storage.read_metadata(session_dir.joinpath(name))["format"] == "feather":
+                storage.link_dataset(session_dir.joinpath(name), tmp_dir.joinpath(name))
+            else:
+                write_dataset(load_data(name, session_id), tmp_dir.joinpath(name), store="feather")
+        storage.write_json(tmp_dir.joinpath(MANIFEST_NAME), manifest)
+
+    _replace_dir(bundle_dir, write)
+    return manifest
+
+
+def read_manifest(bundle_dir):
+    """ Read the manifest of a bundle, raises ValueError for bundles written by a newer format version."""
+    with open(pathlib.Path(bundle_dir).joinpath(MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version", 0) > BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Bundle {bundle_dir} has format version {manifest['format_version']}, "
+                         f"expected at most {BUNDLE_FORMAT_VERSION}")
+    return manifest
+
+
+def open_bundle(bundle_dir, session_id):
+    """
+    Open a bundle in a session. The dataset files are hard linked into the session directory, or copied when the
+    bundle is on another file system. They replace the datasets of the previous run, which are removed where the
+    bundle has no dataset of the same name.
+    :param bundle_dir: bundle directory
+    :param session_id: uuid of session
+    :return: run status dict of the bundle
+    """
+    bundle_dir = pathlib.Path(bundle_dir)
+    manifest = read_manifest(bundle_dir)
+    session_dir = get_session_dir(session_id)
+    for name in manifest["datasets"]:
+        storage.link_dataset(bundle_dir.joinpath(name), session_dir.joinpath(name))
+    for name in pipeline.DATASETS:
+        if name not in manifest["datasets"]:
+            storage.remove_dataset(session_dir.joinpath(name))
+    session_cache.invalidate(session_id)
+    return manifest["run_status"]
+
+
+def list_bundles(bundle_path=BUNDLE_PATH):
+    """
+    List the bundles of a directory, sorted by name.
+    :param bundle_path: directory of bundles
+    :return: list of dicts with the bundle name, creation time, datasets and size in bytes
+    """
+    bundle_path = pathlib.Path(bundle_path)
+    if not bundle_path.exists():
+        return []
+    bundles = []
+    for bundle_dir in sorted(bundle_path.iterdir()):
+        if bundle_dir.name.startswith(".") or not bundle_dir.is_dir():
+            continue
+        try:
+            manifest = read_manifest(bundle_dir)
+            nbytes = sum(f.stat().st_size for f in bundle_dir.iterdir())
+        except (OSError, ValueError):
+            continue
+        bundles.append({"name": bundle_dir.name, "created": manifest.get("created", ""),
+                        "datasets": manifest["datasets"], "bytes": nbytes})
+    return bundles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or remove precomputed project bundles")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list bundles")
+    remove_parser = subparsers.add_parser("remove", help="remove bundles")
+    remove_parser.add_argument("names", nargs="+", help="bundles to remove")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for entry in list_bundles():
+            print(f"{entry['name']:<30} {entry['bytes']:>12}  {entry['created']}  {', '.join(entry['datasets'])}")
+    elif args.command == "remove":
+        for name in args.names:
+            shutil.rmtree(BUNDLE_PATH.joinpath(check_name(name)))
+            print(f"Removed {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,3 @@
-import dash_bio
 import pandas as pd
 
 from utils import GffDataFrame
@@ -64,6 +63,9 @@ def pimms_circos(inner_ring_df, outer_ring_df, hist_ring_df, start, end, hide_ze
     :param size: figure size
     :return:
     """
+    # dash_bio is slow to import, the Circos component scripts are registered by tab_circos
+    import dash_bio
+
     # Ensure correct types
     inner_ring_df['block_id'] = inner_ring_df['block_id'].astype(str)
     outer_ring_df['block_id'] = outer_ring_df['block_id'].astype(str)
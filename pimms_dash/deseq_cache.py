@@ -0,0 +1,135 @@
+"""
+Content addressed disk cache of DESeq2 results, shared by all sessions and workers. Entries are keyed by a hash of
+the mutant pool count matrix, the sample metadata, the filtering option and the R/DESeq2 versions.
+
+Usage:
+    python deseq_cache.py list
+    python deseq_cache.py purge [key ...]
+"""
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+import storage
+
+
+def cache_key(countsdata, metadata, deseq_filtering, versions):
+    """
+    Hash the inputs of a DESeq2 run.
+    :param countsdata: dataframe of mutant pool counts with an id column
+    :param metadata: dataframe of pool ids and dex condition
+    :param deseq_filtering: DESeq2 filtering option
+    :param versions: dict of R and DESeq2 versions
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    for frame in [countsdata, metadata]:
+        digest.update(json.dumps([[str(col), str(dtype)] for col, dtype in frame.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=True).values.tobytes())
+    digest.update(json.dumps({"filtering": bool(deseq_filtering), "versions": versions}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class DESeqResultCache:
+    """
+    Directory per entry holding the results table and the PCA output, written to a temporary directory and renamed
+    into place so concurrent writers and readers never see partial entries. Entry directory modification times
+    record last use, the least recently used entries are evicted when the cache grows over max_bytes.
+    :param cache_dir: cache directory
+    :param max_bytes: size budget of the cache on disk
+    """
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_bytes = max_bytes
+
+    def get(self, key):
+        """ Return (results, pca_dict, pca_labels) for key, or None on a miss."""
+        entry_dir = self.cache_dir.joinpath(key)
+        try:
+            results, metadata = storage.read(entry_dir.joinpath("results"))
+            os.utime(entry_dir)
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+        return results, metadata["attributes"]["pca_dict"], metadata["attributes"]["pca_labels"]
+
+    def put(self, key, results, pca_dict, pca_labels):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = pathlib.Path(tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-"))
+        try:
+            storage.get_session_store("feather").write(
+                tmp_dir.joinpath("results"), results, {"pca_dict": pca_dict, "pca_labels": pca_labels}, "DataFrame")
+            os.rename(tmp_dir, self.cache_dir.joinpath(key))
+        except OSError:
+            # Another worker stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """ List cache entries, least recently used first."""
+        if not self.cache_dir.exists():
+            return []
+        entries = []
+        for entry_dir in self.cache_dir.iterdir():
+            if entry_dir.name.startswith(".") or not entry_dir.is_dir():
+                continue
+            try:
+                stat = entry_dir.stat()
+                nbytes = sum(f.stat().st_size for f in entry_dir.iterdir())
+            except FileNotFoundError:
+                continue
+            entries.append({"key": entry_dir.name, "bytes": nbytes, "last_used": stat.st_mtime})
+        return sorted(entries, key=lambda entry: entry["last_used"])
+
+    def purge(self, keys=None):
+        """ Remove the given entries, or every entry. Returns the number of bytes removed."""
+        removed = 0
+        for entry in self.entries():
+            if keys is None or entry["key"] in keys:
+                shutil.rmtree(self.cache_dir.joinpath(entry["key"]), ignore_errors=True)
+                removed += entry["bytes"]
+        return removed
+
+    def evict(self):
+        """ Remove least recently used entries until the cache fits max_bytes."""
+        entries = self.entries()
+        total = sum(entry["bytes"] for entry in entries)
+        evicted = []
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            evicted.append(entry["key"])
+            total -= entry["bytes"]
+        if evicted:
+            self.purge(evicted)
+        return evicted
+
+
+def main():
+    from app import DESEQ_CACHE_PATH, DESEQ_CACHE_MAX_BYTES
+
+    parser = argparse.ArgumentParser(description="Inspect or purge the DESeq2 result cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list cache entries")
+    purge_parser = subparsers.add_parser("purge", help="remove cache entries")
+    purge_parser.add_argument("keys", nargs="*", help="entries to remove, all entries if omitted")
+    args = parser.parse_args()
+
+    cache = DESeqResultCache(DESEQ_CACHE_PATH, DESEQ_CACHE_MAX_BYTES)
+    if args.command == "list":
+        for entry in cache.entries():
+            last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["last_used"]))
+            print(f"{entry['key']}  {entry['bytes']:>12}  {last_used}")
+    elif args.command == "purge":
+        removed = cache.purge(args.keys or None)
+        print(f"Removed {removed} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+DESeq2 execution service. A pool of long-lived worker processes, each embedding R through rpy2 with DESeq2 loaded
+once at start up. Jobs are queued and dispatched to idle workers, so concurrent sessions run DESeq2 in parallel
+instead of serialising on the single embedded R interpreter of the web process.
+
+This module is imported by the spawned workers, keep module level imports light.
+"""
+import atexit
+import functools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for cancellation while a job waits for its worker
+CANCEL_POLL_INTERVAL = 0.5
+
+
+class DESeqError(Exception):
+    """ DESeq2 job failed inside R, or the worker running it failed."""
+
+
+class DESeqTimeout(DESeqError):
+    """ DESeq2 job did not finish within the job timeout."""
+
+
+class DESeqCancelled(DESeqError):
+    """ DESeq2 job was cancelled, the worker running it was killed."""
+
+
+@functools.lru_cache(maxsize=None)
+def load_run_deseq(script_path):
+    """ Source the DESeq2 R script once per process and return the R run_deseq function."""
+    import rpy2.robjects as ro
+    ro.r['source'](str(script_path))
+    return ro.globalenv['run_deseq']
+
+
+def r_versions():
+    """ Versions of R and DESeq2 loaded in this process."""
+    import rpy2.robjects as ro
+    return {
+        "R": str(ro.r('R.version.string')[0]),
+        "DESeq2": str(ro.r('as.character(packageVersion("DESeq2"))')[0]),
+    }
+
+
+def run_deseq(script_path, countsdata, metadata, deseq_filtering=True):
+    """
+    Run DESeq2 on the count data in this process.
+    :param script_path: path of DESeq2_process.R
+    :param countsdata: dataframe of mutant pool counts with an id column
+    :param metadata: dataframe of pool ids and dex condition
+    :param deseq_filtering: use DESeq2 default outlier removal and independent filtering
+    :return: results dataframe, pca_dict, pca_labels
+    """
+    import rpy2.robjects as ro
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
+
+    # Loading the function we have defined in R.
+    run_deseq_r = load_run_deseq(str(script_path))
+
+    # Convert pandas df to R df
+    with localconverter(ro.default_converter + pandas2ri.converter):
+        r_countsdata = ro.conversion.py2rpy(countsdata)
+        r_metadata = ro.conversion.py2rpy(metadata)
+
+    # Invoking the R function and getting the result
+    df_result_r, pca_r = run_deseq_r(r_countsdata, r_metadata, deseq_filtering)
+    df_pca_r = pca_r[0]
+
+    # results to pandas DataFrame
+    with localconverter(ro.default_converter + pandas2ri.converter):
+        results = ro.conversion.rpy2py(df_result_r)
+        pca = ro.conversion.rpy2py(df_pca_r)
+
+    # Index pca df and store components in dict
+    pca.index = metadata["id"]
+    pca_dict = pca[["PC1", "PC2"]].to_dict(orient="index")
+    pca_labels = {"y_label": pca_r[-1][0][0], "x_label": pca_r[-1][1][0]}
+
+    return results, pca_dict, pca_labels
+
+
+def _worker_main(conn, script_path):
+    """ Worker process loop. Preload DESeq2, report ready, then run jobs received on conn until sent None."""
+    try:
+        load_run_deseq(str(script_path))
+        conn.send(("ready", r_versions()))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+        return
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        try:
+            conn.send(("ok", run_deseq(script_path, *job)))
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+
+
+class DESeqWorker:
+    """ Handle to one R worker process, talking to it over a pipe."""
+    def __init__(self, context, script_path):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, str(script_path)), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.versions = None
+        self.jobs_run = 0
+
+    def wait_ready(self, timeout):
+        if self.versions is None:
+            self.versions = self._receive(timeout)
+        return self.versions
+
+    def run(self, job, timeout, cancel_event=None):
+        self.conn.send(job)
+        self.jobs_run += 1
+        return self._receive(timeout, cancel_event)
+
+    def _receive(self, timeout, cancel_event=None):
+        deadline = time.monotonic() + timeout
+        while not self.conn.poll(max(0, min(CANCEL_POLL_INTERVAL, deadline - time.monotonic()))):
+            if cancel_event is not None and cancel_event.is_set():
+                raise DESeqCancelled(f"DESeq job on worker {self.process.pid} was cancelled")
+            if time.monotonic() >= deadline:
+                raise DESeqTimeout(f"DESeq worker {self.process.pid} did not respond within {timeout}s")
+        try:
+            status, payload = self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise DESeqError(f"DESeq worker {self.process.pid} exited") from e
+        if status == "error":
+            raise DESeqError(payload)
+        return payload
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class DESeqWorkerPool:
+    """
+    Pool of DESeqWorker processes. Jobs queue in a dispatcher with one thread per worker. A worker that times out,
+    fails or has its job cancelled is killed and replaced, and workers are recycled after max_jobs_per_worker jobs
+    to bound R memory growth.
+    :param script_path: path of DESeq2_process.R
+    :param n_workers: number of R worker processes
+    :param timeout: default per job timeout in seconds
+    :param max_jobs_per_worker: jobs run before a worker is replaced
+    :param startup_timeout: seconds allowed for a worker to load R and DESeq2
+    """
+    def __init__(self, script_path, n_workers=2, timeout=600, max_jobs_per_worker=50, startup_timeout=300):
+        self.script_path = str(script_path)
+        self.n_workers = n_workers
+        self.timeout = timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.startup_timeout = startup_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._versions = None
+        self._idle = queue.Queue()
+        self._dispatcher = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="deseq-dispatch")
+        for _ in range(n_workers):
+            self._idle.put(DESeqWorker(self._context, self.script_path))
+
+    def submit(self, countsdata, metadata, deseq_filtering=True, timeout=None, cancel_event=None):
+        """
+        Queue a DESeq2 job. Returns a concurrent.futures.Future of (results, pca_dict, pca_labels).
+        Setting the optional threading.Event cancel_event kills the worker running the job, the future then raises
+        DESeqCancelled.
+        """
+        job = (countsdata, metadata, deseq_filtering)
+        return self._dispatcher.submit(self._run_on_worker, job, timeout or self.timeout, cancel_event)
+
+    def run(self, countsdata, metadata, deseq_filtering=True, timeout=None, cancelled=None):
+        """
+        Run a DESeq2 job on the pool and wait for the result.
+        :param cancelled: optional function polled while waiting, the job is cancelled once it returns True
+        """
+        cancel_event = threading.Event()
+        future = self.submit(countsdata, metadata, deseq_filtering, timeout, cancel_event)
+        while cancelled is not None:
+            try:
+                return future.result(timeout=CANCEL_POLL_INTERVAL)
+            except FutureTimeoutError:
+                if cancelled():
+                    cancel_event.set()
+                    break
+        return future.result()
+
+    def versions(self):
+        """ R and DESeq2 versions reported by the workers, waits for a worker to start on first call."""
+        if self._versions is None:
+            worker = self._idle.get()
+            try:
+                self._versions = worker.wait_ready(self.startup_timeout)
+            except DESeqError:
+                worker = self._replace(worker)
+                raise
+            finally:
+                self._idle.put(worker)
+        return self._versions
+
+    def _run_on_worker(self, job, timeout, cancel_event=None):
+        worker = self._idle.get()
+        if cancel_event is not None and cancel_event.is_set():
+            self._idle.put(worker)
+            raise DESeqCancelled("DESeq job was cancelled before it started")
+        try:
+            self._versions = worker.wait_ready(self.startup_timeout)
+            result = worker.run(job, timeout, cancel_event)
+        except (DESeqTimeout, DESeqCancelled) as e:
+            logger.warning("%s, restarting worker %s", e, worker.process.pid)
+            worker = self._replace(worker)
+            raise
+        except DESeqError:
+            if not worker.process.is_alive():
+                worker = self._replace(worker)
+            raise
+        finally:
+            if worker.jobs_run >= self.max_jobs_per_worker:
+                worker = self._replace(worker, graceful=True)
+            self._idle.put(worker)
+        return result
+
+    def _replace(self, worker, graceful=False):
+        if graceful:
+            worker.stop()
+        else:
+            worker.kill()
+        return DESeqWorker(self._context, self.script_path)
+
+    def shutdown(self):
+        self._dispatcher.shutdown(wait=False)
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+class InlineDESeqRunner:
+    """
+    Runs DESeq2 in the calling process, used when the pool is configured with no workers. Runs can not be cancelled
+    as there is no worker process to kill.
+    """
+    def __init__(self, script_path, **kwargs):
+        self.script_path = str(script_path)
+        self._versions = None
+        self._lock = threading.Lock()
+
+    def run(self, countsdata, metadata, deseq_filtering=True, timeout=None, cancelled=None):
+        # The embedded R interpreter is not thread safe
+        with self._lock:
+            return run_deseq(self.script_path, countsdata, metadata, deseq_filtering)
+
+    def versions(self):
+        with self._lock:
+            if self._versions is None:
+                load_run_deseq(self.script_path)
+                self._versions = r_versions()
+            return self._versions
+
+    def shutdown(self):
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(script_path, n_workers=2, **kwargs):
+    """ Return the process wide DESeq2 runner, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if n_workers > 0:
+                _pool = DESeqWorkerPool(script_path, n_workers=n_workers, **kwargs)
+            else:
+                _pool = InlineDESeqRunner(script_path, **kwargs)
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -0,0 +1,69 @@
+"""
+Per process cache of the data bearing parts of the dashboard figures. A figure is built once per session data
+version and data affecting options, colours, labels and marker options are then applied to a copy of the cached
+figure with the style_* functions of figures, so style changes do not reload data or rebuild traces.
+"""
+import copy
+
+import numpy as np
+
+from app import FIGURE_CACHE_MAX_BYTES
+from utils import SessionObjectCache, data_version
+
+
+figure_cache = SessionObjectCache(FIGURE_CACHE_MAX_BYTES)
+
+
+def cached(session_id, name, datasets, options, build, nbytes):
+    """
+    Get an object derived from session datasets from figure_cache, building it on a miss.
+    Keys are (session_id, (name, *options), data version), an object is rebuilt once any of the datasets it was
+    built from is rewritten.
+    :param session_id: uuid of session
+    :param name: name of the cached object, e.g. the plot type
+    :param datasets: names of the session datasets the object is built from
+    :param options: hashable options the object depends on
+    :param build: function returning the object
+    :param nbytes: function returning the size of the object in bytes
+    :return: cached object, shared between callbacks and to be treated as read only
+    """
+    key = (session_id, (name,) + tuple(options), data_version(session_id, *datasets))
+    obj = figure_cache.get(key)
+    if obj is None:
+        obj = build()
+        figure_cache.put(key, obj, nbytes(obj))
+    return obj
+
+
+def cached_figure(session_id, plot, datasets, options, build):
+    """
+    Figure dict from figure_cache, see cached. The figure is returned as a copy that shares its trace data arrays
+    with the cached figure, style patches may modify it freely as long as they replace rather than modify arrays.
+    :param build: function returning a plotly figure
+    :return: figure dict
+    """
+    fig = cached(session_id, plot, datasets, options, lambda: build().to_plotly_json(), figure_nbytes)
+    return copy_figure(fig)
+
+
+def copy_figure(fig):
+    """ Deep copy of a figure dict except the trace data arrays, which are shared."""
+    memo = {}
+    for trace in fig["data"]:
+        for value in trace.values():
+            if isinstance(value, (np.ndarray, list, tuple)):
+                memo[id(value)] = value
+    return copy.deepcopy(fig, memo)
+
+
+def figure_nbytes(fig):
+    """ Approximate size of the trace data of a figure dict."""
+    nbytes = 0
+    for trace in fig["data"]:
+        for value in trace.values():
+            if isinstance(value, np.ndarray):
+                # Object arrays hold pointers to python strings, count a small string per element
+                nbytes += value.nbytes + (64 * value.size if value.dtype == object else 0)
+            elif isinstance(value, (list, tuple)):
+                nbytes += 64 * len(value)
+    return nbytes
@@ -1,30 +1,30 @@
 # Standard library
 import base64
+import functools
 import io
 
 # Package imports
+# matplotlib and matplotlib_venn are imported by the function drawing with them, so they load on first use
 import numpy as np
 import pandas as pd
-from matplotlib.patches import Patch
-from matplotlib.lines import Line2D
-import matplotlib.ticker as ticker
-import matplotlib.pyplot as plt
 import dash_table
 import plotly.graph_objects as go
-from matplotlib_venn import venn2
 from dash_table.Format import Format, Scheme
+from plotly.colors import qualitative
 from plotly.subplots import make_subplots
-from matplotlib.colors import ColorConverter
 
 # Local imports
-from app import plotly_template
-from utils import scale_lightness
+from app import plotly_template, VENN_CACHE_SIZE
+from table_query import query_page, page_records
+from utils import scale_lightness, hex_to_rgb
 
 
-def main_datatable(df, id, **kwargs):
+def main_datatable(df, id, server_side=False, **kwargs):
     """
     Use dash_table package to create a datatable component from pandas dataframe.
     Define default table args here, can be updated with kwargs.
+    With server_side the table pages, sorts and filters through a callback and only the first page of df is sent
+    with the component, see table_query.
     """
     default_args = dict(
         id=id,
@@ -32,7 +32,6 @@ def main_datatable(df, id, **kwargs):
                   "id": i,
                   "selectable": True,
                   "format": Format(precision=2, scheme=Scheme.fixed)} for i in df.columns],
-        data=df.to_dict('records'),
         style_table={'overflowX': 'scroll', 'overflowY': 'auto', 'color': 'black'},
         style_header={'fontWeight': 'bold', 'backgroundColor': 'white','fontSize': 14},
         style_cell={
@@ -49,13 +48,30 @@ def main_datatable(df, id, **kwargs):
         page_size=15,
         sort_action="native",
     )
+    if server_side:
+        default_args.update(page_action="custom", sort_action="custom", filter_action="custom", page_current=0)
+    default_args.update(kwargs)
+
+    if server_side:
+        page, page_count = query_page(df, page_size=default_args["page_size"])
+        default_args["data"] = page_records(page)
+        default_args["page_count"] = page_count
+    else:
+        page = df
+        default_args["data"] = df.to_dict('records')
     if 'product' in df.columns:
-        default_args["tooltip_data"] = [{'product': {'type': 'text', 'value': f'{r}'}} for r in df['product'].values]
+        default_args["tooltip_data"] = datatable_tooltips(page)
 
-    default_args.update(kwargs)
     return dash_table.DataTable(**default_args)
 
 
+def datatable_tooltips(df):
+    """ Tooltips showing the full product description of each row, which is truncated in the table cell."""
+    if 'product' not in df.columns:
+        return []
+    return [{'product': {'type': 'text', 'value': f'{r}'}} for r in df['product'].values]
+
+
 def histogram(series_control, series_test, range_x=None, range_y=None, bin_size=None):
     """
     Create plotly figure containing two histogram subplots. One above the other with the lower flipped in the y axis.
@@ -224,11 +240,11 @@ def genome_scatter(gff_df):
     return fig
 
 
-def genome_comparison_scatter(gff_df_control, gff_df_test, control_title, test_title):
+def genome_comparison_scatter(inserts_control, inserts_test, control_title, test_title):
     """
-    Create a subplot of two scatter plots of genome insertions from Gff dataframe objects.
-    :param gff_df_control: GffDataFrame object
-    :param gff_df_test: GffDataFrame object
+    Create a subplot of two scatter plots of genome insertions.
+    :param inserts_control: (positions, counts) of control insertions, see utils.downsample_inserts
+    :param inserts_test: (positions, counts) of test insertions
     :return: plotly fig
     """
     fig = make_subplots(rows=2, cols=1,
@@ -236,17 +252,11 @@ def genome_comparison_scatter(gff_df_control, gff_df_test, control_title, test_t
                         vertical_spacing=0.15,
                         subplot_titles=[control_title, test_title],
                         y_title="Number of Mutations / base")
-    for row, gff_df in enumerate([gff_df_control, gff_df_test]):
-        # If gff has score values - assume these are insert counts
-        if gff_df.empty_score():
-            inserts_data = gff_df.value_counts('start').reset_index().rename(
-                columns={"index": "position", "start": "count"})
-        else:
-            inserts_data = gff_df[['start', 'score']].rename(columns={"start": "position", "score": "count"})
+    for row, (positions, counts) in enumerate([inserts_control, inserts_test]):
         # Add trace
         fig.add_trace(
             go.Scattergl(
-                x=inserts_data["position"], y=inserts_data["count"],
+                x=positions, y=counts,
                 name='mutations',
                 mode='markers',
             ),
@@ -255,35 +265,77 @@ def genome_comparison_scatter(gff_df_control, gff_df_test, control_title, test_t
         )
     # Set options common to all traces with fig.update_traces
     fig.update_traces(mode='markers', marker_line_width=1, marker_size=4)
+    # Traces only hold the points of the visible range once zoomed, fix the range slider to the whole genome
+    x_max = max([np.max(positions) for positions, counts in [inserts_control, inserts_test] if len(positions)],
+                default=1)
     fig.update_layout(
         showlegend=False, title_x=0.5, template=plotly_template,
         xaxis2=dict(
             title="Position in the Genome",
             rangeslider=dict(
-                visible=True, bgcolor="#eee", thickness=0.05
+                visible=True, bgcolor="#eee", thickness=0.05, autorange=False, range=[0, x_max]
             ),
         )
     )
     return fig
 
 
-def venn_diagram(set_a, set_b, backgroundcolor='white', set_labels=('Group A', 'Group B'), color_list=None):
+def style_genome_comparison_scatter(fig, color_control, color_test, control_title, test_title, marker_size,
+                                    marker_line_width, log=True):
+    """
+    Apply colours, subplot titles, marker options and the y axis scale to a genome_comparison_scatter figure dict,
+    in place.
+    :return: figure dict
+    """
+    for trace, color in zip(fig["data"], [color_control, color_test]):
+        marker = trace.setdefault("marker", {})
+        marker.update(color=color, size=marker_size)
+        marker.setdefault("line", {})["width"] = marker_line_width
+    layout = fig["layout"]
+    for axis, title in [("yaxis", control_title), ("yaxis2", test_title)]:
+        subplot_title(layout, axis)["text"] = title
+        layout.setdefault(axis, {})["type"] = "log" if log else "linear"
+    return fig
+
+
+def subplot_title(layout, axis):
+    """
+    Subplot title annotation of a make_subplots figure dict, found by its position above the y axis domain.
+    make_subplots adds no annotation for an empty title, figures to be titled later are built with placeholders.
+    :param layout: layout dict
+    :param axis: y axis name of the subplot, e.g. "yaxis2"
+    :return: annotation dict
+    """
+    top = layout[axis]["domain"][1]
+    for annotation in layout.get("annotations", []):
+        if annotation.get("yanchor") == "bottom" and "textangle" not in annotation \
+                and np.isclose(annotation["y"], top):
+            return annotation
+    raise KeyError(f"No subplot title annotation above {axis}")
+
+
+@functools.lru_cache(maxsize=VENN_CACHE_SIZE)
+def venn_image(Ab, aB, AB, backgroundcolor='white', set_labels=('Group A', 'Group B'), color_list=None):
     """
-    Creates a venn diagram given two sets. As plotly venn diagrams are limited, uses matplotlib_venn package.
-    The resulting matplotlib figure currently can not be directly converted to a plotly figure. As a work around the
-    figure is encoded to a base64 string which can be read as an image by dash Img component.
-    :param set_a:
-    :param set_b:
+    Render a two set venn diagram from its subset sizes to a base64 png, read as an image by the dash Img component.
+    As plotly venn diagrams are limited, uses the matplotlib_venn package. The geometry only depends on the subset
+    sizes so images are cached by the arguments, dragging a slider back and forth reuses them.
+    Draws on its own Figure and Agg canvas without pyplot, so sessions can render in parallel threads.
+    :param Ab: size of set a only
+    :param aB: size of set b only
+    :param AB: size of the intersection
+    :param set_labels: tuple of set labels
+    :param color_list: tuple of a only, b only and intersection colours, None for the default colours
     :return: base64 str encoding of plot.
     """
-    # get venn sets
-    aB = len(set(set_b) - set(set_a))
-    Ab = len(set(set_a) - set(set_b))
-    AB = len(set(set_a) & set(set_b))
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib_venn import venn2
 
     # Create venn using matplotlib, encode to b64, pass to html.img
-    plt.figure(linewidth=10, edgecolor=backgroundcolor, facecolor=backgroundcolor)
-    mpl_fig = venn2(subsets=(Ab, aB, AB), set_labels=set_labels)
+    fig = Figure(linewidth=10, edgecolor=backgroundcolor, facecolor=backgroundcolor)
+    FigureCanvasAgg(fig)
+    mpl_fig = venn2(subsets=(Ab, aB, AB), set_labels=set_labels, ax=fig.add_subplot())
 
     if color_list and len(color_list) == 3:
         colors = zip(["10", "01", "11"], color_list)
@@ -299,109 +351,76 @@ def venn_diagram(set_a, set_b, backgroundcolor='white', set_labels=('Group A', '
 
     # Convert to b64
     pic_IObytes = io.BytesIO()
-    plt.savefig(pic_IObytes, format='png', facecolor=backgroundcolor, edgecolor=backgroundcolor)
-    pic_IObytes.seek(0)
-    encoded_image = base64.b64encode(pic_IObytes.read())
+    fig.savefig(pic_IObytes, format='png', facecolor=backgroundcolor, edgecolor=backgroundcolor)
+    encoded_image = base64.b64encode(pic_IObytes.getvalue())
     img = 'data:image/png;base64,{}'.format(encoded_image.decode())
     # plotly_fig = mpl_to_plotly(mpl_fig) # Not working for venn
-    plt.close()
     return img
 
 
-
-def mpl_needleplot(mutation_data: pd.DataFrame, gene_name: str, gene_start: int, gene_end: int, log=True,
-                   color_dict=None, gene_label_width=15, stem_width=1, marker_size=6):
+def needleplot(inserts, gene_name, gene_start, gene_end, log=True, stem_base=None):
     """
-    Create a needleplot of gene mutations using matplotlib stem.
-    :param mutation_data: dataframe holding mutation information
-    :param gene_name:
+    Create an interactive needle plot of the inserts of a gene, a stem and a marker per insertion site and group.
+    Stems of a group are one line trace broken by gaps, so a plot holds a handful of traces whatever the number of
+    sites. Colours, stem width and marker size are set with style_needleplot.
+    :param inserts: dict of group name to (positions, counts) arrays, e.g. InsertionIndex.query slices
+    :param gene_name: gene label
     :param gene_start: coord of start
     :param gene_end: coord of end
-    :param log: Bool
-
-    Example mutation_data  input dataframe:
-    df = pd.DataFrame(
-        {
-            "position": list(np.random.randint(low=1309354, high=1312965, size=10)),
-            "group": list(np.random.choice(["test", "control"], 10)),
-            "count": list(np.random.poisson(3, 10))
-        }
-    )
+    :param log: log y axis
+    :param stem_base: y value stems start from, defaults to 0.5 on the log axis and 0 otherwise
+    :return: plotly fig
+    """
+    if stem_base is None:
+        stem_base = 0.5 if log else 0
+    fig = go.Figure()
+    for i, (group, (positions, counts)) in enumerate(inserts.items()):
+        # Stems and markers of a group share a colour until styled
+        color = qualitative.D3[i % len(qualitative.D3)]
+        positions = np.asarray(positions, dtype="float64")
+        counts = np.asarray(counts, dtype="float64")
+        # (position, base), (position, count), gap for each site
+        stems_x = np.repeat(positions, 3)
+        stems_x[2::3] = np.nan
+        stems_y = np.column_stack([np.full(len(counts), stem_base), counts, np.full(len(counts), np.nan)]).ravel()
+        fig.add_trace(go.Scattergl(x=stems_x, y=stems_y, mode="lines", name=group, legendgroup=group,
+                                   showlegend=False, hoverinfo="skip", connectgaps=False, line_color=color))
+        fig.add_trace(go.Scattergl(x=positions, y=counts, mode="markers", name=group, legendgroup=group,
+                                   marker_color=color,
+                                   hovertemplate="Position: %{x}<br>Mutations: %{y}<extra>%{fullData.name}</extra>"))
+    # Gene rectangle along the bottom of the plot, independent of the y axis scale, with a legend entry
+    fig.add_shape(type="rect", xref="x", yref="paper", x0=gene_start, x1=gene_end, y0=0, y1=0.04,
+                  fillcolor="red", line_color="red", layer="below")
+    fig.add_annotation(x=gene_start + (gene_end - gene_start) / 2, y=0.02, xref="x", yref="paper", text=gene_name,
+                       showarrow=False, font=dict(color="white"))
+    fig.add_trace(go.Scatter(x=[None], y=[None], mode="markers", name=gene_name, legendgroup="gene",
+                             marker=dict(symbol="square", color="red", size=10)))
+    fig.update_yaxes(title="Mutations", type="log" if log else "linear", rangemode="tozero")
+    fig.update_xaxes(title="Position")
+    fig.update_layout(template=plotly_template, height=500,
+                      legend=dict(orientation="h", x=1, y=1.02, xanchor="right", yanchor="bottom"))
+    return fig
+
+
+def style_needleplot(fig, color_dict=None, stem_width=1, marker_size=6):
     """
-    def myLogFormat(y, pos):
-        """ Utility function to format log ticks - hides ticks <1"""
-        if y < 1:
-            return ""
-        # Find the number of decimal places required
-        decimalplaces = int(np.maximum(-np.log10(y), 0))  # =0 for numbers >=1
-        # Insert that number into a format string
-        formatstring = '{{:.{:1d}f}}'.format(decimalplaces)
-        # Return the formatted tick label
-        return formatstring.format(y)
-
-    # List to hold legend objects
-    legend_elements = []
-    # Loop through groups
-    for i, group in enumerate(mutation_data["group"].unique()):
-        # Get only the rows belonging to group
-        subset_df = mutation_data[mutation_data["group"] == group]
-        # Create matplotlib stem plot, baseline is white to hide, colour changes through loop
-        markerline, stemlines, baseline = plt.stem(subset_df["position"], subset_df['count'], f"C{i}", basefmt="w",
-                                                   markerfmt=f"C{i}o", label=group, use_line_collection=True)
-        # Choose marker color
+    Apply group colours, stem width and marker size to a needleplot figure dict, in place.
+    :param color_dict: dict of lower case group name to colour, groups not in it keep the template colours
+    :return: figure dict
+    """
+    for trace in fig["data"]:
+        group = trace.get("legendgroup", "")
+        if group == "gene":
+            continue
+        style = {}
         if color_dict and group.lower() in color_dict:
-            clr = color_dict[group.lower()]
+            style["color"] = color_dict[group.lower()]
+        if trace["mode"] == "lines":
+            trace.setdefault("line", {}).update(width=stem_width, **style)
         else:
-            clr = f"C{i}"
-
-        plt.setp(markerline, 'color', clr)
-        plt.setp(stemlines, 'color', clr)
-
-        # Set the line width, markersize and baseline width. Baseline to 0 will hide.
-        plt.setp(stemlines, "linewidth", stem_width)
-        plt.setp(markerline, markersize=marker_size)
-        plt.setp(baseline, "linewidth", 0)
-
-        # Create the legend icon using line2D object and append to legend elements list
-        legend_elements.append(
-            Line2D([0], [0], marker='o', color="w", label=group, markerfacecolor=clr, markersize=10))
-
-    if log is True:
-        plt.yscale("log")
-        plt.gca().yaxis.set_major_formatter(ticker.FuncFormatter(myLogFormat))
-        #plt.gca().yaxis.set_minor_formatter(ticker.FuncFormatter(myLogFormat))
-
-    # Set genelabel y position. Set >0 to work with log yscale.
-    label_y = 0.8
-
-    # Use another call to stem to create the gene rectangle with its baseline.
-    markerline, stemlines, baseline = plt.stem([gene_start, gene_end], [0, 0], "w", markerfmt="r", basefmt="r-",
-                                               use_line_collection=True, bottom=label_y)
-    # Define the height of the gene label
-    plt.setp(baseline, "linewidth", gene_label_width)
-    # Add a patch to the legend to label gene
-    legend_elements.append(Patch(facecolor='r', edgecolor='r', label=gene_name))
-
-    plt.text(gene_start + (gene_end - gene_start) / 2, label_y, gene_name, horizontalalignment='center',
-             verticalalignment='center')
-
-    # Create custom legend with legend elements
-    plt.legend(handles=legend_elements, bbox_to_anchor=(1, 1), loc='lower right', ncol=3)
-    # General plot formating
-    plt.ylabel("Mutations", fontsize=14)
-    plt.xlabel("Position", fontsize=14)
-
-    # At this point a call to plt.show would display needleplot
-    # For the purposes of the dash board we covert to img b64 string
-    # Convert to b64
-    pic_IObytes = io.BytesIO()
-    plt.savefig(pic_IObytes, format='png', facecolor="w", edgecolor="w")
-    pic_IObytes.seek(0)
-    encoded_image = base64.b64encode(pic_IObytes.read())
-    img = 'data:image/png;base64,{}'.format(encoded_image.decode())
-    # plotly_fig = mpl_to_plotly(mpl_fig) # Not working for venn
-    plt.close()
-    return img
+            trace.setdefault("marker", {}).update(size=marker_size, **style)
+    return fig
+
 
 def NIM_comparison_bar(series_control, series_test, start_positions, end_positions, get_trace=False):
     """ Create plotly bar chart to compare NIM/NRM scores between conditions
@@ -451,38 +470,76 @@ def NIM_comparison_bar(series_control, series_test, start_positions, end_positio
                           ))
         return fig
 
+def bar_outline(values, start_positions, end_positions):
+    """
+    Outline of a bar chart as a single line, four points per bar: (start, 0), (start, y), (end, y), (end, 0).
+    :param values: array of bar heights
+    :param start_positions: array of bar starts
+    :param end_positions: array of bar ends
+    :return: x and y arrays of length 4 * len(values)
+    """
+    x_points = np.repeat(np.column_stack([start_positions, end_positions]), 2, axis=1).ravel()
+    y_points = np.zeros((len(values), 4), dtype="float64")
+    y_points[:, 1:3] = np.asarray(values, dtype="float64")[:, None]
+    return x_points, y_points.ravel()
+
+
+def interleave_gaps(values, fill):
+    """
+    Insert a fill value between consecutive elements, [a, b, c] -> [a, fill, b, fill, c].
+    :param values: 1d array
+    :param fill: value placed in the gaps
+    :return: array of length 2 * len(values) - 1
+    """
+    values = np.asarray(values)
+    result = np.full(max(2 * len(values) - 1, 0), fill, dtype=values.dtype)
+    result[::2] = values
+    return result
+
+
 def NIM_comparison_bar_gl(series_control, series_test, start_positions, end_positions, locus_tags, test_label, control_label, get_trace=False):
     """
     To address performance issues in standard plotly bar with large datasets. Hack scattergl (better performance)
     to produce a bar-like chart using fill.
+    Bars are drawn without hover, each condition has a second trace of invisible markers, one per bar at the bar top,
+    carrying the hover text. Locus tags are sent once per bar rather than for every outline point.
+    Traces are returned as [test bars, control bars, test hover, control hover].
     """
     # Create scatter points to build bar.
-    x_points = [item for x in zip(start_positions, end_positions) for item in [x[0], x[0], x[1], x[1]]]
-    y_points_test = [item for x in series_test.to_list() for item in [0, x, x, 0]]
-    y_points_control = [item for x in series_control.to_list() for item in [0, -x, -x, 0]]
-    locus_labels = [item for x in locus_tags.to_list() for item in ["", x, x, ""]]
+    start_positions = np.asarray(start_positions)
+    end_positions = np.asarray(end_positions)
+    values_test = np.asarray(series_test, dtype="float64")
+    values_control = np.asarray(series_control, dtype="float64")
+    x_points, y_points_test = bar_outline(values_test, start_positions, end_positions)
+    _, y_points_control = bar_outline(-values_control, start_positions, end_positions)
+    hover_x = (start_positions + end_positions) / 2
+    # Score, start and end of each bar for the hover label
+    hover_data_test = np.column_stack([values_test, start_positions, end_positions])
+    hover_data_control = np.column_stack([values_control, start_positions, end_positions])
+    tags = np.asarray(locus_tags, dtype=object)
+    hovertemplate = '<b>Score</b>: %{customdata[0]}' + \
+                    '<br><b>Position</b>: %{customdata[1]} - %{customdata[2]}' + \
+                    '<br><b>Locus Tag</b>: %{text}<br>'
     # Create figure
     fig = go.Figure()
-    t1 = go.Scattergl(x=x_points, y=y_points_test, fill='tozeroy', name=test_label,
-                      hovertemplate='<b>Score</b>: %{text}' +
-                                    '<br><b>Position</b>: %{x}' +
-                                    '<br><b>Locus Tag</b>: %{customdata}<br>',
-                      text=[str(abs(y)) for y in y_points_test],
-                      customdata=locus_labels
-                      )
-    t2 = go.Scattergl(x=x_points, y=y_points_control, fill='tozeroy', name=control_label,
-                      hovertemplate='<b>Score</b>: %{text}' +
-                                    '<br><b>Position</b>: %{x}' +
-                                    '<br><b>Locus Tag</b>: %{customdata}<br>',
-                      text=[str(abs(y)) for y in y_points_control],
-                      customdata=locus_labels
-                      )
+    t1 = go.Scattergl(x=x_points, y=y_points_test, fill='tozeroy', name=test_label, legendgroup="test",
+                      hoverinfo="skip")
+    t2 = go.Scattergl(x=x_points, y=y_points_control, fill='tozeroy', name=control_label, legendgroup="control",
+                      hoverinfo="skip")
+    h1 = go.Scattergl(x=hover_x, y=values_test, mode="markers", marker=dict(opacity=0), name=test_label,
+                      legendgroup="test", showlegend=False, hovertemplate=hovertemplate, text=tags,
+                      customdata=hover_data_test)
+    h2 = go.Scattergl(x=hover_x, y=-values_control, mode="markers", marker=dict(opacity=0), name=control_label,
+                      legendgroup="control", showlegend=False, hovertemplate=hovertemplate, text=tags,
+                      customdata=hover_data_control)
 
     if get_trace:
-        return [t1, t2]
+        return [t1, t2, h1, h2]
     else:
         fig.add_trace(t1)  # fill to trace0 y
         fig.add_trace(t2)  # fill to trace0 y
+        fig.add_trace(h1)
+        fig.add_trace(h2)
 
         fig.update_yaxes(title="Score")
         # General layout
@@ -497,15 +554,15 @@ def NIM_comparison_bar_gl(series_control, series_test, start_positions, end_posi
 def NIM_comparison_heatmap(series_control, series_test,  start_positions, end_positions, locus_tags, test_label, control_label, get_trace=False):
     """ Create a heatmap comparison between the two conditions"""
     conditions = [test_label, control_label]
-    # Zip start and end positions into one list
-    x_points = [item for x in zip(start_positions.to_list(), end_positions.to_list()) for item in x]
+    # Interleave start and end positions into one array
+    x_points = np.column_stack([np.asarray(start_positions), np.asarray(end_positions)]).ravel()
     # Create z values array - insert 0 between elements for sections inbetween loci
-    z_values = np.array([series_test.to_list(), series_control.to_list()])
-    z_values = np.dstack((z_values, np.zeros_like(z_values))).reshape(z_values.shape[0], -1)[:, :-1]
+    z_values = np.vstack([interleave_gaps(np.asarray(series_test, dtype="float64"), 0),
+                          interleave_gaps(np.asarray(series_control, dtype="float64"), 0)])
     # Create locus tag labels - insert empty string between elements for sections inbetween loci
-    labels = [j for i in zip(locus_tags, [""] * len(locus_tags)) for j in i][:-1]
-    # As both conditions have same labels concat in np array
-    labels = np.array([labels, labels])
+    labels = interleave_gaps(np.asarray(locus_tags, dtype=object), "")
+    # As both conditions have same labels stack in np array
+    labels = np.vstack([labels, labels])
     fig = make_subplots(rows=2, cols=1, vertical_spacing=0.01)
     t1 = go.Heatmap(
         z=z_values,
@@ -550,6 +607,18 @@ def NIM_comparison_heatmap(series_control, series_test,  start_positions, end_po
         fig.update_xaxes(matches='x')
         return fig
 
+def nim_colorscale(color):
+    """ Heatmap colorscale from white to color, log spaced to show scores over several orders of magnitude."""
+    return [
+        (0, "white"),
+        (0.0001, f'rgb{scale_lightness(hex_to_rgb(color), 2)}'),
+        (0.001, f'rgb{scale_lightness(hex_to_rgb(color), 1.75)}'),
+        (0.01, f'rgb{scale_lightness(hex_to_rgb(color), 1.5)}'),
+        (0.1, f'rgb{scale_lightness(hex_to_rgb(color), 1.25)}'),
+        (1, color)
+    ]
+
+
 def NIM_comparison_linked(series_control, series_test, start_positions, end_positions, locus_tags, title, color_test, color_control, test_label, control_label):
     """Create both the bar chart and heatmap but with linked xaxes"""
     fig = make_subplots(rows=3, cols=1,
@@ -560,28 +629,18 @@ def NIM_comparison_linked(series_control, series_test, start_positions, end_posi
 
     traces[0]['line'].color = color_test
     traces[1]['line'].color = color_control
+    traces[2]['marker'].color = color_test
+    traces[3]['marker'].color = color_control
 
-    traces[2]["colorscale"] = [
-        (0, "white"),
-        (0.0001, f'rgb{scale_lightness(ColorConverter.to_rgb(color_test), 2)}'),
-        (0.001, f'rgb{scale_lightness(ColorConverter.to_rgb(color_test), 1.75)}'),
-        (0.01, f'rgb{scale_lightness(ColorConverter.to_rgb(color_test), 1.5)}'),
-        (0.1, f'rgb{scale_lightness(ColorConverter.to_rgb(color_test), 1.25)}'),
-        (1, color_test)
-    ]
-    traces[3]["colorscale"] = [
-        (0, "white"),
-        (0.0001, f'rgb{scale_lightness(ColorConverter.to_rgb(color_control), 2)}'),
-        (0.001, f'rgb{scale_lightness(ColorConverter.to_rgb(color_control), 1.75)}'),
-        (0.001, f'rgb{scale_lightness(ColorConverter.to_rgb(color_control), 1.5)}'),
-        (0.1, f'rgb{scale_lightness(ColorConverter.to_rgb(color_control), 1.25)}'),
-        (1, color_control)
-    ]
+    traces[4]["colorscale"] = nim_colorscale(color_test)
+    traces[5]["colorscale"] = nim_colorscale(color_control)
 
     fig.append_trace(traces[0], 1, 1)
     fig.append_trace(traces[1], 1, 1)
-    fig.append_trace(traces[2], 2, 1)
-    fig.append_trace(traces[3], 3, 1)
+    fig.append_trace(traces[2], 1, 1)
+    fig.append_trace(traces[3], 1, 1)
+    fig.append_trace(traces[4], 2, 1)
+    fig.append_trace(traces[5], 3, 1)
 
     fig.update_xaxes(matches='x')
     fig['layout']['xaxis1'].update(visible=False)
@@ -603,6 +662,25 @@ def NIM_comparison_linked(series_control, series_test, start_positions, end_posi
 
     return fig
 
+def style_NIM_comparison(fig, color_test, color_control, test_label, control_label):
+    """
+    Apply colours and labels to a NIM_comparison_linked figure dict, in place.
+    :return: figure dict
+    """
+    bar_test, bar_control, hover_test, hover_control, heatmap_test, heatmap_control = fig["data"]
+    for bar, hover, color, label in [(bar_test, hover_test, color_test, test_label),
+                                     (bar_control, hover_control, color_control, control_label)]:
+        bar["name"] = label
+        bar.setdefault("line", {})["color"] = color
+        hover["name"] = label
+        hover.setdefault("marker", {})["color"] = color
+    for heatmap, color, label in [(heatmap_test, color_test, test_label),
+                                  (heatmap_control, color_control, control_label)]:
+        heatmap["colorscale"] = nim_colorscale(color)
+        heatmap["y"] = [label]
+    return fig
+
+
 def pca_plot(pca_df, control_color, test_color, control_label, test_label):
     fig = go.Figure()
     fig.add_trace(
@@ -657,4 +735,17 @@ def pca_plot(pca_df, control_color, test_color, control_label, test_label):
     fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='LightGrey')
     fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='LightGrey')
 
-    return fig
\ No newline at end of file
+    return fig
+
+
+def style_pca_plot(fig, control_color, test_color, control_label, test_label, marker_size, marker_line_width):
+    """
+    Apply colours, labels and marker options to a pca_plot figure dict, in place.
+    :return: figure dict
+    """
+    for trace, color, label in zip(fig["data"], [control_color, test_color], [control_label, test_label]):
+        trace["name"] = label
+        marker = trace.setdefault("marker", {})
+        marker.update(color=color, size=marker_size)
+        marker.setdefault("line", {})["width"] = marker_line_width
+    return fig
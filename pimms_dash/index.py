@@ -1,21 +1,24 @@
+import os
 import uuid
 
+import flask
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 
-from app import app, app_title
+from app import app, app_title, server
 from panel_control import control_panel_layout
 from tab_about import about_tab_layout
 from tab_datatable import datatable_tab_layout
 from tab_histogram import histogram_tab_layout
 from tab_venn import venn_tab_layout
 from tab_genome_scatter import genome_scatter_tab_layout
-from tab_circos import circos_tab_layout
+# The Circos tab is disabled, importing it loads dash_bio. Import it again when re-enabling the tab
+# from tab_circos import circos_tab_layout
 from tab_geneviewer import geneviewer_tab_layout
 from tab_pca import pca_tab_layout
 from tab_NIM_comparison import NIM_comparison_tab_layout
-from utils import manage_session_data
+from utils import manage_session_data, session_cache, session_sweeper
 
 
 # Header
@@ -85,6 +88,18 @@ def serve_layout():
 
 app.layout = serve_layout
 
+
+@server.route("/stats/session-cache")
+def session_cache_stats():
+    """ Report session cache counters of the worker serving the request, used to size the cache per worker."""
+    return flask.jsonify(pid=os.getpid(), **session_cache.stats())
+
+
+@server.route("/stats/sessions")
+def session_stats():
+    """ Report the last session sweep: reclaimed bytes, removed sessions by reason and live sessions."""
+    return flask.jsonify(session_sweeper.stats())
+
 def run_app():
     manage_session_data()
     app.run_server(
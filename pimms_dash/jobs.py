@@ -0,0 +1,174 @@
+"""
+Background jobs for long running callbacks. Jobs run on a local process pool and report their progress through a
+small json status file in a jobs directory, so any web worker can poll or cancel a job whichever worker started it.
+"""
+import atexit
+import json
+import multiprocessing
+import pathlib
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import storage
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = [DONE, FAILED, CANCELLED]
+
+# JobContext of the job running in this process, job processes run one job at a time
+_current_job = None
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a job when cancellation was requested. Derives from BaseException, like asyncio.CancelledError,
+    so the `except Exception` blocks used to report pipeline failures do not swallow it.
+    """
+
+
+class JobContext:
+    """
+    Passed to job functions as the first argument, used to report stages and check for cancellation.
+    :param jobs_dir: directory holding the job status and cancel files
+    :param job_id: job identifier
+    :param stages: names of the stages the job is expected to run, used to report progress
+    """
+    def __init__(self, jobs_dir, job_id, stages):
+        self.jobs_dir = pathlib.Path(jobs_dir)
+        self.job_id = job_id
+        self.stages = list(stages)
+
+    def stage(self, name):
+        """ Report the start of a stage. Raises JobCancelled if the job has been cancelled."""
+        if self.cancelled():
+            raise JobCancelled(self.job_id)
+        index = self.stages.index(name) if name in self.stages else len(self.stages)
+        _write_status(self.jobs_dir, self.job_id, state=RUNNING, stage=name, stage_index=index,
+                      n_stages=len(self.stages))
+
+    def cancelled(self):
+        return _cancel_path(self.jobs_dir, self.job_id).exists()
+
+
+def _run_job(jobs_dir, job_id, stages, func, args, kwargs):
+    """ Process pool entry point, runs func and records its outcome in the status file."""
+    global _current_job
+    job = JobContext(jobs_dir, job_id, stages)
+    try:
+        if job.cancelled():
+            raise JobCancelled(job_id)
+        _current_job = job
+        result = func(job, *args, **kwargs)
+    except JobCancelled:
+        _write_status(jobs_dir, job_id, state=CANCELLED)
+        return None
+    except Exception:
+        _write_status(jobs_dir, job_id, state=FAILED, error=traceback.format_exc())
+        raise
+    finally:
+        _current_job = None
+    _write_status(jobs_dir, job_id, state=DONE, result=result, stage_index=len(stages), n_stages=len(stages))
+    return result
+
+
+def current_job():
+    """ Return the JobContext of the job running in this process, None outside a job."""
+    return _current_job
+
+
+class JobManager:
+    """
+    Runs jobs on a lazily started local process pool, no external broker is required.
+    :param max_workers: number of job processes
+    :param initializer: optional function run once in each job process
+    """
+    def __init__(self, max_workers=2, initializer=None):
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Spawn, forking a multi threaded web server process is not safe
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=self.initializer)
+                atexit.register(self.shutdown)
+            return self._executor
+
+    def submit(self, jobs_dir, func, *args, stages=(), **kwargs):
+        """
+        Queue func(job_context, *args, **kwargs) and return its job id immediately.
+        :param jobs_dir: directory for the job status files, e.g. within the session directory
+        :param func: picklable module level function
+        :param stages: stage names the job reports, in order
+        :return: job id
+        """
+        jobs_dir = pathlib.Path(jobs_dir)
+        jobs_dir.mkdir(parents=True, exist_ok=True)
+        job_id = uuid.uuid4().hex
+        _write_status(jobs_dir, job_id, state=QUEUED, stage=None, stage_index=0, n_stages=len(stages))
+        future = self._get_executor().submit(_run_job, jobs_dir, job_id, list(stages), func, args, kwargs)
+        with self._lock:
+            self._futures[job_id] = future
+        future.add_done_callback(lambda f: self._on_done(jobs_dir, job_id, f))
+        return job_id
+
+    def cancel(self, jobs_dir, job_id):
+        """
+        Request cancellation. Queued jobs are dropped, running jobs stop at their next stage or, while running
+        DESeq2, as soon as their DESeq2 worker is killed.
+        """
+        _cancel_path(jobs_dir, job_id).touch()
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None and future.cancel():
+            _write_status(jobs_dir, job_id, state=CANCELLED)
+
+    def _on_done(self, jobs_dir, job_id, future):
+        with self._lock:
+            self._futures.pop(job_id, None)
+        if future.cancelled():
+            return
+        # The job process died without recording an outcome
+        if future.exception() is not None and get_status(jobs_dir, job_id).get("state") not in FINISHED_STATES:
+            _write_status(jobs_dir, job_id, state=FAILED, error=repr(future.exception()))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_status(jobs_dir, job_id):
+    """ Read the status of a job, returns an empty dict for unknown jobs."""
+    try:
+        with open(_status_path(jobs_dir, job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _status_path(jobs_dir, job_id):
+    return pathlib.Path(jobs_dir).joinpath(f"{job_id}.json")
+
+
+def _cancel_path(jobs_dir, job_id):
+    return pathlib.Path(jobs_dir).joinpath(f"{job_id}.cancel")
+
+
+def _write_status(jobs_dir, job_id, **fields):
+    status = get_status(jobs_dir, job_id)
+    status.update(fields, job_id=job_id, updated=time.time())
+    storage.write_json(_status_path(jobs_dir, job_id), status)
@@ -6,10 +6,17 @@ import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
-from dash import callback_context
+from dash import callback_context, no_update
 
-from utils import GffDataFrame, PIMMSDataFrame, parse_upload, store_data
-from app import app, DATA_PATH, TESTDATA_PATH
+import bundle
+import jobs
+import pipeline
+from utils import parse_upload, get_session_dir
+from app import app, DATA_PATH, TESTDATA_PATH, JOB_WORKERS, MAX_UPLOAD_BYTES, BUNDLE_PATH
+
+
+# Background jobs running the selection pipeline
+job_manager = jobs.JobManager(max_workers=JOB_WORKERS, initializer=pipeline.init_job_worker)
 
 
 panel_data_tab_layout = dbc.Card(
@@ -44,9 +51,23 @@ panel_data_tab_layout = dbc.Card(
                 bs_size="sm",
             ),
             html.Hr(),
-            dcc.Loading(
-                dcc.Store(id='run-status'),
-                type="dot",
+            dcc.Store(id='run-status'),
+            dcc.Store(id='run-job'),
+            dcc.Interval(id='run-job-interval', interval=1000, disabled=True),
+            dbc.Collapse(
+                dbc.Row(
+                    [
+                        dbc.Col(dbc.Progress(id="run-progress", value=0, striped=True, animated=True), width=9),
+                        dbc.Col(
+                            dbc.Button("Cancel", id="run-cancel-button", color="dark", outline=True, size="sm",
+                                       style={"padding": 0}, block=True),
+                            width=3
+                        ),
+                    ],
+                    align="center", no_gutters=True,
+                ),
+                id="run-progress-collapse",
+                is_open=False,
             ),
             html.Br(),
             html.Div("Select Control Coordinate-Gff"),
@@ -67,8 +88,19 @@ panel_data_tab_layout = dbc.Card(
             html.Hr(),
             dbc.Button("Run Selection", id="run-button", color="info", className='mx-auto', block=True),
             html.Hr(),
+            html.H4("Project Bundles", className="text-center"),
+            html.Div("Open a precomputed run"),
+            dbc.Select(id="bundle-dropdown", options=[], bs_size="sm"),
+            dbc.Button("Open Bundle", id="bundle-open-button", color="info", size="sm", className="mt-1", block=True),
+            html.Br(),
+            html.Div("Export the current run"),
+            dbc.Input(id="bundle-name-input", placeholder="Bundle name", bs_size="sm"),
+            dbc.Button("Export Bundle", id="bundle-export-button", color="dark", outline=True, size="sm",
+                       className="mt-1", block=True),
+            html.Div(id="bundle-feedback", className="small mt-1"),
+            html.Hr(),
             html.H4("Upload Data", className="text-center"),
-            dcc.Upload(id='upload-data', multiple=True, children=[
+            dcc.Upload(id='upload-data', multiple=True, max_size=MAX_UPLOAD_BYTES, children=[
                 dbc.Card(
                     dbc.CardBody("Drag and Drop Files Here"),
                     color="primary", outline=True, inverse=True, className='text-center')
@@ -273,22 +305,39 @@ control_panel_layout = dbc.Tabs(
 
 
 @app.callback(
-    Output("run-status", "data"),
+    Output("run-job", "data"),
     [Input("run-button", "n_clicks"),
+     Input("bundle-open-button", "n_clicks"),
      State("test-dropdown", "value"),
      State("control-dropdown", "value"),
      State("gff-dropdown-control", "value"),
      State("gff-dropdown-test", "value"),
      State("data-input-checklist", "value"),
+     State("bundle-dropdown", "value"),
+     State("run-job", "data"),
      State("session-id", "data")],
     prevent_initial_call=True
 )
-def run_selection(run_clicks, test_filename, control_filename, control_gff_filename,
-                  test_gff_filename, run_options, session_id):
-
-    # Create empty run status
-    run_status = {'pimms': None, 'gff_control': None, 'gff_test': None, 'deseq':
-        None, "control-run": False}
+def run_selection(run_clicks, open_clicks, test_filename, control_filename, control_gff_filename,
+                  test_gff_filename, run_options, bundle_name, run_job, session_id):
+    """
+    Callback to queue the selection pipeline as a background job. Returns the job id straight away, progress and
+    the final run status are picked up by poll_run_job.
+    Opening a bundle replaces the session data without a job, its run status is passed straight to poll_run_job.
+    """
+    trigger = callback_context.triggered[0]['prop_id'].split('.')[0]
+    if trigger == "bundle-open-button":
+        if not bundle_name:
+            raise PreventUpdate
+        # A running selection would overwrite the bundle datasets when it persists its results
+        if run_job and run_job.get("job_id"):
+            job_manager.cancel(get_session_dir(session_id).joinpath("jobs"), run_job["job_id"])
+        try:
+            run_status = bundle.open_bundle(BUNDLE_PATH.joinpath(bundle.check_name(bundle_name)), session_id)
+        except (OSError, ValueError, KeyError):
+            run_status = {'pimms': False, 'gff_control': None, 'gff_test': None, 'deseq': None,
+                          "control-run": False}
+        return {"job_id": None, "run_status": run_status}
 
     # Prevent update if all dropdowns unselected.
     if ((test_filename in [0, None]) or (control_filename in [0, None])) and \
@@ -302,59 +351,99 @@ def run_selection(run_clicks, test_filename, control_filename, control_gff_filen
     all_csvs.extend(list(TESTDATA_PATH.glob('*.xls*')) + list(session_upload_dir.glob('*.xls*')))
     all_gffs = list(TESTDATA_PATH.glob('*.gff')) + list(session_upload_dir.glob('*.gff'))
 
-    # Read control coordinate gff file and store
-    if control_gff_filename not in [0, None]:
-        control_gff_path = [i for i in all_gffs if i.name == control_gff_filename][0]
-        try:
-            gff_df_control = GffDataFrame(control_gff_path)
-            store_data(gff_df_control.to_json(), 'gff_df_control', session_id)
-            run_status['gff_control'] = True
-        except Exception as e:
-            # Todo log exception
-            run_status['gff_control'] = False
-
-    # Read test coordinate gff file and store
-    if test_gff_filename not in [0, None]:
-        test_gff_path = [i for i in all_gffs if i.name == test_gff_filename][0]
-        try:
-            gff_df_test = GffDataFrame(test_gff_path)
-            store_data(gff_df_test.to_json(), 'gff_df_test', session_id)
-            run_status['gff_test'] = True
-        except Exception as e:
-            # Todo log exception
-            run_status['gff_test'] = False
-
-    # Read pimms csv files and store
-    if (test_filename not in [0, None]) and (control_filename not in [0, None]):
-        # Get full filepaths from dropdown selection
-        try:
-            test_path = [i for i in all_csvs if i.name == test_filename][0]
-            control_path = [i for i in all_csvs if i.name == control_filename][0]
-            run_deseq = "deseq" in run_options
-            filter_deseq = "filter" in run_options
-            pimms_df = PIMMSDataFrame(control_path, test_path, run_deseq=run_deseq, deseq_filtering=filter_deseq)
-            store_data(pimms_df.to_json(), 'pimms_df', session_id)
-            run_status['pimms'] = True
-            run_status['deseq'] = pimms_df.deseq_run_logs
-        except Exception as e:
-            # Todo Log exception
-            run_status['pimms'] = False
-    elif ('control-run' in run_options) and (control_filename not in [0, None]):
-        try:
-            control_path = [i for i in all_csvs if i.name == control_filename][0]
-            pimms_df = PIMMSDataFrame(
-                control_path,
-                test_path=None,
-            )
-            store_data(pimms_df.to_json(), 'pimms_df', session_id)
-            run_status['pimms'] = True
-            run_status['deseq'] = pimms_df.deseq_run_logs
-            run_status["control-run"] = True
-        except Exception as e:
-            # Todo Log exception
-            run_status['pimms'] = False
-
-    return run_status
+    def find_path(filename, paths):
+        if filename in [0, None]:
+            return None
+        return [i for i in paths if i.name == filename][0]
+
+    job_id = job_manager.submit(
+        get_session_dir(session_id).joinpath("jobs"),
+        pipeline.run_selection,
+        session_id,
+        control_path=find_path(control_filename, all_csvs),
+        test_path=find_path(test_filename, all_csvs),
+        control_gff_path=find_path(control_gff_filename, all_gffs),
+        test_gff_path=find_path(test_gff_filename, all_gffs),
+        run_deseq="deseq" in run_options,
+        deseq_filtering="filter" in run_options,
+        control_run='control-run' in run_options,
+        stages=pipeline.STAGES,
+    )
+    return {"job_id": job_id}
+
+
+@app.callback(
+    [Output("run-status", "data"),
+     Output("run-progress", "value"),
+     Output("run-progress", "children"),
+     Output("run-progress-collapse", "is_open"),
+     Output("run-job-interval", "disabled")],
+    [Input("run-job", "data"),
+     Input("run-job-interval", "n_intervals"),
+     Input("run-cancel-button", "n_clicks"),
+     State("session-id", "data")],
+    prevent_initial_call=True
+)
+def poll_run_job(run_job, n_intervals, cancel_clicks, session_id):
+    """
+    Callback to follow the selection job. Polls the job status while it runs, shows the current stage in the
+    progress bar and publishes the run status once the job is done. Also handles the cancel button.
+    """
+    if not run_job:
+        raise PreventUpdate
+    if run_job["job_id"] is None:
+        # Bundle opened by run_selection
+        return run_job["run_status"], 100, "Opened" if run_job["run_status"]["pimms"] else "Failed", False, True
+    jobs_dir = get_session_dir(session_id).joinpath("jobs")
+    job_id = run_job["job_id"]
+
+    trigger = callback_context.triggered[0]['prop_id'].split('.')[0]
+    if trigger == "run-cancel-button":
+        job_manager.cancel(jobs_dir, job_id)
+
+    status = jobs.get_status(jobs_dir, job_id)
+    state = status.get("state", jobs.QUEUED)
+    n_stages = status.get("n_stages") or 1
+    progress = int(100 * status.get("stage_index", 0) / n_stages)
+
+    if state == jobs.DONE:
+        return status["result"], 100, "Done", False, True
+    elif state == jobs.FAILED:
+        run_status = {'pimms': False, 'gff_control': None, 'gff_test': None, 'deseq': None, "control-run": False}
+        return run_status, 100, "Failed", False, True
+    elif state == jobs.CANCELLED:
+        return no_update, 0, "Cancelled", True, True
+    elif state == jobs.QUEUED:
+        return no_update, 0, "Queued", True, False
+    return no_update, progress, f"{status.get('stage', '').capitalize()}...", True, False
+
+
+@app.callback(
+    [Output("bundle-feedback", "children"),
+     Output("bundle-dropdown", "options")],
+    [Input("bundle-export-button", "n_clicks"),
+     Input("session-id", "data"),
+     State("bundle-name-input", "value"),
+     State("run-status", "data")],
+)
+def export_bundle(export_clicks, session_id, bundle_name, run_status):
+    """
+    Callback to export the session datasets of the last run as a project bundle. Also lists the available bundles
+    when the page loads.
+    """
+    message = no_update
+    if callback_context.triggered[0]['prop_id'].split('.')[0] == "bundle-export-button":
+        if not run_status or not run_status['pimms']:
+            message = "Run a selection before exporting a bundle"
+        else:
+            try:
+                bundle.export_session(session_id, BUNDLE_PATH.joinpath(bundle.check_name(bundle_name)), run_status)
+                message = f"Exported bundle {bundle_name}"
+            except (OSError, ValueError) as e:
+                message = f"Export failed: {e}"
+    options = [{'label': f"{entry['name']} ({entry['created']})", 'value': entry['name']}
+               for entry in bundle.list_bundles(BUNDLE_PATH)]
+    return message, options
 
 
 @app.callback(
@@ -0,0 +1,169 @@
+"""
+The "Run Selection" pipeline. Parses and merges the selected PIMMS files, loads the coordinate gffs, calculates the
+comparison metrics, runs DESeq2 and persists the results to the session store. Runs as a background job, see jobs.
+"""
+import logging
+
+from utils import GffDataFrame, InsertionIndex, InsertionPyramid, LocusIndex, PIMMSDataFrame, VennIndex, \
+    gene_insert_stats, get_deseq_pool, remove_data, store_data
+
+# Stages reported to the job status, in run order
+STAGES = ["coordinate gffs", "parse control", "parse test", "merge", "metrics", "DESeq", "gene insert stats", "persist"]
+
+# Session datasets written by build_selection
+DATASETS = [
+    "pimms_df", "locus_index", "venn_index", "gene_insert_stats",
+    "gff_df_control", "insert_index_control", "insert_lod_control",
+    "gff_df_test", "insert_index_test", "insert_lod_test",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def init_job_worker():
+    """
+    Job process initializer. Starts the DESeq2 pool of the job process, sized by DESEQ_WORKERS, so R and DESeq2
+    load before the first run.
+    """
+    get_deseq_pool()
+
+
+def run_selection(job, session_id, control_path=None, test_path=None, control_gff_path=None, test_gff_path=None,
+                  run_deseq=True, deseq_filtering=True, control_run=False):
+    """
+    Run the selection pipeline and store the results under the session id.
+    :param job: jobs.JobContext used to report stages
+    :param session_id: uuid of session
+    See build_selection for the other parameters.
+    :return: run status dict
+    """
+    run_status, to_store = build_selection(job, control_path, test_path, control_gff_path, test_gff_path, run_deseq,
+                                           deseq_filtering, control_run)
+
+    # Datasets are persisted together at the end so a cancelled run leaves the previous session data intact
+    job.stage("persist")
+    for name, data in to_store.items():
+        store_data(data, name, session_id)
+    # Datasets of the previous run that this run did not produce
+    for name in DATASETS:
+        if name not in to_store:
+            remove_data(name, session_id)
+    return run_status
+
+
+def selection_datasets(run_status):
+    """
+    Names of the datasets a run stored, as build_selection stores them for its run status.
+    :param run_status: run status dict
+    :return: list of dataset names
+    """
+    datasets = []
+    if run_status.get("pimms"):
+        datasets += ["pimms_df", "locus_index"]
+        if not run_status.get("control-run"):
+            datasets.append("venn_index")
+    for condition in ["control", "test"]:
+        if run_status.get(f"gff_{condition}"):
+            datasets += [f"gff_df_{condition}", f"insert_index_{condition}", f"insert_lod_{condition}"]
+    if run_status.get("pimms") and (run_status.get("gff_control") or run_status.get("gff_test")):
+        datasets.append("gene_insert_stats")
+    return datasets
+
+
+def build_selection(job, control_path=None, test_path=None, control_gff_path=None, test_gff_path=None,
+                    run_deseq=True, deseq_filtering=True, control_run=False):
+    """
+    Parse, merge and analyse the selected files without storing anything, shared by run_selection and the batch
+    command line.
+    :param job: object with a stage(name) method called as each stage starts, e.g. jobs.JobContext
+    :param control_path: path to control PIMMS csv/excel
+    :param test_path: path to test PIMMS csv/excel
+    :param control_gff_path: path to control coordinate gff
+    :param test_gff_path: path to test coordinate gff
+    :param run_deseq: run DESeq2 on the mutant pools
+    :param deseq_filtering: use DESeq2 default outlier removal and independent filtering
+    :param control_run: process the control file alone when no test file is selected
+    :return: run status dict, dict of dataset name to the object stored under it. The errors entry of the run
+    status maps each failed step, pimms, gff_control or gff_test, to an error message string.
+    """
+    # Create empty run status
+    run_status = {'pimms': None, 'gff_control': None, 'gff_test': None, 'deseq': None, "control-run": False,
+                  'errors': {}}
+    to_store = {}
+
+    if control_gff_path is not None or test_gff_path is not None:
+        job.stage("coordinate gffs")
+    # Read control coordinate gff file
+    if control_gff_path is not None:
+        try:
+            gff_df = GffDataFrame(control_gff_path)
+            to_store['insert_index_control'] = InsertionIndex.from_gff(gff_df)
+            to_store['insert_lod_control'] = InsertionPyramid.from_index(to_store['insert_index_control'])
+            to_store['gff_df_control'] = gff_df
+            run_status['gff_control'] = True
+        except Exception as e:
+            logger.exception("Reading the control coordinate gff %s failed", control_gff_path)
+            run_status['gff_control'] = False
+            run_status['errors']['gff_control'] = f"{type(e).__name__}: {e}"
+
+    # Read test coordinate gff file
+    if test_gff_path is not None:
+        try:
+            gff_df = GffDataFrame(test_gff_path)
+            to_store['insert_index_test'] = InsertionIndex.from_gff(gff_df)
+            to_store['insert_lod_test'] = InsertionPyramid.from_index(to_store['insert_index_test'])
+            to_store['gff_df_test'] = gff_df
+            run_status['gff_test'] = True
+        except Exception as e:
+            logger.exception("Reading the test coordinate gff %s failed", test_gff_path)
+            run_status['gff_test'] = False
+            run_status['errors']['gff_test'] = f"{type(e).__name__}: {e}"
+
+    # Read pimms csv files
+    if test_path is not None and control_path is not None:
+        try:
+            job.stage("parse control")
+            df_control = PIMMSDataFrame.read_input(control_path)
+            job.stage("parse test")
+            df_test = PIMMSDataFrame.read_input(test_path)
+            job.stage("merge")
+            merged = PIMMSDataFrame.merge_inputs(df_control, df_test)
+            job.stage("metrics")
+            pimms_df = PIMMSDataFrame(control_path, test_path, data=merged, deseq_filtering=deseq_filtering)
+            if run_deseq:
+                job.stage("DESeq")
+                pimms_df.deseq_run_logs = pimms_df.run_DESeq()
+            to_store['pimms_df'] = pimms_df
+            # Sorted filter columns, read by the Venn tab for every slider position
+            to_store['venn_index'] = VennIndex.from_pimms(pimms_df)
+            run_status['pimms'] = True
+            run_status['deseq'] = pimms_df.deseq_run_logs
+        except Exception as e:
+            logger.exception("Processing the PIMMS files %s and %s failed", control_path, test_path)
+            run_status['pimms'] = False
+            run_status['errors']['pimms'] = f"{type(e).__name__}: {e}"
+    elif control_run and control_path is not None:
+        try:
+            job.stage("parse control")
+            pimms_df = PIMMSDataFrame(control_path, test_path=None)
+            to_store['pimms_df'] = pimms_df
+            run_status['pimms'] = True
+            run_status['deseq'] = pimms_df.deseq_run_logs
+            run_status["control-run"] = True
+        except Exception as e:
+            logger.exception("Processing the PIMMS file %s failed", control_path)
+            run_status['pimms'] = False
+            run_status['errors']['pimms'] = f"{type(e).__name__}: {e}"
+
+    # Start sorted loci, read by the NIM Comparison view for the visible window
+    if 'pimms_df' in to_store:
+        to_store['locus_index'] = LocusIndex.from_pimms(to_store['pimms_df'])
+
+    # Inserts per gene, read by the GeneViewer for the selected gene
+    insert_indexes = {condition: to_store[f'insert_index_{condition}'] for condition in ["control", "test"]
+                      if f'insert_index_{condition}' in to_store}
+    if 'pimms_df' in to_store and insert_indexes:
+        job.stage("gene insert stats")
+        to_store['gene_insert_stats'] = gene_insert_stats(to_store['pimms_df'], insert_indexes)
+
+    return run_status, to_store
@@ -0,0 +1,90 @@
+"""
+Production entry point. Serves the Dash server with gunicorn: the app is imported once in the master process and
+forked into the web workers, so pandas, plotly and the dashboard modules are loaded a single time per instance.
+
+Session data, background jobs and the DESeq2 cache all live on disk, so any worker can serve any request of a
+session. Long running work, "Run Selection" and DESeq2, runs in job processes and never blocks a web worker.
+
+Usage:
+    python serve.py [--bind 0.0.0.0:8050] [--workers 4] [--threads 4] [--timeout 120]
+
+Graceful restart: send SIGHUP to the master to replace the workers after finishing in-flight requests. With the
+app preloaded HUP keeps the loaded code, to deploy new code start a new master (SIGUSR2) then stop the old one
+(SIGWINCH, then SIGQUIT).
+"""
+import argparse
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+def default_options():
+    """ Gunicorn settings, each can be overridden by a PIMMS_* environment variable."""
+    return {
+        "bind": os.environ.get("PIMMS_BIND", "0.0.0.0:8050"),
+        "workers": int(os.environ.get("PIMMS_WEB_WORKERS", min(2 * multiprocessing.cpu_count() + 1, 8))),
+        "threads": int(os.environ.get("PIMMS_WEB_THREADS", 4)),
+        "timeout": int(os.environ.get("PIMMS_WEB_TIMEOUT", 120)),
+        "graceful_timeout": int(os.environ.get("PIMMS_GRACEFUL_TIMEOUT", 30)),
+        # Recycle workers to bound memory growth, jitter avoids restarting every worker at once
+        "max_requests": int(os.environ.get("PIMMS_MAX_REQUESTS", 1000)),
+        "max_requests_jitter": int(os.environ.get("PIMMS_MAX_REQUESTS_JITTER", 100)),
+        "preload_app": True,
+        "worker_class": "gthread",
+        "accesslog": "-",
+    }
+
+
+class PIMMSApplication(BaseApplication):
+    """
+    Gunicorn application serving the Dash flask server.
+    :param options: gunicorn settings, see default_options
+    """
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+        self.cfg.set("when_ready", when_ready)
+        self.cfg.set("post_fork", post_fork)
+
+    def load(self):
+        # Imported here so the import happens once in the master, before the workers are forked
+        from index import server
+        return server
+
+
+def when_ready(arbiter):
+    """ Clear expired sessions once per instance, before workers start serving."""
+    from utils import session_sweeper
+    session_sweeper.sweep()
+
+
+def post_fork(arbiter, worker):
+    """
+    Start the session sweeper thread in each worker. Threads do not survive fork so it can not start in the master,
+    the sweep lock lets one worker at a time sweep.
+    """
+    from utils import session_sweeper
+    session_sweeper.start()
+
+
+def main():
+    options = default_options()
+    parser = argparse.ArgumentParser(description="Serve the PIMMS dashboard with gunicorn")
+    parser.add_argument("--bind", default=options["bind"], help="address to listen on, host:port")
+    parser.add_argument("--workers", type=int, default=options["workers"], help="web worker processes")
+    parser.add_argument("--threads", type=int, default=options["threads"], help="threads per web worker")
+    parser.add_argument("--timeout", type=int, default=options["timeout"],
+                        help="seconds before a silent worker is killed and restarted")
+    args = parser.parse_args()
+    options.update(vars(args))
+    PIMMSApplication(options).run()
+
+
+if __name__ == '__main__':
+    main()
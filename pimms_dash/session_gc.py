@@ -0,0 +1,230 @@
+"""
+Garbage collection of session data directories. A sweeper thread runs in every web process and removes sessions not
+used within a time to live, sessions larger than the per session quota and, least recently used first, sessions
+over the quota for all sessions together. Sessions are only removed for their size once idle, a session in use keeps
+its data until it stops being used. Session directory modification times record last use, see touch. Dataset files
+shared by hard links, as opened bundles are, do not count towards the quotas.
+
+A lock file in the session root lets one process sweep at a time. Sessions are removed by renaming them out of the
+way first, so a session is either complete or invisible to every worker, then deleting the renamed directory.
+
+Usage:
+    python session_gc.py list
+    python session_gc.py sweep
+"""
+import argparse
+import fcntl
+import json
+import logging
+import os
+import pathlib
+import shutil
+import threading
+import time
+
+import storage
+
+logger = logging.getLogger(__name__)
+
+DELETING_PREFIX = ".deleting-"
+LOCK_NAME = ".sweep.lock"
+STATS_NAME = ".sweep.json"
+
+
+def touch(session_dir):
+    """ Record use of a session, an already removed session is ignored."""
+    try:
+        os.utime(session_dir)
+    except FileNotFoundError:
+        pass
+
+
+def _dir_nbytes(path):
+    """
+    Bytes that removing a directory would free. Files with other hard links, such as the dataset files of an
+    opened bundle, stay on disk after removal and are not counted.
+    """
+    nbytes = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    nbytes += _dir_nbytes(entry.path)
+                else:
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_nlink == 1:
+                        nbytes += stat.st_size
+    except FileNotFoundError:
+        pass
+    return nbytes
+
+
+class SessionSweeper:
+    """
+    Removes expired and oversized session directories.
+    :param session_root: directory holding one directory per session
+    :param ttl: seconds since last use after which a session is removed
+    :param session_max_bytes: disk quota of a single session
+    :param total_max_bytes: disk quota of all sessions together
+    :param interval: seconds between sweeps of the background thread
+    :param idle: seconds since last use after which a session may be removed for exceeding a quota
+    """
+    def __init__(self, session_root, ttl, session_max_bytes, total_max_bytes, interval, idle=10 * 60):
+        self.session_root = pathlib.Path(session_root)
+        self.ttl = ttl
+        self.idle = idle
+        self.session_max_bytes = session_max_bytes
+        self.total_max_bytes = total_max_bytes
+        self.interval = interval
+        self._thread = None
+        self._stop = threading.Event()
+
+    def sessions(self):
+        """ List sessions, least recently used first."""
+        if not self.session_root.exists():
+            return []
+        sessions = []
+        for session_dir in self.session_root.iterdir():
+            if session_dir.name.startswith(".") or not session_dir.is_dir():
+                continue
+            try:
+                last_used = session_dir.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            sessions.append({"session_id": session_dir.name, "bytes": _dir_nbytes(session_dir),
+                             "last_used": last_used})
+        return sorted(sessions, key=lambda session: session["last_used"])
+
+    def remove(self, session_id):
+        """
+        Remove a session directory. The rename is atomic, when two processes remove the same session only one
+        rename succeeds. Returns True if this call removed the session.
+        """
+        deleting_dir = self.session_root.joinpath(f"{DELETING_PREFIX}{session_id}-{os.getpid()}")
+        try:
+            os.rename(self.session_root.joinpath(session_id), deleting_dir)
+        except FileNotFoundError:
+            return False
+        shutil.rmtree(deleting_dir, ignore_errors=True)
+        return True
+
+    def sweep(self, now=None):
+        """
+        Remove expired sessions, then idle sessions over the per session quota, then least recently used idle
+        sessions until all sessions fit the total quota. Skipped, returning None, while another process is sweeping.
+        :return: dict of reclaimed bytes, removed and live sessions, and over quota sessions kept as in use
+        """
+        self.session_root.mkdir(parents=True, exist_ok=True)
+        with open(self.session_root.joinpath(LOCK_NAME), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                return self._sweep(time.time() if now is None else now)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sweep(self, now):
+        reclaimed = 0
+        # Left behind by a process that stopped while deleting
+        for deleting_dir in self.session_root.glob(f"{DELETING_PREFIX}*"):
+            reclaimed += _dir_nbytes(deleting_dir)
+            shutil.rmtree(deleting_dir, ignore_errors=True)
+
+        removed = {"expired": 0, "session_quota": 0, "total_quota": 0}
+        live = []
+        in_use = set()
+        for session in self.sessions():
+            idle = now - session["last_used"] > self.idle
+            if now - session["last_used"] > self.ttl:
+                reason = "expired"
+            elif session["bytes"] > self.session_max_bytes and idle:
+                reason = "session_quota"
+            else:
+                live.append(session)
+                if session["bytes"] > self.session_max_bytes:
+                    in_use.add(session["session_id"])
+                continue
+            if self.remove(session["session_id"]):
+                removed[reason] += 1
+                reclaimed += session["bytes"]
+
+        # Least recently used idle sessions first, sessions in use are kept even while over the total quota
+        total = sum(session["bytes"] for session in live)
+        for session in list(live):
+            if total <= self.total_max_bytes:
+                break
+            if now - session["last_used"] <= self.idle:
+                in_use.add(session["session_id"])
+                continue
+            live.remove(session)
+            if self.remove(session["session_id"]):
+                removed["total_quota"] += 1
+                reclaimed += session["bytes"]
+            total -= session["bytes"]
+
+        stats = {"swept_at": now, "reclaimed_bytes": reclaimed, "removed": removed,
+                 "live_sessions": len(live), "live_bytes": total, "over_quota_in_use": len(in_use)}
+        previous = self.stats()
+        stats["total_reclaimed_bytes"] = previous.get("total_reclaimed_bytes", 0) + reclaimed
+        storage.write_json(self.session_root.joinpath(STATS_NAME), stats)
+        if reclaimed:
+            logger.info("Session sweep reclaimed %s bytes, removed %s, %s sessions live", reclaimed, removed, len(live))
+        if in_use:
+            logger.warning("%s sessions over quota are in use, kept until idle", len(in_use))
+        return stats
+
+    def stats(self):
+        """ Result of the last sweep by any process, empty before the first sweep."""
+        try:
+            with open(self.session_root.joinpath(STATS_NAME)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def start(self):
+        """ Start the background sweeper thread of this process, once."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Session sweep failed")
+
+
+def main():
+    from app import SESSION_DATA_PATH, SESSION_TTL, SESSION_IDLE, SESSION_MAX_BYTES, SESSIONS_MAX_BYTES, \
+        SESSION_SWEEP_INTERVAL
+
+    parser = argparse.ArgumentParser(description="Inspect or sweep session data")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="list sessions")
+    subparsers.add_parser("sweep", help="remove expired and over quota sessions now")
+    args = parser.parse_args()
+
+    sweeper = SessionSweeper(SESSION_DATA_PATH, SESSION_TTL, SESSION_MAX_BYTES, SESSIONS_MAX_BYTES,
+                             SESSION_SWEEP_INTERVAL, idle=SESSION_IDLE)
+    if args.command == "list":
+        for session in sweeper.sessions():
+            last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(session["last_used"]))
+            print(f"{session['session_id']}  {session['bytes']:>12}  {last_used}")
+    elif args.command == "sweep":
+        stats = sweeper.sweep()
+        if stats is None:
+            print("Another process is sweeping")
+        else:
+            print(f"Reclaimed {stats['reclaimed_bytes']} bytes, {stats['live_sessions']} sessions live")
+
+
+if __name__ == '__main__':
+    main()
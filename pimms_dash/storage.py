@@ -0,0 +1,262 @@
+import codecs
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+from pyarrow import feather
+
+
+class SessionStore:
+    """
+    Base class for session storage backends. A stored dataset is a pandas dataframe written to `<name><suffix>`
+    plus a small json sidecar `<name>.meta.json` holding the owning class name, the storage format and the
+    non-dataframe instance attributes. The sidecar is written last so its presence marks a complete dataset.
+    """
+    format = None
+    suffix = None
+
+    def prepare_frame(self, frame):
+        """ Convert the dataframe to the object passed to write_frame. Raise here if the backend can't store it."""
+        return frame
+
+    def write_frame(self, prepared, fh):
+        raise NotImplementedError
+
+    def read_frame(self, path, metadata, columns=None):
+        raise NotImplementedError
+
+    def write(self, path_stem, frame, attributes, kind):
+        """
+        Write dataframe and sidecar metadata for a dataset.
+        :param path_stem: path of the dataset without suffix, e.g. session_dir/pimms_df
+        :param frame: pandas dataframe
+        :param attributes: json serialisable dict of instance attributes
+        :param kind: name of the class the dataset is restored as
+        """
+        path_stem = pathlib.Path(path_stem)
+        prepared = self.prepare_frame(frame)
+        metadata = {
+            "kind": kind,
+            "format": self.format,
+            "dtypes": {str(col): str(dtype) for col, dtype in frame.dtypes.items()},
+            "attributes": attributes,
+        }
+        atomic_write(path_stem.with_name(path_stem.name + self.suffix), lambda fh: self.write_frame(prepared, fh),
+                     mode="wb")
+        write_json(meta_path(path_stem), metadata)
+
+
+class FeatherSessionStore(SessionStore):
+    """
+    Default backend. Stores dataframes as uncompressed Arrow IPC (feather v2) so reads can be memory-mapped and
+    dtypes (including categoricals) round trip exactly.
+    """
+    format = "feather"
+    suffix = ".feather"
+
+    def write(self, path_stem, frame, attributes, kind):
+        try:
+            super().write(path_stem, frame, attributes, kind)
+        except pa.ArrowException:
+            # Mixed type object columns can not be expressed in arrow, keep these datasets readable as json.
+            JsonSessionStore().write(path_stem, frame, attributes, kind)
+
+    def prepare_frame(self, frame):
+        return pa.Table.from_pandas(frame, preserve_index=None)
+
+    def write_frame(self, prepared, fh):
+        feather.write_feather(prepared, fh, compression="uncompressed")
+
+    def read_frame(self, path, metadata, columns=None):
+        table = feather.read_table(str(path), columns=columns, memory_map=True)
+        # split_blocks lets null free numeric columns stay zero-copy views onto the memory map
+        return table.to_pandas(split_blocks=True)
+
+
+class JsonSessionStore(SessionStore):
+    """ Legacy backend storing dataframes as pandas 'split' orient json. Dtypes are restored from the sidecar."""
+    format = "json"
+    suffix = ".json"
+
+    def write_frame(self, prepared, fh):
+        write_frame_json(prepared, codecs.getwriter("utf-8")(fh))
+
+    def read_frame(self, path, metadata, columns=None):
+        frame = pd.read_json(path, orient='split')
+        dtypes = {col: dtype for col, dtype in metadata.get("dtypes", {}).items() if col in frame.columns}
+        try:
+            frame = frame.astype(dtypes)
+        except (TypeError, ValueError):
+            pass
+        if columns is not None:
+            frame = frame[columns]
+        return frame
+
+
+SESSION_STORES = {
+    FeatherSessionStore.format: FeatherSessionStore,
+    JsonSessionStore.format: JsonSessionStore,
+}
+
+
+def get_session_store(name):
+    """ Return an instance of the session storage backend registered under name."""
+    if name not in SESSION_STORES:
+        raise ValueError(f"Unknown session store {name}, expected one of {list(SESSION_STORES)}")
+    return SESSION_STORES[name]()
+
+
+def meta_path(path_stem):
+    path_stem = pathlib.Path(path_stem)
+    return path_stem.with_name(path_stem.name + ".meta.json")
+
+
+def read_metadata(path_stem):
+    with open(meta_path(path_stem)) as f:
+        return json.load(f)
+
+
+def read(path_stem, columns=None):
+    """
+    Read a stored dataset with whichever backend wrote it.
+    :param path_stem: path of the dataset without suffix
+    :param columns: optional subset of columns to read
+    :return: dataframe, metadata dict
+    """
+    path_stem = pathlib.Path(path_stem)
+    metadata = read_metadata(path_stem)
+    store = get_session_store(metadata["format"])
+    frame = store.read_frame(path_stem.with_name(path_stem.name + store.suffix), metadata, columns=columns)
+    return frame, metadata
+
+
+def exists(path_stem):
+    return meta_path(path_stem).exists()
+
+
+def link_dataset(src_stem, dst_stem):
+    """
+    Hard link a stored dataset to another path, copying where the paths are on different file systems. The sidecar
+    is linked last so the destination only reads as complete once its data file is in place. Stored files are
+    replaced rather than modified on every write, so the linked files stay valid while the source is rewritten.
+    :param src_stem: path of the stored dataset without suffix
+    :param dst_stem: destination path without suffix
+    """
+    src_stem, dst_stem = pathlib.Path(src_stem), pathlib.Path(dst_stem)
+    store = get_session_store(read_metadata(src_stem)["format"])
+    for suffix in [store.suffix, ".meta.json"]:
+        src = src_stem.with_name(src_stem.name + suffix)
+        dst = dst_stem.with_name(dst_stem.name + suffix)
+        tmp_path = dst.with_name(f".{dst.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        try:
+            os.replace(tmp_path, dst)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def remove_dataset(path_stem):
+    """
+    Remove a stored dataset, whichever backend wrote it. The sidecar is removed first so the dataset stops reading
+    as complete before its data file goes. Missing datasets are ignored.
+    :param path_stem: path of the dataset without suffix
+    """
+    path_stem = pathlib.Path(path_stem)
+    paths = [meta_path(path_stem)] + [path_stem.with_name(path_stem.name + store.suffix)
+                                      for store in SESSION_STORES.values()]
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def generation(path_stem):
+    """
+    Return a token that changes every time the dataset is rewritten. The sidecar is replaced on every write, so
+    its inode and modification time identify the write, also across worker processes.
+    """
+    stat = os.stat(meta_path(path_stem))
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+# Rows serialised at a time when streaming a dataframe as json
+FRAME_JSON_CHUNK_ROWS = 50000
+
+
+def write_frame_json(frame, fh, chunk_rows=FRAME_JSON_CHUNK_ROWS):
+    """
+    Stream a dataframe to a text file object as pandas 'split' orient json, readable with
+    pd.read_json(orient='split'). Rows are serialised a chunk at a time so the json string of the whole frame is
+    never held in memory.
+    :param frame: pandas dataframe
+    :param fh: text file object
+    :param chunk_rows: rows serialised at a time
+    """
+    def write_chunked(values_of):
+        first = True
+        for start in range(0, len(frame), chunk_rows):
+            chunk = values_of(start, start + chunk_rows).to_json(orient='values', date_format='iso')[1:-1]
+            if chunk:
+                fh.write(chunk if first else "," + chunk)
+                first = False
+
+    fh.write('{"columns":' + pd.Series(frame.columns, dtype=object).to_json(orient='values'))
+    fh.write(',"index":[')
+    write_chunked(lambda start, end: pd.Series(frame.index[start:end], dtype=object))
+    fh.write('],"data":[')
+    write_chunked(lambda start, end: frame.iloc[start:end])
+    fh.write(']}')
+
+
+class _JsonStringWriter:
+    """ Text file object wrapper escaping everything written as the contents of a json string."""
+    def __init__(self, fh):
+        self.fh = fh
+
+    def write(self, text):
+        self.fh.write(json.dumps(text)[1:-1])
+
+
+def write_instance_json(fh, frame, attributes):
+    """
+    Stream a serialised session class to a text file object, a json object of its attributes with the dataframe as
+    split orient json in a '_data' string.
+    :param fh: text file object
+    :param frame: pandas dataframe
+    :param attributes: json serialisable dict of instance attributes
+    """
+    fh.write("{")
+    for key, value in attributes.items():
+        fh.write(f"{json.dumps(key)}: {json.dumps(value)}, ")
+    fh.write('"_data": "')
+    write_frame_json(frame, _JsonStringWriter(fh))
+    fh.write('"}')
+
+
+def write_json(path, obj):
+    """ Atomically replace path with obj serialised as json."""
+    atomic_write(path, lambda fh: json.dump(obj, fh), mode="w")
+
+
+def atomic_write(path, writer, mode="w"):
+    """ Write to a temporary file in the target directory then rename over path, readers never see partial files."""
+    path = pathlib.Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as fh:
+            writer(fh)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
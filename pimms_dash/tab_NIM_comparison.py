@@ -5,8 +5,9 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 
 from app import app
-from utils import PIMMSDataFrame, load_data
-from figures import NIM_comparison_linked
+from utils import load_data, window_loci, relayout_x_range, apply_relayout
+from figures import NIM_comparison_linked, NIM_comparison_bar_gl, NIM_comparison_heatmap, style_NIM_comparison
+from figure_cache import cached_figure
 
 
 NIM_comparison_tab_layout = dbc.Card(
@@ -78,35 +79,90 @@ def create_comparison_subplot(run_status, mode, colors, test_label, control_labe
 
     if run_status["control-run"]:
         return "Control Run: NIM Comparison Not Available"
+    if mode not in ['nim', 'nrm']:
+        raise PreventUpdate
+
+    def build():
+        # Whole genome overview, refined to per locus detail by update_nim_window
+        pimms_df = load_data('pimms_df', session_id)
+        locus_index = load_data('locus_index', session_id)
+        test_col, control_col, title, y_title = score_columns(pimms_df, mode)
+        scores, starts, ends, labels, _ = window_loci(pimms_df, locus_index, [test_col, control_col])
+        fig = NIM_comparison_linked(
+            scores[control_col], scores[test_col], starts, ends, labels, title=title,
+            color_control=colors['control'], color_test=colors['test'],
+            test_label=test_label, control_label=control_label,
+        )
+        fig['layout']['yaxis1'].update(title=y_title)
+        # The range slider spans the genome whatever window is loaded
+        fig['layout']['xaxis3']['rangeslider'].update(range=locus_index.extent())
+        return fig
 
-    data = load_data('pimms_df', session_id)
+    # Colours and labels are applied to the cached figure of the mode
+    fig = cached_figure(session_id, 'NIM_comparison', ['pimms_df', 'locus_index'], [mode], build)
+    style_NIM_comparison(fig, colors['test'], colors['control'], test_label, control_label)
 
-    # Load data from store
-    pimms_df = PIMMSDataFrame.from_json(data)
+    return dcc.Graph(id='NIM-comparison-fig', figure=fig)
 
+
+def score_columns(pimms_df, mode):
+    """
+    Score columns and titles of a NIM Comparison mode.
+    :param pimms_df: PIMMSDataFrame object
+    :param mode: 'nim' or 'nrm'
+    :return: test column, control column, figure title, y axis title
+    """
     if mode == 'nim':
         test_col, control_col = pimms_df.get_NIM_score_columns()
-        title = "NIM Score Across Genome"
-        y_title = "NIM Score"
+        return test_col, control_col, "NIM Score Across Genome", "NIM Score"
     elif mode == 'nrm':
         test_col, control_col = pimms_df.get_NRM_score_columns()
-        title = "NRM Score Across Genome"
-        y_title = "NRM Score"
+        return test_col, control_col, "NRM Score Across Genome", "NRM Score"
     else:
         raise PreventUpdate
 
-    df = pimms_df.get_data()
-    series_control = df[control_col]
-    series_test = df[test_col]
-    fig = NIM_comparison_linked(
-        series_control, series_test, df["start"], df["end"], df["locus_tag"], title=title,
-        color_control=colors['control'], color_test=colors['test'],
-        test_label=test_label, control_label=control_label,
-    )
 
-    fig['layout']['yaxis1'].update(title=y_title)
+@app.callback(
+    Output('NIM-comparison-fig', 'figure'),
+    [Input('NIM-comparison-fig', 'relayoutData')],
+    [State('NIM-comparison-fig', 'figure'),
+     State('nim-comp-radio', 'value'),
+     State('session-id', 'data')],
+    prevent_initial_call=True
+)
+def update_nim_window(relayout_data, fig, mode, session_id):
+    """
+    Callback to redraw the NIM Comparison traces for the visible range after zooming, panning or moving the range
+    slider. Loci are drawn individually once the visible range holds few enough of them, otherwise as windows.
+    :param relayout_data: graph relayout event
+    :param fig: current figure
+    :param mode: NIM Comparison mode
+    :param session_id: uuid of session
+    :return: plotly fig
+    """
+    try:
+        x_range = relayout_x_range(relayout_data or {})
+    except KeyError:
+        raise PreventUpdate
+
+    pimms_df = load_data('pimms_df', session_id)
+    test_col, control_col, _, _ = score_columns(pimms_df, mode)
+    scores, starts, ends, labels, _ = window_loci(pimms_df, load_data('locus_index', session_id),
+                                                  [test_col, control_col], x_range)
+    args = (scores[control_col], scores[test_col], starts, ends, labels, None, None)
+    # Only the data of the bar and heatmap traces is replaced, their style is kept
+    bars = NIM_comparison_bar_gl(*args, get_trace=True)
+    new_traces = [(trace, ["x", "y"]) for trace in bars[:2]]
+    new_traces += [(trace, ["x", "y", "text", "customdata"]) for trace in bars[2:]]
+    new_traces += [(trace, ["x", "z", "customdata"]) for trace in NIM_comparison_heatmap(*args, get_trace=True)]
+    for trace, (new_trace, keys) in zip(fig['data'], new_traces):
+        for key in keys:
+            trace[key] = new_trace[key]
+
+    # Keep the user's view, the returned figure replaces the plotted one
+    apply_relayout(fig['layout'], relayout_data)
+    return fig
 
-    return dcc.Graph(id='NIM-comparison-fig', figure=fig)
 
 @app.callback(
     Output("nim-options-collapse", "is_open"),
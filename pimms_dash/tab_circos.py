@@ -3,9 +3,11 @@ import dash_html_components as html
 import dash_core_components as dcc
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
+# Registers the Circos component scripts with dash, which only happens for libraries imported before the app serves
+import dash_bio  # noqa: F401
 
 from app import app
-from utils import PIMMSDataFrame, load_data
+from utils import load_data
 from circos import pimms_circos
 
 
@@ -66,11 +68,9 @@ def create_circos(run_status, g_len, checkbox, c_metric, session_id):
     if run_status["control-run"]:
         return "Control Run: Circos Not Available"
 
-    data = load_data('pimms_df', session_id)
-
     hide_zeros = 'hide_zero' in checkbox
-    # Load data from dcc.Store
-    pimms_df = PIMMSDataFrame.from_json(data)
+    # Load data from store
+    pimms_df = load_data('pimms_df', session_id)
     NIM_test_col, NIM_control_col = pimms_df.get_NIM_score_columns()
 
     # Calc genome range and limit using slider values
@@ -1,19 +1,28 @@
 import dash_bootstrap_components as dbc
 import dash_html_components as html
+import dash_core_components as dcc
+from dash import callback_context
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 from dash_table.Format import Format, Scheme
 
-from utils import PIMMSDataFrame, load_data
-from figures import main_datatable
+from utils import load_data
+from figures import main_datatable, datatable_tooltips
+from table_query import query_page, page_records, column_ids
+from table_export import export_href, export_link, register_table
 
 from app import app
 
 
+register_table("pimms_table", lambda session_id, params: load_data("pimms_df", session_id).get_data())
+
+
 datatable_tab_layout = dbc.Card(
     dbc.CardBody(
         [
-            html.Div("No Input Data Loaded", id="tab1-datatable-div")
+            html.Div("No Input Data Loaded", id="tab1-datatable-div"),
+            # Dataset index of the selected row, kept while paging away from the page holding the row
+            dcc.Store(id="main-datatable-selected-id"),
         ]
     ),
     className="mt-3",
@@ -34,9 +43,12 @@ def create_table(run_status, session_id):
     :return:
     """
     if run_status['pimms']:
-        data = load_data("pimms_df", session_id)
-        pimms_df = PIMMSDataFrame.from_json(data)
-        return main_datatable(pimms_df.get_data(), id="main-datatable", row_selectable='single', export_format="xlsx")
+        pimms_df = load_data("pimms_df", session_id)
+        # The export link serves the whole table, the DataTable export button would only see the current page
+        return [
+            export_link("main-datatable-export", export_href("pimms_table", session_id)),
+            main_datatable(pimms_df.get_data(), id="main-datatable", server_side=True, row_selectable='single'),
+        ]
     else:
         return "No Input Data Found"
 
@@ -46,19 +58,19 @@ def create_table(run_status, session_id):
      Output("main-datatable", "filter_action"),
      Output("main-datatable", "page_size"),
      Output("main-datatable", "columns")],
-    [Input("main-datatable", "selected_rows"),
+    [Input("main-datatable-selected-id", "data"),
      Input("comparison-metric-dropdown", "value"),
      Input("datatable-checklist", "value"),
      Input("datatable-numrows", 'value'),
      State("run-status", "data"),
      State("session-id", "data")]
 )
-def style_table(selected_rows, c_metric, checked_options, num_rows, run_status, session_id):
+def style_table(selected_id, c_metric, checked_options, num_rows, run_status, session_id):
     """
     This Callback adds highlighting to datatable.
     1. Highlights the rows where one NIM score is 0 and other is >0.
     2. Highlights any selected columns
-    :param selected_columns: list of columns selected in dataframe
+    :param selected_id: dataset index of the selected row
     :param c_metric: selected comparison metric
     :param checked_options: list of check values from datatable checkbox
     :param num_rows: number of rows in table
@@ -74,13 +86,12 @@ def style_table(selected_rows, c_metric, checked_options, num_rows, run_status,
         raise PreventUpdate
 
     # read data from data store
-    data = load_data("pimms_df", session_id)
-    pimms_df = PIMMSDataFrame.from_json(data)
+    pimms_df = load_data("pimms_df", session_id)
     NIM_test_col, NIM_control_col = pimms_df.get_NIM_score_columns()
 
     # Add filter row
     if "filter" in checked_options:
-        filter_action = "native"
+        filter_action = "custom"
     else:
         filter_action = "none"
 
@@ -110,12 +121,69 @@ def style_table(selected_rows, c_metric, checked_options, num_rows, run_status,
                     "if": {"filter_query": f"({{{NIM_control_col}}} = 0 and {{{NIM_test_col}}} > 0) or \
                                              ({{{NIM_control_col}}} > 0 and {{{NIM_test_col}}} = 0)"},
                     "backgroundColor": "#EDFFEC"})
-    if selected_rows != None:
-        for row_i in selected_rows:
-            locus_tag = pimms_df.get_data().at[row_i, "locus_tag"]
-            style_data_conditional.append({
-                    'if': {'filter_query': f'{{locus_tag}} eq "{locus_tag}"'},
-                    "background_color": "#D2F3FF",
-                    'fontWeight': 'bold',
-                })
-    return style_data_conditional, filter_action, page_size, columns
\ No newline at end of file
+    if selected_id is not None:
+        style_data_conditional.append({
+                'if': {'filter_query': f'{{id}} = {selected_id}'},
+                "background_color": "#D2F3FF",
+                'fontWeight': 'bold',
+            })
+    return style_data_conditional, filter_action, page_size, columns
+
+
+@app.callback(
+    [Output("main-datatable", "data"),
+     Output("main-datatable", "page_count"),
+     Output("main-datatable", "tooltip_data"),
+     Output("main-datatable", "selected_rows"),
+     Output("main-datatable-export", "href")],
+    [Input("main-datatable", "page_current"),
+     Input("main-datatable", "page_size"),
+     Input("main-datatable", "sort_by"),
+     Input("main-datatable", "filter_query"),
+     Input("main-datatable", "filter_action"),
+     Input("main-datatable", "columns")],
+    [State("main-datatable-selected-id", "data"),
+     State("session-id", "data")],
+    prevent_initial_call=True
+)
+def page_table(page_current, page_size, sort_by, filter_query, filter_action, columns, selected_id, session_id):
+    """
+    Server side paging callback. Filters and sorts the stored dataset and returns the rows of the current page, and
+    points the export link at the whole table as filtered and sorted.
+    :param page_current: current page number
+    :param page_size: number of rows in table
+    :param sort_by: list of sorted columns
+    :param filter_query: datatable filter query
+    :param filter_action: filter query is ignored while the filter row is hidden
+    :param columns: displayed columns, only these are sent to the browser
+    :param selected_id: dataset index of the selected row, reselected if on the page
+    :param session_id: uuid of session
+    :return:
+    """
+    pimms_df = load_data("pimms_df", session_id)
+    if filter_action != "custom":
+        filter_query = None
+    page, page_count = query_page(pimms_df.get_data(), page_current, page_size, sort_by, filter_query)
+    selected_rows = [i for i, row_id in enumerate(page.index) if row_id == selected_id]
+    href = export_href("pimms_table", session_id, sort_by, filter_query, column_ids(columns))
+    return page_records(page, column_ids(columns)), page_count, datatable_tooltips(page), selected_rows, href
+
+
+@app.callback(
+    Output("main-datatable-selected-id", "data"),
+    [Input("main-datatable", "selected_row_ids"),
+     Input("run-status", "data")],
+    [State("main-datatable-selected-id", "data")],
+    prevent_initial_call=True
+)
+def store_selected_row(selected_row_ids, run_status, selected_id):
+    """
+    Keep the dataset index of the selected row. Row ids are cleared while the selected row is on another page, so
+    only new selections are stored. New run data clears the selection.
+    """
+    trigger = callback_context.triggered[0]['prop_id'].split('.')[0]
+    if trigger == "run-status":
+        return None
+    if not selected_row_ids or selected_row_ids[0] == selected_id:
+        raise PreventUpdate
+    return selected_row_ids[0]
\ No newline at end of file
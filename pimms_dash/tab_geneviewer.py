@@ -3,14 +3,23 @@ import dash_html_components as html
 import dash_core_components as dcc
 from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
-from dash import callback_context
+from dash import callback_context, no_update
 
 import numpy as np
 import pandas as pd
 
 from app import app
-from utils import PIMMSDataFrame, GffDataFrame, load_data
-from figures import main_datatable, mpl_needleplot
+from utils import load_data, store_data
+from figures import main_datatable, needleplot, style_needleplot, datatable_tooltips
+from table_query import query_page, page_records
+from table_export import export_href, export_link, register_table
+from figure_cache import cached_figure
+
+
+# Inputs of create_needleplot that only restyle the needle plot
+STYLE_INPUTS = ["plot-color-store", "geneviewer-marker-size-input", "geneviewer-stem-line-width-input"]
+
+register_table("geneviewer_table", lambda session_id, params: load_data("geneviewer_table", session_id))
 
 
 geneviewer_tab_layout = dbc.Card(
@@ -111,11 +120,31 @@ geneviewer_tab_layout = dbc.Card(
 )
 
 
+def insert_stats_markdown(gene_stats, condition, label):
+    """
+    Markdown list of the insert statistics of a gene in one condition.
+    :param gene_stats: row of the gene_insert_stats session table
+    :param condition: condition suffix of the statistics columns
+    :param label: phenotype label shown
+    """
+    if f"total_inserts_{condition}" not in gene_stats.index:
+        return f"* {label} Phenotype: **no coordinate gff**"
+    first, last = gene_stats[f"first_insert_{condition}"], gene_stats[f"last_insert_{condition}"]
+    lines = [
+        f"* {label} Phenotype Total Inserts: **{gene_stats[f'total_inserts_{condition}']:g}**",
+        f"* {label} Phenotype Unique Insert Sites: **{gene_stats[f'unique_sites_{condition}']}**",
+        f"* {label} Phenotype Insert Range: **{f'{first} - {last}' if first >= 0 else '-'}**",
+        f"* {label} Phenotype Max Site Count: **{gene_stats[f'max_site_count_{condition}']:g}**",
+        f"* {label} Phenotype Insert Density: **{gene_stats[f'insert_density_{condition}']:.2f}** sites per kb",
+    ]
+    return "\n\n        ".join(lines)
+
+
 @app.callback(
     [Output("tab6-geneviewer-div", "children"),
      Output("geneviewer-markdown", "children"),
      Output("tab6-geneviewer-datatable-div", "children")],
-    [Input("main-datatable", "selected_rows"),
+    [Input("main-datatable-selected-id", "data"),
      Input("plot-color-store", "data"),
      Input("geneviewer-reload-button", "n_clicks"),
      Input("geneviewer-marker-size-input", 'value'),
@@ -124,7 +153,7 @@ geneviewer_tab_layout = dbc.Card(
      State("dashboard-tabs", "active_tab"),
      State("session-id", "data")],
 )
-def create_needleplot(selected_rows, colors, reload_clicks, marker_size, stem_width, run_status, active_tab, session_id):
+def create_needleplot(selected_id, colors, reload_clicks, marker_size, stem_width, run_status, active_tab, session_id):
     """
     Callback to display intergenic mutations when row is selected.
     Also returns markdown of information on needleplot.
@@ -143,13 +172,12 @@ def create_needleplot(selected_rows, colors, reload_clicks, marker_size, stem_wi
                "Select a gene in the DataTable tab", "", ""
     elif trigger == "plot-color-store" and active_tab != "geneviewer":
         raise PreventUpdate
-    elif selected_rows:
-        # Selected row can only be single value - extract from list
-        row_index = selected_rows[0]
+    elif selected_id is not None:
+        # Selected row is the dataset index of the row selected in the main datatable
+        row_index = selected_id
 
         # Load pimms gff
-        data = load_data('pimms_df', session_id)
-        pimms_df = PIMMSDataFrame.from_json(data)
+        pimms_df = load_data('pimms_df', session_id)
 
         # Get gene start and end
         gene_start = pimms_df.get_data().at[row_index, "start"]
@@ -166,38 +194,30 @@ def create_needleplot(selected_rows, colors, reload_clicks, marker_size, stem_wi
         buffer_prc = 0 #Todo control intergenic buffer with slider.
         buffer = buffer_prc * (gene_end - gene_start)
 
+        # Inserts within the gene plus a percentage buffer, views of the session insertion indexes
         if not run_status['control-run']:
-            # Load test coordinate gff
-            data_test = load_data("gff_df_test", session_id)
-            gff_df_test = GffDataFrame.from_json(data_test)
-
-            # get mutations in test from gff df
-            if gff_df_test.empty_score():
-                inserts_data_t = gff_df_test.value_counts('start').reset_index().rename(
-                    columns={"index": "position", "start": "count"})
-            else:
-                inserts_data_t = gff_df_test[['start', 'score']].rename(columns={"start": "position", "score": "count"})
-
-            # tRestrict mutations in test to gene plus a percentage buffer
-            inserts_data_t = inserts_data_t[
-                (inserts_data_t["position"] > (gene_start - buffer)) & (inserts_data_t["position"] < (gene_end + buffer))]
+            inserts_data_t = load_data("insert_index_test", session_id).query(gene_start - buffer, gene_end + buffer)
         else:
             inserts_data_t = pd.DataFrame(columns=['position', 'count'])
+        inserts_data_c = load_data("insert_index_control", session_id).query(gene_start - buffer, gene_end + buffer)
 
-        # Load control coordinate gff
-        data_control = load_data("gff_df_control", session_id)
-        gff_df_control = GffDataFrame.from_json(data_control)
+        if inserts_data_c.empty and inserts_data_t.empty:
+            return f"No Mutations to plot within {gene_label}", "", ""
 
-        # get mutations in control from gff df
-        if gff_df_control.empty_score():
-            inserts_data_c = gff_df_control.value_counts('start').reset_index().rename(
-                columns={"index": "position", "start": "count"})
-        else:
-            inserts_data_c = gff_df_control[['start', 'score']].rename(columns={"start": "position", "score": "count"})
+        def build():
+            inserts = {group: (data["position"].to_numpy(), data["count"].to_numpy())
+                       for group, data in [("Test", inserts_data_t), ("Control", inserts_data_c)] if not data.empty}
+            return needleplot(inserts, gene_label, gene_start, gene_end)
+
+        # Colours, stem width and marker size are applied to the cached figure of the gene
+        datasets = ["pimms_df", "insert_index_control"] + ([] if run_status['control-run'] else ["insert_index_test"])
+        fig = cached_figure(session_id, "needleplot", datasets, [row_index], build)
+        style_needleplot(fig, color_dict=colors, stem_width=stem_width, marker_size=marker_size)
+        graph = dcc.Graph(id='geneviewer-fig', figure=fig)
 
-        # Restrict mutations in control to gene plus a percentage buffer
-        inserts_data_c = inserts_data_c[
-            (inserts_data_c["position"] > (gene_start - buffer)) & (inserts_data_c["position"] < (gene_end + buffer))]
+        # Style changes leave the markdown and table as they are
+        if trigger in STYLE_INPUTS:
+            return graph, no_update, no_update
 
         # Create wide data view for table
         wide_table = inserts_data_c.merge(inserts_data_t, how="outer", on="position")
@@ -208,44 +228,51 @@ def create_needleplot(selected_rows, colors, reload_clicks, marker_size, stem_wi
                       .reset_index(drop=True))
 
         # Create intergenic column to highlight mutations that occur within gene and not buffer.
-        inserts_data_c["within CDS"] = ((inserts_data_c["position"] >= gene_start) & (inserts_data_c["position"] <= gene_end))
-        inserts_data_t["within CDS"] = ((inserts_data_t["position"] >= gene_start) & (inserts_data_t["position"] <= gene_end))
         wide_table["within CDS"] = ((wide_table["position"] >= gene_start) & (wide_table["position"] <= gene_end))
 
-        # Create mutation_data df - Assign group column and append control and test
-        inserts_data_c["group"] = "Control"
-        inserts_data_t["group"] = "Test"
-        mutation_data = inserts_data_t.append(inserts_data_c).sort_values(by="position")
-
-        # Format markdown with mutation counts
+        # Format markdown with the precomputed insert statistics of the gene
+        gene_stats = load_data("gene_insert_stats", session_id).loc[row_index]
         md_text = f"""
         Start Position: **{gene_start}**    End Position: **{gene_end}**
 
-        * Control Phenotype Total Inserts: **{inserts_data_c[inserts_data_c["within CDS"]==True]["count"].sum()}**
-
-        * Control Phenotype Unique Insert Sites: **{len(inserts_data_c[inserts_data_c["within CDS"]==True])}**
-
-        * Test Phenotype Total Inserts: **{inserts_data_t[inserts_data_t["within CDS"]==True]["count"].sum()}**
+        {insert_stats_markdown(gene_stats, "control", "Control")}
 
-        * Test Phenotype Unique Insert Sites: **{len(inserts_data_t[inserts_data_t["within CDS"]==True])}**
+        {insert_stats_markdown(gene_stats, "test", "Test")}
         """
 
-        # Return objects to div children
-        if mutation_data.empty:
-            return f"No Mutations to plot within {gene_label}", "", ""
-        else:
-            needleplot_img = mpl_needleplot(mutation_data, gene_label, gene_start, gene_end, color_dict=colors,
-                                            stem_width=stem_width, marker_size=marker_size)
-            mutation_table = main_datatable(wide_table, id="venn-datatable",
-                           style_table={'height': '100em', 'overflowY': 'auto'},
-                           fixed_rows={"headers":True},
-                           page_size=50,
-                           export_format="xlsx")
-            return html.Img(src=needleplot_img, id='geneviewer-image'), md_text, mutation_table
+        # Table pages are served from the stored table by page_geneviewer_table
+        store_data(wide_table, "geneviewer_table", session_id)
+        mutation_table = main_datatable(wide_table, id="geneviewer-datatable", server_side=True,
+                       style_table={'height': '100em', 'overflowY': 'auto'},
+                       fixed_rows={"headers":True},
+                       page_size=50)
+        # The export link serves the whole table, the DataTable export button would only see the current page
+        export = export_link("geneviewer-datatable-export", export_href("geneviewer_table", session_id))
+        return graph, md_text, [export, mutation_table]
     else:
         raise PreventUpdate
 
 
+@app.callback(
+    [Output("geneviewer-datatable", "data"),
+     Output("geneviewer-datatable", "page_count"),
+     Output("geneviewer-datatable", "tooltip_data"),
+     Output("geneviewer-datatable-export", "href")],
+    [Input("geneviewer-datatable", "page_current"),
+     Input("geneviewer-datatable", "page_size"),
+     Input("geneviewer-datatable", "sort_by"),
+     Input("geneviewer-datatable", "filter_query")],
+    [State("session-id", "data")],
+    prevent_initial_call=True
+)
+def page_geneviewer_table(page_current, page_size, sort_by, filter_query, session_id):
+    """ Server side paging callback of the insert datatable, also points the export link at the filtered table."""
+    page, page_count = query_page(load_data("geneviewer_table", session_id), page_current, page_size, sort_by,
+                                  filter_query)
+    href = export_href("geneviewer_table", session_id, sort_by, filter_query)
+    return page_records(page), page_count, datatable_tooltips(page), href
+
+
 @app.callback(
     Output("geneviewer-datatable-collapse", "is_open"),
     [Input("geneviewer-collapse-button", "n_clicks")],
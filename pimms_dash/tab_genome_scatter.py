@@ -5,8 +5,9 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 
 from app import app
-from utils import GffDataFrame, load_data
-from figures import genome_comparison_scatter
+from utils import load_data, downsample_inserts, relayout_x_range, apply_relayout
+from figures import genome_comparison_scatter, style_genome_comparison_scatter
+from figure_cache import cached_figure
 
 
 genome_scatter_tab_layout = dbc.Card(
@@ -110,23 +111,56 @@ def create_genome_scatter(run_status, checkbox, colors, marker_size, marker_line
     if run_status["control-run"]:
         return "Control Run: Genome Scatter Not Available"
 
-    data_control = load_data("gff_df_control", session_id)
-    data_test = load_data("gff_df_test", session_id)
-    gff_df_control = GffDataFrame.from_json(data_control)
-    gff_df_test = GffDataFrame.from_json(data_test)
-    # Create figure
+    def build():
+        # Whole genome view at the coarsest resolution within the point budget, refined by update_scatter_resolution
+        inserts = [downsample_inserts(load_data(f"insert_index_{group}", session_id),
+                                      load_data(f"insert_lod_{group}", session_id))[:2]
+                   for group in ["control", "test"]]
+        # Placeholder titles, make_subplots adds no title annotation for empty titles
+        fig = genome_comparison_scatter(inserts[0], inserts[1], "Control", "Test")
+        fig.update_layout(height=700)
+        return fig
+
+    # Titles, colours, marker options and the y axis scale are applied to the cached figure
+    datasets = [f"{prefix}_{group}" for prefix in ["insert_index", "insert_lod"] for group in ["control", "test"]]
+    fig = cached_figure(session_id, 'genome_scatter', datasets, [], build)
     control_title = f"Insertions Across {label_control} Phenotype"
     test_title = f"Insertions Across {label_test} Phenotype"
-    fig = genome_comparison_scatter(
-        gff_df_control, gff_df_test, control_title, test_title)
-    # Change to log axis if checked
-    if 'log' in checkbox:
-        fig.update_yaxes(type="log")
-    fig.update_traces(marker_color=colors['control'], marker_line_width=marker_line_width, marker_size=marker_size, row=1)
-    fig.update_traces(marker_color=colors['test'], marker_line_width=marker_line_width, marker_size=marker_size, row=2)
-    fig.update_layout(height=700)
+    style_genome_comparison_scatter(fig, colors['control'], colors['test'], control_title, test_title, marker_size,
+                                    marker_line_width, log='log' in checkbox)
     return dcc.Graph(id='gff-scatter-fig', figure=fig)
 
+
+@app.callback(
+    Output('gff-scatter-fig', 'figure'),
+    [Input('gff-scatter-fig', 'relayoutData')],
+    [State('gff-scatter-fig', 'figure'),
+     State("session-id", "data")],
+    prevent_initial_call=True
+)
+def update_scatter_resolution(relayout_data, fig, session_id):
+    """
+    Callback to redraw the genome scatter at a resolution matched to the visible range after zooming or panning.
+    Binned counts are replaced by the insertion sites once the visible range holds few enough of them.
+    :param relayout_data: graph relayout event
+    :param fig: current figure
+    :param session_id: uuid of session
+    :return: plotly fig
+    """
+    try:
+        x_range = relayout_x_range(relayout_data or {})
+    except KeyError:
+        raise PreventUpdate
+
+    for trace, group in zip(fig['data'], ["control", "test"]):
+        x, y, _ = downsample_inserts(load_data(f"insert_index_{group}", session_id),
+                                     load_data(f"insert_lod_{group}", session_id), x_range)
+        trace['x'], trace['y'] = x, y
+
+    # Keep the user's view, the returned figure replaces the plotted one
+    apply_relayout(fig['layout'], relayout_data)
+    return fig
+
 @app.callback(
     Output("scatter-options-collapse", "is_open"),
     [Input("scatter-collapse-button", "n_clicks")],
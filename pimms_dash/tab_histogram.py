@@ -5,7 +5,7 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 
 from app import app
-from utils import PIMMSDataFrame, load_data
+from utils import load_data
 from figures import histogram, histogram_type2
 
 
@@ -43,10 +43,8 @@ def create_hist(run_status, hist_type, bin_size, session_id):
         return "Control Run: Histogram Not Available"
 
 
-    data = load_data('pimms_df', session_id)
-
     # Load data from store
-    pimms_df = PIMMSDataFrame.from_json(data)
+    pimms_df = load_data('pimms_df', session_id)
     NIM_test_col, NIM_control_col = pimms_df.get_NIM_score_columns()
 
     # Create relevant histogram and return in graph component
@@ -77,11 +75,10 @@ def display_hist_type1(relayoutData, bin_size, session_id):
     :return:
     """
     if relayoutData:
-        data = load_data("pimms_df", session_id)
         if 'autosize' in relayoutData:
             raise PreventUpdate
         # Load data from store
-        pimms_df = PIMMSDataFrame.from_json(data)
+        pimms_df = load_data("pimms_df", session_id)
         NIM_test_col, NIM_control_col = pimms_df.get_NIM_score_columns()
 
         # Create new y range
@@ -6,8 +6,9 @@ from dash.dependencies import Input, Output, State
 import pandas as pd
 
 from app import app
-from utils import PIMMSDataFrame, load_data
-from figures import pca_plot
+from utils import load_data
+from figures import pca_plot, style_pca_plot
+from figure_cache import cached_figure
 
 
 pca_tab_layout = dbc.Card(
@@ -99,21 +100,19 @@ def create_pca_pca(run_status, colors, marker_size, marker_line_width, control_l
     elif run_status["deseq"]["success"] is False:
         return "DESeq run failed"
 
-    data = load_data('pimms_df', session_id)
-
-    # Load data from store
-    pimms_df = PIMMSDataFrame.from_json(data)
-
-    pca_df = pd.DataFrame.from_dict(pimms_df.pca_dict, orient="index")
-    pca_df["group"] = pd.Series(pca_df.index).apply(lambda x: x.split("_")[-1]).to_list()
-    labels = pimms_df.pca_labels
-
-    fig = pca_plot(pca_df, colors["control"], colors["test"], control_label, test_label)
-    fig.update_xaxes(title=labels["x_label"])
-    fig.update_yaxes(title=labels["y_label"])
-
-    fig.update_traces(marker_line_width=marker_line_width, marker_size=marker_size)
+    def build():
+        pimms_df = load_data('pimms_df', session_id)
+        pca_df = pd.DataFrame.from_dict(pimms_df.pca_dict, orient="index")
+        pca_df["group"] = pd.Series(pca_df.index).apply(lambda x: x.split("_")[-1]).to_list()
+        labels = pimms_df.pca_labels
+        fig = pca_plot(pca_df, colors["control"], colors["test"], control_label, test_label)
+        fig.update_xaxes(title=labels["x_label"])
+        fig.update_yaxes(title=labels["y_label"])
+        return fig
 
+    # Colours, labels and marker options are applied to the cached figure
+    fig = cached_figure(session_id, 'pca', ['pimms_df'], [], build)
+    style_pca_plot(fig, colors["control"], colors["test"], control_label, test_label, marker_size, marker_line_width)
     return dcc.Graph(id='pca-scatter-fig', figure=fig)
 
 @app.callback(
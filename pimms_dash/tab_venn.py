@@ -8,8 +8,11 @@ from dash import callback_context
 import numpy as np
 
 from app import app
-from utils import PIMMSDataFrame, load_data, combine_hex_values
-from figures import main_datatable, venn_diagram
+from utils import load_data, combine_hex_values, assign_sets
+from figures import main_datatable, venn_image, datatable_tooltips
+from table_query import query_page, page_records
+from table_export import export_href, export_link, register_table
+from figure_cache import cached
 
 
 venn_tab_layout = dbc.Card(
@@ -143,15 +146,56 @@ venn_tab_layout = dbc.Card(
 )
 
 
+def venn_sets(session_id, thresh_c, slider_c):
+    """
+    Venn set membership of every locus for a slider position, from the session VennIndex. Cached per slider
+    position so the diagram and the table callbacks share it.
+    :param thresh_c: NIM score threshold
+    :param slider_c: [low, high] inserts percentile range
+    :return: control membership, test membership and set label arrays
+    """
+    def build():
+        masks = load_data('venn_index', session_id).membership(thresh_c, slider_c[0], slider_c[1])
+        return masks["control"], masks["test"], assign_sets(masks["control"], masks["test"])
+
+    return cached(session_id, 'venn_sets', ['venn_index'], [thresh_c, tuple(slider_c)], build,
+                  lambda obj: 2 * len(obj[0]) + 8 * len(obj[2]))
+
+
+def venn_table(session_id, thresh_c, slider_c, radioitems):
+    """
+    Rows of the venn datatable for a slider position and set selection, cached so paging reuses it.
+    :param radioitems: set shown, Ab, aB, AB or all
+    :return: dataframe
+    """
+    def build():
+        pimms_df = load_data('pimms_df', session_id)
+        NIM_test_col, NIM_control_col = pimms_df.get_NIM_score_columns()
+        perc_test_cols, perc_control_cols = pimms_df.test_control_cols_containing('insert_posn_as_percentile')
+        df_cols = pimms_df.info_columns + perc_test_cols + perc_control_cols + [NIM_test_col, NIM_control_col]
+        df_cols.pop(0)
+        # Loaded data is shared through the session cache so work on a copy
+        df = pimms_df.get_data()[df_cols].copy()
+        df["_set_"] = venn_sets(session_id, thresh_c, slider_c)[2]
+        # Filter rows. Currently only adjusts table
+        if radioitems != "all":
+            df = df[df["_set_"] == radioitems]
+        return df
+
+    return cached(session_id, 'venn_table', ['pimms_df', 'venn_index'], [thresh_c, tuple(slider_c), radioitems],
+                  build, lambda df: int(df.memory_usage(index=True).sum()))
+
+
+register_table("venn_table", lambda session_id, params: venn_table(session_id, params["thresh_c"], params["slider_c"],
+                                                                   params["radioitems"]))
+
+
 @app.callback(
     [Output("tab3-venn-div", "children"),
-     Output("tab3-venn-label", "children"),
-     Output("tab3-venn-datatable-div", "children")],
+     Output("tab3-venn-label", "children")],
     [Input("run-status", "data"),
      Input('venn-slider', 'value'),
      Input('venn-inserts-slider', 'value'),
-     Input("venn-table-radioitems", "value"),
-     Input("venn-table-checklist", "value"),
      Input('plot-color-store', 'data'),
      Input('venn-color-options', 'value'),
      Input("venn-reload-button", "n_clicks"),
@@ -161,29 +205,18 @@ venn_tab_layout = dbc.Card(
      State('session-id', 'data')],
     prevent_initial_call=True
 )
-def create_venn(run_status, thresh_c, slider_c, radioitems, checklist, colors, color_options,
+def create_venn(run_status, thresh_c, slider_c, colors, color_options,
                 reload_clicks, control_label, test_label, active_tab, session_id):
     """
     Callback to create/update venn diagram when new data in dcc.store or venn options are changed.
-    Also creates the venn datatable below the diagram.
+    Only needs the set sizes, so it returns before create_venn_table has built the table.
     :param thresh_c: NIM score threshold from slider
     :param slider_c: Inserts range from slider
-    :param radioitems: Checklist of venn table options
     :param run_status: dictionary containing run success information
     :param session_id: uuid of session
     :return:
     """
 
-    def assign_set(a, b):
-        if a and b:
-            return "AB"
-        elif a and not b:
-            return "Ab"
-        elif b and not a:
-            return "aB"
-        else:
-            return np.nan
-
     trigger = callback_context.triggered[0]['prop_id'].split('.')[0]
 
     if not run_status or not run_status["pimms"]:
@@ -193,47 +226,27 @@ def create_venn(run_status, thresh_c, slider_c, radioitems, checklist, colors, c
         raise PreventUpdate
 
     if run_status["control-run"]:
-        return "Control Run: Venn Not Available"
+        return "Control Run: Venn Not Available", ""
 
     # Load data from store
-    data = load_data('pimms_df', session_id)
-    pimms_df = PIMMSDataFrame.from_json(data)
+    pimms_df = load_data('pimms_df', session_id)
 
     # Get appropriate column names
     NIM_test_col, NIM_control_col = pimms_df.get_NIM_score_columns()
-    perc_test_cols, perc_control_cols = pimms_df.test_control_cols_containing('insert_posn_as_percentile')
 
-    # Create an unique identifier column
-    pimms_df.insert_column('unique', np.arange(len(pimms_df)).astype(str))
-
-    # Apply filters to get sets
-    df = pimms_df.get_data().copy(deep=True)
-    df["_control_set_"] = np.where(
-        ((df[NIM_control_col] <= thresh_c) &
-         (df[perc_control_cols[0]] >= slider_c[0]) &
-         (df[perc_control_cols[1]] <= slider_c[1])),
-        True,
-        False
-    )
-    df["_test_set_"] = np.where(
-        ((df[NIM_test_col] <= thresh_c) &
-         (df[perc_test_cols[0]] >= slider_c[0]) &
-         (df[perc_test_cols[1]] <= slider_c[1])),
-        True,
-        False
-    )
-    df["_set_"] = df.apply(lambda row: assign_set(row["_control_set_"], row["_test_set_"]), axis=1)
-
-    # Create Venn
-    control_set = df[df["_control_set_"] == True]['unique']
-    test_set = df[df["_test_set_"] == True]['unique']
+    # Set sizes, only these and the styling shape the diagram
+    in_control, in_test, _ = venn_sets(session_id, thresh_c, slider_c)
+    AB = np.count_nonzero(in_control & in_test)
+    Ab = np.count_nonzero(in_control) - AB
+    aB = np.count_nonzero(in_test) - AB
+
     if color_options and ('mixed' in color_options):
         mixed_color = combine_hex_values({colors["control"]: 0.5, colors["test"]: 0.5})
-        color_list = [colors["control"], colors["test"], mixed_color]
+        color_list = (colors["control"], colors["test"], mixed_color)
     else:
         color_list=None
 
-    venn_img = venn_diagram(control_set, test_set, set_labels=(control_label, test_label), color_list=color_list)
+    venn_img = venn_image(Ab, aB, AB, set_labels=(control_label, test_label), color_list=color_list)
 
     # Create Venn Label
     label = dcc.Markdown(f"""
@@ -248,13 +261,36 @@ def create_venn(run_status, thresh_c, slider_c, radioitems, checklist, colors, c
     * All Inserts within {slider_c[0]}th to {slider_c[1]}th percentile range
     """)
 
-    # Filter rows. Currently only adjusts table, Move prior to creating venn_img to change diagram using radioitems.
-    if radioitems != "all":
-        df = df[df["_set_"] == radioitems]
+    return html.Img(src=venn_img, id='venn-image'), label
+
+
+@app.callback(
+    Output("tab3-venn-datatable-div", "children"),
+    [Input("run-status", "data"),
+     Input('venn-slider', 'value'),
+     Input('venn-inserts-slider', 'value'),
+     Input("venn-table-radioitems", "value"),
+     Input("venn-table-checklist", "value"),
+     Input("venn-reload-button", "n_clicks"),
+     Input("venn-datatable-collapse", "is_open"),
+     State('session-id', 'data')],
+    prevent_initial_call=True
+)
+def create_venn_table(run_status, thresh_c, slider_c, radioitems, checklist, reload_clicks, table_open, session_id):
+    """
+    Callback to create the venn datatable below the diagram. The table is only built while its collapse is open,
+    opening it builds the table for the current sliders. Only the first page is sent, page_venn_table serves the
+    others.
+    :param radioitems: Checklist of venn table options
+    :param table_open: whether the venn table collapse is open
+    :return:
+    """
+    if not run_status or not run_status["pimms"] or run_status["control-run"] or not table_open:
+        raise PreventUpdate
 
-    # Create Venn datatable
-    df_cols = pimms_df.info_columns + perc_test_cols + perc_control_cols + [NIM_test_col, NIM_control_col, "_set_"]
-    df_cols.pop(0)
+    pimms_df = load_data('pimms_df', session_id)
+    perc_test_cols, perc_control_cols = pimms_df.test_control_cols_containing('insert_posn_as_percentile')
+    df = venn_table(session_id, thresh_c, slider_c, radioitems)
 
     style_data_conditional = []
     # If displaying all sets style by set
@@ -291,14 +327,38 @@ def create_venn(run_status, thresh_c, slider_c, radioitems, checklist, colors, c
         )
 
 
-    table = main_datatable(df[df_cols], id="venn-datatable",
+    table = main_datatable(df, id="venn-datatable", server_side=True,
                            style_data_conditional=style_data_conditional,
                            style_table={'height': '100em', 'overflowY': 'auto'},
                            fixed_rows={"headers":True},
-                           page_size=50,
-                           export_format="xlsx")
+                           page_size=50)
+    # The export link serves the whole table, the DataTable export button would only see the current page
+    href = export_href("venn_table", session_id, thresh_c=thresh_c, slider_c=slider_c, radioitems=radioitems)
+    return [export_link("venn-datatable-export", href), table]
+
 
-    return html.Img(src=venn_img, id='venn-image'), label, table
+@app.callback(
+    [Output("venn-datatable", "data"),
+     Output("venn-datatable", "page_count"),
+     Output("venn-datatable", "tooltip_data"),
+     Output("venn-datatable-export", "href")],
+    [Input("venn-datatable", "page_current"),
+     Input("venn-datatable", "page_size"),
+     Input("venn-datatable", "sort_by"),
+     Input("venn-datatable", "filter_query")],
+    [State('venn-slider', 'value'),
+     State('venn-inserts-slider', 'value'),
+     State("venn-table-radioitems", "value"),
+     State("session-id", "data")],
+    prevent_initial_call=True
+)
+def page_venn_table(page_current, page_size, sort_by, filter_query, thresh_c, slider_c, radioitems, session_id):
+    """ Server side paging callback of the venn datatable, also points the export link at the filtered table."""
+    page, page_count = query_page(venn_table(session_id, thresh_c, slider_c, radioitems), page_current, page_size,
+                                  sort_by, filter_query)
+    href = export_href("venn_table", session_id, sort_by, filter_query, thresh_c=thresh_c, slider_c=slider_c,
+                       radioitems=radioitems)
+    return page_records(page), page_count, datatable_tooltips(page), href
 
 
 @app.callback(
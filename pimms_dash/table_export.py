@@ -0,0 +1,88 @@
+"""
+Server side export of the data tables. With server side paging the DataTable export button only sees the page in the
+browser, so each table has an export link to a flask route that filters and sorts the whole stored table with
+table_query and returns it as an xlsx workbook.
+"""
+import io
+import json
+import urllib.parse
+import uuid
+
+import flask
+import dash_bootstrap_components as dbc
+import dash_html_components as html
+
+from app import server
+from table_query import query_view
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Exportable tables, name to source(session_id, params) returning the dataframe of the table
+TABLE_SOURCES = {}
+
+
+def register_table(name, source):
+    """
+    Make a table exportable.
+    :param name: table name used in the export url
+    :param source: function(session_id, params) returning the table dataframe, params is the dict of extra
+    parameters passed to export_href
+    """
+    TABLE_SOURCES[name] = source
+
+
+def export_href(name, session_id, sort_by=None, filter_query=None, columns=None, **params):
+    """
+    Export url of a table as currently sorted and filtered in its DataTable.
+    :param name: registered table name
+    :param session_id: uuid of session
+    :param sort_by: DataTable sort_by
+    :param filter_query: DataTable filter_query
+    :param columns: optional list of the column ids to export, in order
+    :param params: json serialisable parameters passed to the table source
+    :return: url
+    """
+    query = {
+        "session": session_id,
+        "sort": json.dumps(sort_by or []),
+        "filter": filter_query or "",
+        "columns": json.dumps(columns),
+        "params": json.dumps(params),
+    }
+    return f"/export/{name}.xlsx?" + urllib.parse.urlencode(query)
+
+
+def export_link(id, href):
+    """ Export button of a table, a link to export_href."""
+    return html.A(dbc.Button("Export", color="dark", outline=True, size="sm"), id=id, href=href, download="",
+                  className="mb-2", style={"display": "inline-block"})
+
+
+@server.route("/export/<name>.xlsx")
+def export_table(name):
+    """ Return the whole of a registered table, filtered and sorted as given by the query string, as xlsx."""
+    if name not in TABLE_SOURCES:
+        flask.abort(404)
+    args = flask.request.args
+    try:
+        session_id = str(uuid.UUID(args["session"]))
+        sort_by = json.loads(args.get("sort") or "[]")
+        columns = json.loads(args.get("columns") or "null")
+        params = json.loads(args.get("params") or "{}")
+    except (KeyError, ValueError):
+        flask.abort(400)
+    try:
+        df = TABLE_SOURCES[name](session_id, params)
+    except FileNotFoundError:
+        flask.abort(404)
+    except (KeyError, TypeError):
+        # Missing or malformed table parameters
+        flask.abort(400)
+
+    view = query_view(df, sort_by, args.get("filter"))
+    if columns:
+        view = view[[col for col in columns if col in view.columns]]
+    buffer = io.BytesIO()
+    view.to_excel(buffer, index=False)
+    return flask.Response(buffer.getvalue(), mimetype=XLSX_MIMETYPE,
+                          headers={"Content-Disposition": f'attachment; filename="{name}.xlsx"'})
@@ -0,0 +1,145 @@
+"""
+Server side paging, sorting and filtering for DataTables with page_action, sort_action and filter_action set to
+'custom'. DataTable filter_query strings are translated into vectorised pandas masks over the session dataset and
+only the visible page is sent to the browser.
+"""
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+# DataTable relational operators, as written by the filter row. Named operators take an optional 'i' (case
+# insensitive) or 's' (case sensitive) prefix from the filter row case toggle, unprefixed operators are case sensitive
+_FILTER_OPERATOR = re.compile(
+    r"^(?:(?P<case>[is])?(?P<name>eq|ne|lt|le|gt|ge|contains)|(?P<symbol>>=|<=|!=|<|>|=)|(?P<date>datestartswith))"
+    r"(?=\s|$)", re.IGNORECASE)
+_SYMBOLS = {">=": "ge", "<=": "le", "!=": "ne", "<": "lt", ">": "gt", "=": "eq"}
+
+_FILTER_PART = re.compile(r"^\{(?P<column>[^}]+)\}\s*(?P<rest>.*)$")
+
+
+def split_filter_part(filter_part):
+    """
+    Split one filter expression, e.g. '{NIM_score_control} > 5' or '{gene} icontains dna', into its parts.
+    :param filter_part: single expression of a filter_query
+    :return: column name, operator, value, case insensitive flag. Operator is None if the expression can not be
+    parsed.
+    """
+    match = _FILTER_PART.match(filter_part.strip())
+    if match is None:
+        return None, None, None, False
+    column, rest = match.group("column"), match.group("rest").strip()
+    if rest in ("is blank", "is nil"):
+        return column, "blank", None, False
+    match = _FILTER_OPERATOR.match(rest)
+    if match is None:
+        return column, None, None, False
+    if match.group("symbol"):
+        operator = _SYMBOLS[match.group("symbol")]
+    elif match.group("date"):
+        operator = "datestartswith"
+    else:
+        operator = match.group("name").lower()
+    value = rest[match.end():].strip()
+    if len(value) > 1 and value[0] == value[-1] and value[0] in "\"'`":
+        value = value[1:-1]
+    return column, operator, value, (match.group("case") or "").lower() == "i"
+
+
+def filter_mask(df, filter_query):
+    """
+    Boolean mask of the rows of df matching a DataTable filter_query. Expressions are joined with '&&'. Expressions
+    that can not be parsed, use an unsupported operator or name an unknown column match no rows, so a query is never
+    shown as applied when it was not. Missing values only match 'is blank'.
+    :param df: pandas dataframe
+    :param filter_query: DataTable filter_query string
+    :return: numpy boolean array
+    """
+    mask = np.ones(len(df), dtype=bool)
+    if not filter_query:
+        return mask
+    for filter_part in filter_query.split(" && "):
+        column, operator, value, case_insensitive = split_filter_part(filter_part)
+        if operator is None or column not in df.columns:
+            return np.zeros(len(df), dtype=bool)
+        series = df[column]
+        if operator == "blank":
+            part_mask = series.isna() | (series.astype(str) == "")
+            mask &= np.asarray(part_mask, dtype=bool)
+            continue
+        present = series.notna().to_numpy()
+        if operator in ("contains", "datestartswith") or not pd.api.types.is_numeric_dtype(series) or \
+                pd.api.types.is_bool_dtype(series):
+            strings = series.astype(str)
+            if case_insensitive:
+                strings, value = strings.str.lower(), value.lower()
+            if operator == "contains":
+                part_mask = strings.str.contains(value, regex=False)
+            elif operator == "datestartswith":
+                part_mask = strings.str.startswith(value)
+            else:
+                part_mask = getattr(strings, operator)(value)
+        else:
+            try:
+                value = float(value)
+            except ValueError:
+                return np.zeros(len(df), dtype=bool)
+            part_mask = getattr(series, operator)(value)
+        mask &= present & np.asarray(part_mask, dtype=bool)
+    return mask
+
+
+def query_page(df, page_current=0, page_size=15, sort_by=None, filter_query=None):
+    """
+    Filter, sort and page a dataframe as requested by a DataTable.
+    :param df: pandas dataframe
+    :param page_current: zero based page number
+    :param page_size: rows per page
+    :param sort_by: DataTable sort_by list of {'column_id', 'direction'} dicts
+    :param filter_query: DataTable filter_query string
+    :return: page dataframe, number of pages
+    """
+    view = query_view(df, sort_by, filter_query)
+    page_size = max(int(page_size or 1), 1)
+    page_count = max(math.ceil(len(view) / page_size), 1)
+    page_current = min(max(int(page_current or 0), 0), page_count - 1)
+    start = page_current * page_size
+    return view.iloc[start:start + page_size], page_count
+
+
+def query_view(df, sort_by=None, filter_query=None):
+    """
+    Filter and sort a dataframe as requested by a DataTable, without paging.
+    :param df: pandas dataframe
+    :param sort_by: DataTable sort_by list of {'column_id', 'direction'} dicts
+    :param filter_query: DataTable filter_query string
+    :return: dataframe
+    """
+    mask = filter_mask(df, filter_query)
+    view = df if mask.all() else df[mask]
+
+    sort_by = [col for col in (sort_by or []) if col["column_id"] in view.columns]
+    if sort_by:
+        view = view.sort_values([col["column_id"] for col in sort_by],
+                                ascending=[col["direction"] == "asc" for col in sort_by],
+                                kind="mergesort", na_position="last")
+    return view
+
+
+def page_records(page, columns=None):
+    """
+    DataTable records for a page. Each record carries the dataframe index as its row 'id', so row selections made
+    on any page can be mapped back to the dataset.
+    :param page: page dataframe from query_page
+    :param columns: optional list of columns to send, defaults to all columns
+    :return: list of dicts
+    """
+    if columns is not None:
+        page = page[[col for col in columns if col in page.columns]]
+    return page.assign(id=page.index).to_dict("records")
+
+
+def column_ids(columns):
+    """ Column ids of a DataTable columns property."""
+    return [col["id"] for col in columns] if columns else None
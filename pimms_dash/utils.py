@@ -1,19 +1,25 @@
 import json
 import pathlib
+import re
 import math
-import copy
 import io
 import base64
-import time
-import shutil
 import colorsys
+import threading
+from collections import OrderedDict
 
+import numpy as np
 import pandas as pd
-import rpy2.robjects as ro
-from rpy2.robjects import pandas2ri
-from rpy2.robjects.conversion import localconverter
 
-from app import DATA_PATH
+import deseq_cache
+import deseq_service
+import jobs
+import session_gc
+import storage
+from app import DATA_PATH, SESSION_DATA_PATH, SESSION_STORE, SESSION_CACHE_MAX_BYTES, SESSION_TTL, SESSION_IDLE, \
+    SESSION_MAX_BYTES, SESSIONS_MAX_BYTES, SESSION_SWEEP_INTERVAL, DESEQ_SCRIPT_PATH, DESEQ_WORKERS, DESEQ_TIMEOUT, \
+    DESEQ_MAX_JOBS_PER_WORKER, DESEQ_CACHE_PATH, DESEQ_CACHE_MAX_BYTES, SCATTER_MAX_POINTS, LOD_BASE_BIN_WIDTH, \
+    NIM_MAX_LOCI, MAX_UPLOAD_BYTES
 
 class GffDataFrame:
     """
@@ -21,52 +27,57 @@ class GffDataFrame:
     :param path: Path to gff file
     """
     gff3_cols = ["seq_id",  "source", "type", "start", "end", "score", "strand", "phase", "attributes"]
+    # Coordinate gffs repeat a few values in every column but the coordinates, so text columns are categorical
+    gff3_dtypes = {"seq_id": "category", "source": "category", "type": "category", "start": "int64", "end": "int64",
+                   "score": "float32", "strand": "category", "phase": "category", "attributes": "category"}
 
     def __init__(self, path, data=None, header=None):
         self.path = path
         if data is None:
-            self._data = self.read_gff(path)
+            self.header, self._data = self.read_gff(path)
         else:
             self._data = data
-
-        if header is None:
-            self.header = self._read_header()
-        else:
             self.header = header
+        # Parsed attributes, see parse_attributes
+        self._attributes = None
 
     def __getitem__(self, item):
         return self._data[item]
 
     def read_gff(self, path):
-        return pd.read_csv(path, sep="\t", comment="#", names=self.gff3_cols)
+        """
+        Read the header and the features of a gff in one pass.
+        :param path: path to gff file or open text file
+        :return: header str, features dataframe
+        """
+        fh = path if hasattr(path, "readline") else open(path)
+        try:
+            header = ""
+            position = fh.tell()
+            line = fh.readline()
+            while line.startswith("#"):
+                header += line
+                position = fh.tell()
+                line = fh.readline()
+            fh.seek(position)
+            data = pd.read_csv(fh, sep="\t", comment="#", names=self.gff3_cols, dtype=self.gff3_dtypes,
+                               na_values={"score": ["."]})
+        finally:
+            if fh is not path:
+                fh.close()
+        for col in ["start", "end"]:
+            if data[col].max() < np.iinfo(np.int32).max:
+                data[col] = data[col].astype(np.int32)
+        return header, data
 
     def get_data(self):
         return self._data.round(5)
 
-    def _read_header(self):
-        if not self._data.empty:
-            header = ""
-            if isinstance(self.path, io.StringIO):
-                for line in self.path.readlines():
-                    if line.startswith("#"):
-                        header += line
-                    else:
-                        break
-            else:
-                for line in open(self.path):
-                    if line.startswith("#"):
-                        header += line
-                    else:
-                        break
-            return header
-        else:
-            return None
-
     def to_gff3(self, gff_file):
-        gff_feature = self._data[self.gff3_cols].to_csv(sep="\t", index=False, header=None)
         with open(gff_file, "w") as fh:
-            fh.write(self.header)
-            fh.write(gff_feature)
+            fh.write(self.header or "")
+            self._data[self.gff3_cols].to_csv(fh, sep="\t", index=False, header=False, na_rep=".",
+                                              float_format="%.7g")
 
     def value_counts(self, column):
         return self._data[column].value_counts()
@@ -75,32 +86,45 @@ class GffDataFrame:
         return self._data[self.gff3_cols[0]].unique()
 
     def empty_score(self):
-        return (self._data["score"] == ".").all()
+        return pd.to_numeric(self._data["score"], errors="coerce").isna().all()
 
     def parse_attributes(self):
-        """ Method to parse the attributes column into new dataframe"""
-        def str_parser(att_str):
-            out = {}
-            for att in att_str.split(";"):
-                if "=" in att:
-                    out[att.split("=")[0]] = att.split("=")[1]
-                else:
-                    continue
-            return out
-        att_series = self._data["attributes"].apply(str_parser)
-        attribute_df = pd.DataFrame.from_records(att_series.to_list())
-        return attribute_df
+        """
+        Parse the attributes column into a new dataframe, one column per attribute key. Parsed on first use, each
+        distinct attribute string is parsed once and the result is shared by the features holding it.
+        """
+        if self._attributes is None:
+            attributes = self._data["attributes"].astype("category")
+            pairs = (pd.Series(attributes.cat.categories, dtype=object)
+                     .str.extractall(r"(?:^|;)(?P<key>[^=;]+)=(?P<value>[^;]*)")
+                     .reset_index(level="match", drop=True)
+                     .reset_index())
+            # Later values of a repeated key win, columns keep the order keys are first seen in
+            pairs = pairs.drop_duplicates(["index", "key"], keep="last")
+            parsed = (pairs.pivot(index="index", columns="key", values="value")
+                      .reindex(index=range(len(attributes.cat.categories) + 1), columns=pd.unique(pairs["key"])))
+            # Code -1, a missing attributes value, selects the trailing all NaN row
+            codes = attributes.cat.codes.to_numpy()
+            self._attributes = parsed.iloc[np.where(codes < 0, len(parsed) - 1, codes)].reset_index(drop=True)
+            self._attributes.columns.name = None
+        return self._attributes
 
     def to_json(self):
         """
-        Serialise the class. Converts non-serialisable instance attributes to serialisable objects first.
-        ref https://medium.com/@yzhong.cs/serialize-and-deserialize-complex-json-in-python-205ecc636caa
+        Serialise the class, see write_json.
         :return: json
         """
-        serialisable_instance = copy.deepcopy(self)
-        serialisable_instance._data = serialisable_instance._data.to_json(date_format='iso', orient='split')
-        serialisable_instance.path = str(serialisable_instance.path)
-        return json.dumps(serialisable_instance.__dict__)
+        fh = io.StringIO()
+        self.write_json(fh)
+        return fh.getvalue()
+
+    def write_json(self, fh):
+        """
+        Stream the serialised class to a text file object. The dataframe is written in chunks straight from the
+        instance, alongside the attributes from get_metadata.
+        :param fh: text file object
+        """
+        storage.write_instance_json(fh, self._data, self.get_metadata())
 
     @classmethod
     def from_json(cls, json_data):
@@ -110,10 +134,457 @@ class GffDataFrame:
         :return: PIMMSDataFrame class instance
         """
         deserialised_data = json.loads(json_data)
-        deserialised_data['data'] = deserialised_data.pop('_data')
-        deserialised_data['data'] = pd.read_json(deserialised_data['data'], orient='split')
-        deserialised_data['path'] = pathlib.Path(deserialised_data['path'])
-        return cls(**deserialised_data)
+        data = pd.read_json(io.StringIO(deserialised_data.pop('_data')), orient='split')
+        return cls.from_data(data, deserialised_data)
+
+    def get_metadata(self):
+        """ Return the instance attributes, other than the dataframe, as a json serialisable dict."""
+        metadata = {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+        metadata['path'] = str(self.path)
+        return metadata
+
+    @classmethod
+    def from_data(cls, data, metadata):
+        """
+        Recreate class instance from a dataframe and the output of get_metadata.
+        :param data: pandas dataframe
+        :param metadata: dict output from get_metadata method.
+        :return: GffDataFrame class instance
+        """
+        metadata = dict(metadata)
+        metadata['path'] = pathlib.Path(metadata['path'])
+        return cls(data=data, **metadata)
+
+
+class InsertionIndex:
+    """
+    Sorted, array backed index of the insertion sites of a coordinate gff. Holds one row per insertion position
+    with its insert count and a cumulative count, so range queries are two binary searches, O(log n + k) for the
+    k sites returned and O(log n) for totals. Built once when the gff is loaded and stored with the session data.
+    :param data: dataframe with position and count columns, sorted by position
+    """
+    def __init__(self, data):
+        self._data = data
+        self.positions = data["position"].to_numpy()
+        self.counts = data["count"].to_numpy()
+        # Cumulative counts with a leading zero, the total between sites i and j is cumsum[j] - cumsum[i]
+        self.cumsum = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def __len__(self):
+        return len(self.positions)
+
+    @classmethod
+    def from_gff(cls, gff_df):
+        """
+        Build the index from a GffDataFrame. Gff score values are taken as insert counts, a gff without scores
+        lists each insert as a feature and positions are counted.
+        :param gff_df: GffDataFrame object
+        :return: InsertionIndex class instance
+        """
+        starts = gff_df["start"].to_numpy()
+        if gff_df.empty_score():
+            positions, counts = np.unique(starts, return_counts=True)
+        else:
+            scores = pd.to_numeric(gff_df["score"], errors="coerce").fillna(0).to_numpy()
+            positions, inverse = np.unique(starts, return_inverse=True)
+            counts = np.bincount(inverse, weights=scores, minlength=len(positions))
+        return cls(pd.DataFrame({"position": positions, "count": counts}))
+
+    def _slice(self, start, end):
+        """ Index range of the sites within the closed interval [start, end]."""
+        return (np.searchsorted(self.positions, start, side="left"),
+                np.searchsorted(self.positions, end, side="right"))
+
+    def query(self, start, end):
+        """
+        Insertion sites within [start, end].
+        :return: dataframe with position and count columns, a view of the index
+        """
+        i, j = self._slice(start, end)
+        return self._data.iloc[i:j]
+
+    def total_inserts(self, start, end):
+        """ Sum of insert counts within [start, end]."""
+        i, j = self._slice(start, end)
+        return self.cumsum[j] - self.cumsum[i]
+
+    def unique_sites(self, start, end):
+        """ Number of insertion positions within [start, end]."""
+        i, j = self._slice(start, end)
+        return j - i
+
+    def interval_stats(self, starts, ends):
+        """
+        Insert statistics of many closed intervals [start, end] at once, e.g. every gene of a genome. Intervals may
+        overlap and need not be sorted, each costs two binary searches.
+        :param starts: array of interval starts
+        :param ends: array of interval ends
+        :return: dict of arrays: total_inserts, unique_sites, first_insert and last_insert positions (-1 for
+            intervals without inserts) and max_site_count
+        """
+        i = np.searchsorted(self.positions, starts, side="left")
+        j = np.searchsorted(self.positions, ends, side="right")
+        has_inserts = j > i
+        # Padding with a trailing sentinel keeps bounds equal to the number of sites, and j - 1 = -1, in range
+        positions = np.append(self.positions, -1)
+        counts = np.append(self.counts, np.zeros(1, dtype=self.counts.dtype))
+        # Max of counts[i:j] for every interval, reduceat over the interleaved bounds. Empty intervals reduce to a
+        # single value and are masked
+        bounds = np.column_stack([i, j]).ravel()
+        max_counts = np.maximum.reduceat(counts, bounds)[::2] if len(bounds) else counts[:0]
+        return {
+            "total_inserts": self.cumsum[j] - self.cumsum[i],
+            "unique_sites": j - i,
+            "first_insert": np.where(has_inserts, positions[i], -1),
+            "last_insert": np.where(has_inserts, positions[j - 1], -1),
+            "max_site_count": np.where(has_inserts, max_counts, 0),
+        }
+
+    def get_data(self):
+        return self._data
+
+    def get_metadata(self):
+        return {}
+
+    @classmethod
+    def from_data(cls, data, metadata):
+        return cls(data)
+
+
+class InsertionPyramid:
+    """
+    Level of detail pyramid of the insertion counts of an InsertionIndex. Level 0 bins the genome into bins of
+    base_bin_width bases, every level above doubles the bin width until one bin covers all sites. Each non-empty bin
+    holds the min, max and sum of the counts of its insertion sites, so a genome wide plot can be drawn at a
+    resolution matched to the visible range without losing peaks.
+    :param data: dataframe with level, bin, min, max and sum columns, sorted by level then bin
+    :param base_bin_width: bin width of level 0
+    """
+    def __init__(self, data, base_bin_width=LOD_BASE_BIN_WIDTH):
+        self._data = data
+        self.base_bin_width = base_bin_width
+        levels = data["level"].to_numpy()
+        self.n_levels = int(levels[-1]) + 1 if len(levels) else 0
+        # Row offsets of each level
+        self._bounds = np.searchsorted(levels, np.arange(self.n_levels + 1))
+
+    @classmethod
+    def from_index(cls, insert_index, base_bin_width=LOD_BASE_BIN_WIDTH):
+        """
+        Build the pyramid from an InsertionIndex, each level is reduced from the level below.
+        :param insert_index: InsertionIndex object
+        :param base_bin_width: bin width of level 0
+        :return: InsertionPyramid class instance
+        """
+        frames = []
+        bins = insert_index.positions // base_bin_width
+        mins = maxs = sums = insert_index.counts.astype(float)
+        level = 0
+        while len(bins):
+            # Sites, or bins of the level below, are sorted so each bin is a contiguous run
+            first = np.flatnonzero(np.concatenate([[True], bins[1:] != bins[:-1]]))
+            bins = bins[first]
+            mins, maxs, sums = (np.minimum.reduceat(mins, first), np.maximum.reduceat(maxs, first),
+                                np.add.reduceat(sums, first))
+            frames.append(pd.DataFrame({"level": level, "bin": bins, "min": mins, "max": maxs, "sum": sums}))
+            if len(bins) == 1:
+                break
+            bins = bins // 2
+            level += 1
+        if not frames:
+            frames.append(pd.DataFrame({"level": [], "bin": [], "min": [], "max": [], "sum": []}))
+        data = pd.concat(frames, ignore_index=True)
+        data["level"] = data["level"].astype(np.int8)
+        data["bin"] = data["bin"].astype(np.int64)
+        return cls(data, base_bin_width)
+
+    def bin_width(self, level):
+        return self.base_bin_width * 2 ** level
+
+    def level(self, level):
+        """ Rows of one level, a view of the pyramid."""
+        return self._data.iloc[self._bounds[level]:self._bounds[level + 1]]
+
+    def select_level(self, start, end, max_bins):
+        """
+        Finest level holding at most max_bins non-empty bins within [start, end].
+        :return: level number and its rows within the range
+        """
+        for level in range(self.n_levels):
+            rows = self.level(level)
+            width = self.bin_width(level)
+            bins = rows["bin"].to_numpy()
+            i = np.searchsorted(bins, start // width, side="left")
+            j = np.searchsorted(bins, end // width, side="right")
+            if j - i <= max_bins or level == self.n_levels - 1:
+                return level, rows.iloc[i:j]
+        return None, self._data.iloc[0:0]
+
+    def get_data(self):
+        return self._data
+
+    def get_metadata(self):
+        return {"base_bin_width": self.base_bin_width}
+
+    @classmethod
+    def from_data(cls, data, metadata):
+        return cls(data, **metadata)
+
+
+def downsample_inserts(insert_index, pyramid, x_range=None, max_points=SCATTER_MAX_POINTS):
+    """
+    Insertion sites to plot within an x range. Sites are returned at full resolution when there are at most
+    max_points of them, otherwise the min and max count of each bin of the finest pyramid level that fits are
+    returned at the bin centres.
+    :param insert_index: InsertionIndex object
+    :param pyramid: InsertionPyramid built from insert_index
+    :param x_range: [start, end] genome positions, None for the whole genome
+    :param max_points: point budget
+    :return: x array, y array, bin width or None at full resolution
+    """
+    if x_range is None:
+        x_range = [-np.inf, np.inf] if len(insert_index) == 0 else \
+            [insert_index.positions[0], insert_index.positions[-1]]
+    start, end = x_range
+    if insert_index.unique_sites(start, end) <= max_points:
+        sites = insert_index.query(start, end)
+        return sites["position"].to_numpy(), sites["count"].to_numpy(), None
+    # Two points, min and max, per bin
+    level, rows = pyramid.select_level(int(start), int(end), max_points // 2)
+    width = pyramid.bin_width(level)
+    centres = (rows["bin"].to_numpy() + 0.5) * width
+    return (np.concatenate([centres, centres]), np.concatenate([rows["max"].to_numpy(), rows["min"].to_numpy()]),
+            width)
+
+
+def relayout_x_range(relayout_data):
+    """
+    Visible x range from graph relayoutData.
+    :return: [start, end], None when the axes were reset. Raises KeyError if the x range did not change.
+    """
+    for axis in ["xaxis", "xaxis2", "xaxis3"]:
+        if f"{axis}.range[0]" in relayout_data:
+            return [relayout_data[f"{axis}.range[0]"], relayout_data[f"{axis}.range[1]"]]
+        if f"{axis}.range" in relayout_data:
+            return list(relayout_data[f"{axis}.range"])
+        if relayout_data.get(f"{axis}.autorange"):
+            return None
+    raise KeyError("x range")
+
+
+def apply_relayout(layout, relayout_data):
+    """
+    Copy the axis ranges of a relayout event into a figure layout, so a figure returned by a callback keeps the
+    user's view.
+    :param layout: figure layout dict, updated in place
+    :param relayout_data: graph relayout event
+    """
+    for key, value in relayout_data.items():
+        axis, _, prop = key.partition(".")
+        if prop.startswith("range[") and axis in layout:
+            layout[axis].setdefault("range", [None, None])[int(prop[6])] = value
+            layout[axis]["autorange"] = False
+        elif prop in ["range", "autorange"] and axis in layout:
+            layout[axis][prop] = value
+            if prop == "range":
+                layout[axis]["autorange"] = False
+
+
+class LocusIndex:
+    """
+    Index of the PIMMS loci sorted by start position, with a running maximum of the locus ends. The loci overlapping
+    a genome window are two binary searches away, so the NIM Comparison view can fetch per locus detail for the
+    visible window only. Built once when the PIMMS data is loaded and stored with the session data.
+    :param data: dataframe with row, the position of the locus in the PIMMS data, start and end columns, sorted by
+        start
+    """
+    def __init__(self, data):
+        self._data = data
+        self.rows = data["row"].to_numpy()
+        self.starts = data["start"].to_numpy()
+        self.ends = data["end"].to_numpy()
+        # Loci before the first with max_end >= start lie entirely before start
+        self.max_end = np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_pimms(cls, pimms_df):
+        """
+        Build the index from a PIMMSDataFrame.
+        :param pimms_df: PIMMSDataFrame object
+        :return: LocusIndex class instance
+        """
+        data = pimms_df.get_data()
+        starts = data["start"].to_numpy()
+        order = np.argsort(starts, kind="stable")
+        return cls(pd.DataFrame({"row": order, "start": starts[order], "end": data["end"].to_numpy()[order]}))
+
+    def extent(self):
+        """ Genome range covered by the loci, [first start, last end]."""
+        if len(self) == 0:
+            return [0, 0]
+        return [int(self.starts[0]), int(self.max_end[-1])]
+
+    def query(self, start, end):
+        """
+        Loci overlapping the closed interval [start, end].
+        :return: array of positions in the index, in start order
+        """
+        i = np.searchsorted(self.max_end, start, side="left")
+        j = np.searchsorted(self.starts, end, side="right")
+        positions = np.arange(i, max(i, j))
+        return positions[self.ends[positions] >= start]
+
+    def get_data(self):
+        return self._data
+
+    def get_metadata(self):
+        return {}
+
+    @classmethod
+    def from_data(cls, data, metadata):
+        return cls(data)
+
+
+def window_loci(pimms_df, locus_index, score_cols, x_range=None, max_loci=NIM_MAX_LOCI):
+    """
+    Scores of the loci to plot within an x range. Loci are returned individually when at most max_loci of them
+    overlap the range, otherwise the range is cut into max_loci equal windows by locus start and the maximum score
+    of each window is returned.
+    :param pimms_df: PIMMSDataFrame object
+    :param locus_index: LocusIndex built from pimms_df
+    :param score_cols: score column names
+    :param x_range: [start, end] genome positions, None for the whole genome
+    :param max_loci: loci or windows returned at most
+    :return: dict of score column to score array, start array, end array, label array and whether loci are binned
+    """
+    if x_range is None:
+        x_range = locus_index.extent()
+    start, end = x_range
+    positions = locus_index.query(start, end)
+    rows = locus_index.rows[positions]
+    data = pimms_df.get_data()
+    scores = {col: data[col].to_numpy(dtype="float64")[rows] for col in score_cols}
+    if len(positions) <= max_loci:
+        labels = data["locus_tag"].to_numpy(dtype=object)[rows]
+        return scores, locus_index.starts[positions], locus_index.ends[positions], labels, False
+    # Starts are sorted so the loci of each window are a contiguous run
+    width = (end - start) / max_loci
+    windows = np.clip((locus_index.starts[positions] - start) // width, 0, max_loci - 1).astype(np.int64)
+    first = np.flatnonzero(np.concatenate([[True], windows[1:] != windows[:-1]]))
+    window_starts = start + windows[first] * width
+    n_loci = np.diff(np.append(first, len(windows)))
+    scores = {col: np.fmax.reduceat(values, first) for col, values in scores.items()}
+    labels = pd.Series(n_loci).astype(str).add(" loci").to_numpy(dtype=object)
+    return scores, window_starts, window_starts + width, labels, True
+
+
+class VennIndex:
+    """
+    Sorted orders of the columns the venn sets filter on, the NIM score and the first and last insert percentiles of
+    each condition. A locus is in the set of a condition when its NIM score <= threshold and its inserts lie within
+    the [low, high] percentile range, each condition is a prefix or suffix of a sorted order found by binary search,
+    so set membership for any slider position costs three searches and three scatters per condition.
+    :param data: dataframe with {condition}_{key}_order and {condition}_{key}_value columns, the row order and the
+        sorted values of each filter column, NaN sorted last
+    """
+    conditions = ["control", "test"]
+    keys = ["nim", "first", "last"]
+
+    def __init__(self, data):
+        self._data = data
+        self.orders = {}
+        self.values = {}
+        for condition in self.conditions:
+            for key in self.keys:
+                self.orders[condition, key] = data[f"{condition}_{key}_order"].to_numpy()
+                self.values[condition, key] = data[f"{condition}_{key}_value"].to_numpy()
+
+    def __len__(self):
+        return len(self._data)
+
+    @classmethod
+    def from_pimms(cls, pimms_df):
+        """
+        Build the index from a PIMMSDataFrame with test and control data.
+        :param pimms_df: PIMMSDataFrame object
+        :return: VennIndex class instance
+        """
+        df = pimms_df.get_data()
+        nim_test_col, nim_control_col = pimms_df.get_NIM_score_columns()
+        perc_test_cols, perc_control_cols = pimms_df.test_control_cols_containing('insert_posn_as_percentile')
+        columns = {
+            "control": [nim_control_col] + perc_control_cols[:2],
+            "test": [nim_test_col] + perc_test_cols[:2],
+        }
+        data = {}
+        for condition, cols in columns.items():
+            for key, col in zip(cls.keys, cols):
+                values = df[col].to_numpy(dtype="float64")
+                order = np.argsort(values, kind="stable")
+                data[f"{condition}_{key}_order"] = order
+                data[f"{condition}_{key}_value"] = values[order]
+        return cls(pd.DataFrame(data))
+
+    def _rows(self, condition, key, low=-np.inf, high=np.inf):
+        """ Rows whose value is within [low, high], NaN values never are."""
+        values = self.values[condition, key]
+        i = np.searchsorted(values, low, side="left")
+        j = np.searchsorted(values, high, side="right")
+        return self.orders[condition, key][i:j]
+
+    def membership(self, threshold, low, high):
+        """
+        Venn set membership of every locus.
+        :param threshold: NIM score threshold
+        :param low: lower percentile limit of the first insert
+        :param high: upper percentile limit of the last insert
+        :return: dict of condition to boolean membership array in row order
+        """
+        masks = {}
+        for condition in self.conditions:
+            bits = np.zeros(len(self), dtype=np.uint8)
+            bits[self._rows(condition, "nim", high=threshold)] |= 1
+            bits[self._rows(condition, "first", low=low)] |= 2
+            bits[self._rows(condition, "last", high=high)] |= 4
+            masks[condition] = bits == 7
+        return masks
+
+    def get_data(self):
+        return self._data
+
+    def get_metadata(self):
+        return {}
+
+    @classmethod
+    def from_data(cls, data, metadata):
+        return cls(data)
+
+
+def gene_insert_stats(pimms_df, insert_indexes):
+    """
+    Per gene insert statistics of each condition, the inserts of the coordinate gffs within each PIMMS locus. Rows
+    share the index of the PIMMS data so a gene selected in the main datatable is a single .loc lookup.
+    :param pimms_df: PIMMSDataFrame object
+    :param insert_indexes: dict of condition name to InsertionIndex, e.g. {"control": ..., "test": ...}
+    :return: dataframe with locus_tag and a {statistic}_{condition} column per statistic and condition, insert
+        density is unique insert sites per kb of gene
+    """
+    data = pimms_df.get_data()
+    starts = data["start"].to_numpy()
+    ends = data["end"].to_numpy()
+    gene_kb = (ends - starts + 1) / 1000
+    stats = pd.DataFrame({"locus_tag": data["locus_tag"]}, index=data.index)
+    for condition, insert_index in insert_indexes.items():
+        interval_stats = insert_index.interval_stats(starts, ends)
+        for name, values in interval_stats.items():
+            if name in ("unique_sites", "first_insert", "last_insert"):
+                values = values.astype("int32")
+            stats[f"{name}_{condition}"] = values
+        stats[f"insert_density_{condition}"] = (interval_stats["unique_sites"] / gene_kb).astype("float32")
+    return stats
 
 
 class PIMMSDataFrame:
@@ -131,10 +602,17 @@ class PIMMSDataFrame:
     # Suffixes
     c_suffix = '_control'
     t_suffix = '_test'
+    # Text columns stored as categoricals
+    categorical_columns = ['seq_id', 'locus_tag', 'type', 'gene', 'product']
+    # Coordinate and insert count columns, stored as integers when all values are whole numbers
+    integer_columns = re.compile(r'^(start|end|feat_length|.*num_insertions_mapped_per_feat|.*num_insert_sites_per_feat'
+                                 r'|.*_MP\d+)(_control|_test)?$')
 
     def __init__(self, control_path, test_path, data=None, comparison_cols=None, run_deseq=False, deseq_filtering=True, **kwargs):
         self.control_path = control_path
         self.test_path = test_path
+        # Rounded presentation view of _data, see get_data
+        self._view = None
 
         if test_path is None:
             self.control_run = True
@@ -142,9 +620,8 @@ class PIMMSDataFrame:
             self.control_run = False
 
         if data is None:
-            self._data = self.load_and_merge(control_path, test_path)
-        else:
-            self._data = data
+            data = self.load_and_merge(control_path, test_path)
+        self._data = self.normalize_dtypes(data)
 
         if comparison_cols is not None:
             self.comparison_cols = [col_name for col_name in comparison_cols if col_name in self._data.columns]
@@ -153,8 +630,7 @@ class PIMMSDataFrame:
 
         # Calculate comparison columns
         if not self.control_run:
-            self.calc_NIM_comparision_metric(fold_change_comparision, 'fold_change')
-            self.calc_NIM_comparision_metric(percentile_rank_comparision, 'pctl_rank')
+            self.calc_NIM_comparision_metrics(COMPARISON_METRICS)
 
         # Pass pools to deseq
         self.deseq_run_logs = {}
@@ -172,7 +648,41 @@ class PIMMSDataFrame:
         return len(self._data)
 
     def get_data(self):
-        return self._data.round(5)
+        """
+        Data with float columns rounded for presentation. The view is built on first use and shared until the data
+        changes, treat it as read only.
+        """
+        if self._view is None:
+            view = self._data.copy(deep=False)
+            float_cols = view.select_dtypes('floating').columns
+            view[float_cols] = view[float_cols].round(5)
+            self._view = view
+        return self._view
+
+    @classmethod
+    def normalize_dtypes(cls, df):
+        """
+        Compact dtypes for the merged table. Text info columns become categoricals and coordinate and count columns,
+        read as float when the input has empty rows, become int32 (int64 if out of range) when all values are whole.
+        :param df: pandas dataframe
+        :return: pandas dataframe, sharing unchanged columns with df
+        """
+        df = df.copy(deep=False)
+        for col in df.columns:
+            series = df[col]
+            if col in cls.categorical_columns:
+                if not isinstance(series.dtype, pd.CategoricalDtype):
+                    df[col] = series.astype('category')
+            elif cls.integer_columns.match(col) and pd.api.types.is_numeric_dtype(series) \
+                    and not pd.api.types.is_bool_dtype(series):
+                values = series.to_numpy()
+                if series.isna().any() or not np.array_equal(values, np.floor(values)):
+                    continue
+                int_type = np.int32 if (len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and
+                                                             values.max() <= np.iinfo(np.int32).max)) else np.int64
+                if series.dtype != int_type:
+                    df[col] = series.astype(int_type)
+        return df
 
     def get_columns(self, simple=False, c_metric='all'):
         if c_metric not in self.comparison_cols + [None, 'all']:
@@ -202,6 +712,7 @@ class PIMMSDataFrame:
 
     def insert_column(self, col_name, series):
         self._data.insert(len(self._data.columns), col_name, series)
+        self._view = None
 
     def load_and_merge(self, control_data_path, test_data_path):
         """
@@ -211,43 +722,54 @@ class PIMMSDataFrame:
         :return:
         """
         # Read input control file into pandas dataframe
-        if ".csv" in control_data_path.suffix:
-            df_control = pd.read_csv(control_data_path)
-        elif ".xls" in control_data_path.suffix:
-            df_control = pd.read_excel(control_data_path)
-        else:
-            raise ValueError("Unaccepted file type")
+        df_control = self.read_input(control_data_path)
 
         if control_data_path and test_data_path is None:
             return df_control
 
         # Read input test file into pandas dataframe
-        if ".csv" in test_data_path.suffix:
-            df_test = pd.read_csv(test_data_path)
-        elif ".xls" in test_data_path.suffix:
-            df_test = pd.read_excel(test_data_path)
+        df_test = self.read_input(test_data_path)
+
+        return self.merge_inputs(df_control, df_test)
+
+    @staticmethod
+    def read_input(data_path):
+        """ Read an input csv or excel file, given as str or pathlib.Path, into pd._Dataframe"""
+        data_path = pathlib.Path(data_path)
+        if ".csv" in data_path.suffix:
+            return pd.read_csv(data_path)
+        elif ".xls" in data_path.suffix:
+            return pd.read_excel(data_path)
         else:
             raise ValueError("Unaccepted file type")
 
+    @classmethod
+    def merge_inputs(cls, df_control, df_test):
+        """ Merge control and test input dataframes on the info columns, suffixing the data columns"""
         # Drop rows that are all na
         df_control = df_control.dropna(how="all")
         df_test = df_test.dropna(how="all")
 
         # Merge_control_test
-        df_merged = self.merge_add_suffix(df_control, df_test, self.info_columns, self.c_suffix, self.t_suffix)
+        df_merged = cls.merge_add_suffix(df_control, df_test, cls.info_columns, cls.c_suffix, cls.t_suffix)
         return df_merged
 
     def to_json(self):
         """
-        Serialise the class. Converts non-serialisable instance attributes to serialisable objects first.
-        ref https://medium.com/@yzhong.cs/serialize-and-deserialize-complex-json-in-python-205ecc636caa
+        Serialise the class, see write_json.
         :return: json
         """
-        serialisable_instance = copy.deepcopy(self)
-        serialisable_instance._data = serialisable_instance._data.to_json(date_format='iso', orient='split')
-        serialisable_instance.control_path = str(serialisable_instance.control_path)
-        serialisable_instance.test_path = str(serialisable_instance.test_path)
-        return json.dumps(serialisable_instance.__dict__)
+        fh = io.StringIO()
+        self.write_json(fh)
+        return fh.getvalue()
+
+    def write_json(self, fh):
+        """
+        Stream the serialised class to a text file object. The dataframe is written in chunks straight from the
+        instance, alongside the attributes from get_metadata.
+        :param fh: text file object
+        """
+        storage.write_instance_json(fh, self._data, self.get_metadata())
 
     @classmethod
     def from_json(cls, json_data):
@@ -257,19 +779,37 @@ class PIMMSDataFrame:
         :return: PIMMSDataFrame class instance
         """
         deserialised_data = json.loads(json_data)
-        deserialised_data['data'] = deserialised_data.pop('_data')
-        deserialised_data['data'] = pd.read_json(deserialised_data['data'], orient='split')
-        if deserialised_data['control_path'] != 'None':
-            deserialised_data['control_path'] = pathlib.Path(deserialised_data['control_path'])
+        data = pd.read_json(io.StringIO(deserialised_data.pop('_data')), orient='split')
+        return cls.from_data(data, deserialised_data)
+
+    def get_metadata(self):
+        """ Return the instance attributes, other than the dataframe, as a json serialisable dict."""
+        metadata = {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+        metadata['control_path'] = str(self.control_path)
+        metadata['test_path'] = str(self.test_path)
+        return metadata
+
+    @classmethod
+    def from_data(cls, data, metadata):
+        """
+        Recreate class instance from a dataframe and the output of get_metadata.
+        Restores control_path and test_path to their original type.
+        :param data: pandas dataframe
+        :param metadata: dict output from get_metadata method.
+        :return: PIMMSDataFrame class instance
+        """
+        metadata = dict(metadata)
+        if metadata['control_path'] not in ['None', None]:
+            metadata['control_path'] = pathlib.Path(metadata['control_path'])
         else:
-            deserialised_data['control_path'] = None
-        if deserialised_data['test_path'] != 'None':
-            deserialised_data['test_path'] = pathlib.Path(deserialised_data['test_path'])
+            metadata['control_path'] = None
+        if metadata['test_path'] not in ['None', None]:
+            metadata['test_path'] = pathlib.Path(metadata['test_path'])
         else:
-            deserialised_data['test_path'] = None
+            metadata['test_path'] = None
         # If already ran deseq, prevent trigger on new class instance
-        deserialised_data['run_deseq'] = False
-        return cls(**deserialised_data)
+        metadata['run_deseq'] = False
+        return cls(data=data, **metadata)
 
     @staticmethod
     def merge_add_suffix(df1, df2, on_columns, suffix1, suffix2):
@@ -334,12 +874,32 @@ class PIMMSDataFrame:
             # Calc metric and insert as column
             test_NIM_col, control_NIM_col = self.get_NIM_score_columns()
             self._data[col_name] = comparison_func(self._data[test_NIM_col], self._data[control_NIM_col])
+            self._view = None
         if col_name not in self.comparison_cols:
             self.comparison_cols.append(col_name)
 
+    def calc_NIM_comparision_metrics(self, metrics):
+        """
+        Calculate several comparision scores between test and control NIM scores in one pass, the NIM columns are
+        looked up and converted once for all metrics. Metrics already present are not recalculated.
+        :param metrics: dict of column name to comparison function, see COMPARISON_METRICS.
+        :return:
+        """
+        missing = {col_name: func for col_name, func in metrics.items() if col_name not in self._data.columns}
+        if missing:
+            test_NIM_col, control_NIM_col = self.get_NIM_score_columns()
+            series_test = self._data[test_NIM_col].astype(float)
+            series_control = self._data[control_NIM_col].astype(float)
+            for col_name, comparison_func in missing.items():
+                self._data[col_name] = comparison_func(series_test, series_control)
+            self._view = None
+        for col_name in metrics:
+            if col_name not in self.comparison_cols:
+                self.comparison_cols.append(col_name)
+
     def run_DESeq(self):
         """
-        Passes MutantPool columns to R based DESeq script with rpy2
+        Passes MutantPool columns to the DESeq2 worker pool (see deseq_service)
         Merges results into self._data and makes available in comparison columns
         """
         # Dict to hold run feedback
@@ -388,6 +948,7 @@ class PIMMSDataFrame:
 
                 # Merge columns into pimms dataframe
                 self._data = pd.merge(self._data, deseq_results, left_index=True, right_index=True, how="left")
+                self._view = None
 
                 deseqlog["run"] = True
                 deseqlog["success"] = True
@@ -402,34 +963,45 @@ class PIMMSDataFrame:
         return deseqlog
 
 
-def run_deseq_r_script(countsdata, metadata, deseq_filtering=True):
-    # Defining the R script and loading the instance in Python
-    r = ro.r
-    r['source']('DESeq2_process.R')
+# Classes that can be passed to store_data and restored by load_data
+SESSION_CLASSES = {
+    'GffDataFrame': GffDataFrame,
+    'InsertionIndex': InsertionIndex,
+    'InsertionPyramid': InsertionPyramid,
+    'LocusIndex': LocusIndex,
+    'VennIndex': VennIndex,
+    'PIMMSDataFrame': PIMMSDataFrame,
+}
 
-    # Loading the function we have defined in R.
-    run_deseq_r = ro.globalenv['run_deseq']
 
-    # Convert pandas df to R df
-    with localconverter(ro.default_converter + pandas2ri.converter):
-        r_countsdata = ro.conversion.py2rpy(countsdata)
-        r_metadata = ro.conversion.py2rpy(metadata)
+def get_deseq_pool():
+    """ Return the process wide DESeq2 runner configured in app."""
+    return deseq_service.get_pool(DESEQ_SCRIPT_PATH, n_workers=DESEQ_WORKERS, timeout=DESEQ_TIMEOUT,
+                                  max_jobs_per_worker=DESEQ_MAX_JOBS_PER_WORKER)
 
-    # Invoking the R function and getting the result
-    df_result_r, pca_r = run_deseq_r(r_countsdata, r_metadata, deseq_filtering)
-    df_pca_r = pca_r[0]
 
-    # results to pandas DataFrame
-    with localconverter(ro.default_converter + pandas2ri.converter):
-        results = ro.conversion.rpy2py(df_result_r)
-        pca = ro.conversion.rpy2py(df_pca_r)
+def run_deseq_r_script(countsdata, metadata, deseq_filtering=True):
+    """
+    Run DESeq2 on the worker pool and wait for results, pca_dict and pca_labels.
+    Results are reused from the DESeq2 result cache when the same inputs were run before. Inside a background job
+    the DESeq2 worker is killed as soon as the job is cancelled.
+    """
+    pool = get_deseq_pool()
+    key = deseq_cache.cache_key(countsdata, metadata, deseq_filtering, pool.versions())
+    cached = deseq_result_cache.get(key)
+    if cached is not None:
+        return cached
+    job = jobs.current_job()
+    try:
+        results, pca_dict, pca_labels = pool.run(countsdata, metadata, deseq_filtering,
+                                                 cancelled=job.cancelled if job is not None else None)
+    except deseq_service.DESeqCancelled:
+        raise jobs.JobCancelled(job.job_id) from None
+    deseq_result_cache.put(key, results, pca_dict, pca_labels)
+    return results, pca_dict, pca_labels
 
-    # Index pca df and store components in dict
-    pca.index = metadata["id"]
-    pca_dict = pca[["PC1", "PC2"]].to_dict(orient="index")
-    pca_labels = {"y_label": pca_r[-1][0][0], "x_label": pca_r[-1][1][0]}
 
-    return results, pca_dict, pca_labels
+deseq_result_cache = deseq_cache.DESeqResultCache(DESEQ_CACHE_PATH, DESEQ_CACHE_MAX_BYTES)
 
 
 def log2_fold_change(a, b):
@@ -440,83 +1012,323 @@ def log2_fold_change(a, b):
         return 0
 
 
+def log2_fold_change_array(a, b, zero_value=0.0, nan_policy='propagate'):
+    """
+    Vectorised log2_fold_change. Keeps the scalar semantics: a zero denominator or a non positive ratio (which the
+    scalar version fails to log) gives zero_value, NaN inputs give NaN unless nan_policy is 'zero'.
+    :param a: array like numerator
+    :param b: array like denominator
+    :param zero_value: value for undefined fold changes
+    :param nan_policy: 'propagate' to keep NaN, 'zero' to replace NaN with zero_value
+    :return: numpy float array
+    """
+    if nan_policy not in ['propagate', 'zero']:
+        raise ValueError(f"nan_policy {nan_policy} not in ['propagate', 'zero']")
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = a / b
+        fc = np.log2(ratio)
+    undefined = (b == 0) | (ratio <= 0)
+    if nan_policy == 'zero':
+        undefined |= np.isnan(ratio)
+    fc[undefined] = zero_value
+    return fc
+
+
 def fold_change_comparision(series_a, series_b):
-    df = pd.concat([series_a, series_b], axis=1)
-    return df.apply(lambda row: log2_fold_change(row[series_a.name], row[series_b.name]), axis=1)
+    return pd.Series(log2_fold_change_array(series_a.to_numpy(), series_b.to_numpy()), index=series_a.index)
 
 
 def percentile_rank_comparision(series_a, series_b):
-    df = pd.concat([series_a, series_b], axis=1)
-    df['percentile_a'] = df[series_a.name].rank(method='min', pct=True)
-    df['percentile_b'] = df[series_b.name].rank(method='min', pct=True)
-    return df['percentile_a'] - df['percentile_b']
+    return series_a.rank(method='min', pct=True) - series_b.rank(method='min', pct=True)
+
+
+def assign_sets(in_a, in_b):
+    """
+    Vectorised venn set assignment from two boolean membership arrays.
+    :return: object array of "AB", "Ab", "aB" or NaN when in neither set.
+    """
+    in_a = np.asarray(in_a, dtype=bool)
+    in_b = np.asarray(in_b, dtype=bool)
+    sets = np.full(len(in_a), np.nan, dtype=object)
+    sets[in_a & in_b] = "AB"
+    sets[in_a & ~in_b] = "Ab"
+    sets[~in_a & in_b] = "aB"
+    return sets
+
+
+# Comparison metrics calculated for every test vs control run, column name to comparison function
+COMPARISON_METRICS = {
+    'fold_change': fold_change_comparision,
+    'pctl_rank': percentile_rank_comparision,
+}
+
+
+# Base64 characters decoded per chunk when streaming an upload to disk, a multiple of 4
+UPLOAD_CHUNK_CHARS = 4 * 1024**2
+# Rows per chunk when validating an uploaded csv
+UPLOAD_CSV_CHUNK_ROWS = 100000
+
+
+def decode_upload(contents, dest_path, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Stream the base64 payload of a dcc.Upload data url to a file, decoding a chunk at a time so the decoded file is
+    never held in memory.
+    :param contents: data url, 'data:<content type>;base64,<payload>'
+    :param dest_path: file to write the decoded bytes to
+    :param max_bytes: largest decoded size accepted, checked before decoding
+    """
+    start = contents.index(',') + 1
+    decoded_size = (len(contents) - start) * 3 // 4
+    if decoded_size > max_bytes:
+        raise ValueError(f'File larger than the {max_bytes / 1024**2:.0f} MB upload limit')
+    with open(dest_path, 'wb') as fh:
+        for offset in range(start, len(contents), UPLOAD_CHUNK_CHARS):
+            fh.write(base64.b64decode(contents[offset:offset + UPLOAD_CHUNK_CHARS]))
+
+
+def ingest_csv(upload_path, save_path):
+    """
+    Validate a PIMMS csv in chunks, dropping rows without a locus_tag, and write it to save_path. Values are read as
+    strings so they are written back unchanged whatever types each chunk would be inferred as.
+    """
+    def writer(fh):
+        for i, chunk in enumerate(pd.read_csv(upload_path, dtype=str, chunksize=UPLOAD_CSV_CHUNK_ROWS)):
+            if "locus_tag" not in chunk.columns:
+                raise ValueError('No locus_tag column')
+            chunk.dropna(subset=["locus_tag"]).to_csv(fh, index=False, header=(i == 0))
+    storage.atomic_write(save_path, writer, mode="w")
+
+
+def ingest_excel(upload_path, save_path):
+    """ Validate a PIMMS excel file, dropping rows without a locus_tag, and write it to save_path."""
+    df = pd.read_excel(upload_path)
+    df = df.dropna(subset=["locus_tag"])
+    storage.atomic_write(save_path, lambda fh: df.to_excel(fh, index=False), mode="wb")
+
+
+def ingest_gff(upload_path, save_path):
+    """
+    Validate a gff line by line and write it to save_path. Header lines are kept, blank lines are dropped and
+    every feature line must have the nine gff3 columns with integer coordinates.
+    """
+    def writer(fh):
+        with open(upload_path, encoding='utf-8') as upload:
+            for line_number, line in enumerate(upload, 1):
+                if not line.strip():
+                    continue
+                if not line.startswith('#'):
+                    fields = line.rstrip('\r\n').split('\t')
+                    if len(fields) != len(GffDataFrame.gff3_cols):
+                        raise ValueError(f'Line {line_number}: expected {len(GffDataFrame.gff3_cols)} tab separated '
+                                         f'columns, found {len(fields)}')
+                    if not (fields[3].isdigit() and fields[4].isdigit()):
+                        raise ValueError(f'Line {line_number}: start and end must be integers')
+                fh.write(line if line.endswith('\n') else line + '\n')
+    storage.atomic_write(save_path, writer, mode="w")
 
 
 def parse_upload(contents, filename, upload_dir):
-    content_type, content_string = contents.split(',')
+    """
+    Save an uploaded file to the upload directory. The upload is decoded to a temporary file in chunks, then
+    validated and written out once in its on-disk format.
+    :param contents: dcc.Upload contents data url
+    :param filename: name of the uploaded file
+    :param upload_dir: session upload directory
+    :return: status message
+    """
     save_path = upload_dir.joinpath(filename)
-    decoded = base64.b64decode(content_string)
+    upload_path = upload_dir.joinpath(f'.{filename}.upload')
     try:
         if save_path.is_file():
             raise IOError('File Already Exists')
         if '.csv' in filename:
-            df = pd.read_csv(io.StringIO(decoded.decode('utf-8')))
-            df = df.dropna(subset=["locus_tag"])
-            df.to_csv(save_path, index=False)
-            return f'Uploaded {filename}'
+            ingest = ingest_csv
         elif '.xls' in filename:
-            df = pd.read_excel(io.BytesIO(decoded))
-            df = df.dropna(subset=["locus_tag"])
-            df.to_excel(save_path, index=False)
-            return f'Uploaded {filename}'
+            ingest = ingest_excel
         elif ".gff" in filename:
-            gff_df = GffDataFrame(io.StringIO(decoded.decode('utf-8')))
-            gff_df.to_gff3(save_path)
-            return f'Uploaded {filename}'
+            ingest = ingest_gff
         else:
             raise TypeError('Unexpected file format')
+        decode_upload(contents, upload_path)
+        ingest(upload_path, save_path)
+        return f'Uploaded {filename}'
     except Exception as e:
         print(e)
         return f'Error processing {filename}: {e}'
+    finally:
+        if upload_path.exists():
+            upload_path.unlink()
 
 
 def get_stored_csv_files():
     return list(DATA_PATH.glob('*.csv'))
 
 
-def store_data(string, name, session_id):
-    session_dir = DATA_PATH.joinpath('session_data', session_id)
-    if not session_dir.exists():
-        session_dir.mkdir(parents=True, exist_ok=True)
-        with open(session_dir.joinpath("timestamp.txt"), "w") as text_file:
-            text_file.write(str(time.time()))
-    with open(session_dir.joinpath(f'{name}.json'), 'w') as f:
-        json.dump(string, f)
+def get_session_dir(session_id):
+    """ Return the session data directory, creating it on first use, and record use of the session."""
+    session_dir = SESSION_DATA_PATH.joinpath(session_id)
+    session_dir.mkdir(parents=True, exist_ok=True)
+    session_gc.touch(session_dir)
+    return session_dir
+
+
+def store_data(data, name, session_id):
+    """
+    Store a PIMMSDataFrame, GffDataFrame or pandas dataframe in the session directory with the configured
+    session storage backend.
+    :param data: object to store
+    :param name: dataset name, used again with load_data
+    :param session_id: uuid of session
+    """
+    session_dir = get_session_dir(session_id)
+    write_dataset(data, session_dir.joinpath(name))
+    session_cache.invalidate(session_id, name)
+
+
+def remove_data(name, session_id):
+    """
+    Remove a dataset stored with store_data, if present.
+    :param name: dataset name
+    :param session_id: uuid of session
+    """
+    storage.remove_dataset(get_session_dir(session_id).joinpath(name))
+    session_cache.invalidate(session_id, name)
+
+
+def write_dataset(data, path_stem, store=SESSION_STORE):
+    """
+    Write a PIMMSDataFrame, GffDataFrame or pandas dataframe to a path with a session storage backend, readable
+    with load_data once the path is in a session directory.
+    :param data: object to store
+    :param path_stem: path of the dataset without suffix
+    :param store: name of the session storage backend
+    """
+    if isinstance(data, pd.DataFrame):
+        frame, attributes, kind = data, {}, 'DataFrame'
+    elif type(data).__name__ in SESSION_CLASSES:
+        frame, attributes, kind = data._data, data.get_metadata(), type(data).__name__
+    else:
+        raise TypeError(f"Can not store object of type {type(data).__name__}")
+    storage.get_session_store(store).write(path_stem, frame, attributes, kind)
+
 
 def load_data(name, session_id):
-    session_dir = DATA_PATH.joinpath('session_data', session_id)
-    with open(session_dir.joinpath(f'{name}.json')) as f:
-        data = json.load(f)
-    return data
+    """
+    Load a dataset stored with store_data, restoring it as the class it was stored from.
+    Objects are served from the process level session_cache while the stored dataset is unchanged, they are shared
+    between callbacks and must be treated as read only.
+    :param name: dataset name
+    :param session_id: uuid of session
+    :return: PIMMSDataFrame, GffDataFrame or pandas dataframe
+    """
+    path_stem = SESSION_DATA_PATH.joinpath(session_id, name)
+    session_gc.touch(path_stem.parent)
+    key = (session_id, name, storage.generation(path_stem))
+    obj = session_cache.get(key)
+    if obj is None:
+        frame, metadata = storage.read(path_stem)
+        if metadata['kind'] == 'DataFrame':
+            obj = frame
+        else:
+            obj = SESSION_CLASSES[metadata['kind']].from_data(frame, metadata['attributes'])
+        session_cache.put(key, obj, _object_nbytes(frame))
+    return obj
+
+
+def data_version(session_id, *names):
+    """
+    Version of a set of session datasets, changes whenever any of them is rewritten.
+    :param session_id: uuid of session
+    :param names: dataset names
+    :return: hashable version token
+    """
+    session_dir = SESSION_DATA_PATH.joinpath(session_id)
+    session_gc.touch(session_dir)
+    return tuple(storage.generation(session_dir.joinpath(name)) for name in names)
+
+
+def _object_nbytes(frame):
+    return int(frame.memory_usage(index=True, deep=True).sum())
+
+
+class SessionObjectCache:
+    """
+    Thread safe, byte size bounded LRU cache of deserialised session objects.
+    Keys are (session_id, dataset name, write generation) so a rewritten dataset is never served stale, also when
+    another worker process wrote it. Entries larger than the whole budget are not cached.
+    :param max_bytes: total size budget of cached objects
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, obj, nbytes):
+        with self._lock:
+            if nbytes > self.max_bytes:
+                return
+            # Older generations of the same dataset can not be requested again
+            self._remove(lambda k: k[:2] == key[:2])
+            self._entries[key] = (obj, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+                self.evictions += 1
+
+    def invalidate(self, session_id, name=None):
+        """ Drop cached objects of a session, or only of one dataset if name is given."""
+        with self._lock:
+            self._remove(lambda k: k[0] == session_id and (name is None or k[1] == name))
+
+    def clear(self):
+        with self._lock:
+            self._remove(lambda k: True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, predicate):
+        for key in [k for k in self._entries if predicate(k)]:
+            _, nbytes = self._entries.pop(key)
+            self.nbytes -= nbytes
+
+
+session_cache = SessionObjectCache(SESSION_CACHE_MAX_BYTES)
+
+
+session_sweeper = session_gc.SessionSweeper(SESSION_DATA_PATH, SESSION_TTL, SESSION_MAX_BYTES, SESSIONS_MAX_BYTES,
+                                           SESSION_SWEEP_INTERVAL, idle=SESSION_IDLE)
+
 
 def manage_session_data():
-    data_session_folder = DATA_PATH.joinpath('session_data')
-    if not data_session_folder.exists():
-        data_session_folder.mkdir(parents=True, exist_ok=True)
-    for session_dir in data_session_folder.iterdir():
-        timestamp_path = session_dir.joinpath('timestamp.txt')
-        if not timestamp_path.exists():
-            try:
-                with open(timestamp_path, "w") as text_file:
-                    text_file.write(str(time.time()))
-                continue
-            except:
-                continue
-        with open(timestamp_path, "r") as f:
-            ts = float(f.readlines()[0])
-        time_period = time.time() - float(ts)
-        if time_period > 60*60:
-            shutil.rmtree(session_dir)
+    """ Sweep session data now and start the background sweeper of this process."""
+    session_sweeper.sweep()
+    session_sweeper.start()
+
 
 def combine_hex_values(d):
     d_items = sorted(d.items())
@@ -527,6 +1339,12 @@ def combine_hex_values(d):
     zpad = lambda x: x if len(x)==2 else '0' + x
     return "#" + zpad(hex(red)[2:]) + zpad(hex(green)[2:]) + zpad(hex(blue)[2:])
 
+def hex_to_rgb(hex_color):
+    """ Convert a '#rrggbb' colour to an rgb tuple of floats in [0, 1], as expected by scale_lightness."""
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
 def scale_lightness(rgb, scale_l):
     # convert rgb to hls
     h, l, s = colorsys.rgb_to_hls(*rgb)